@@ -0,0 +1,595 @@
+'''
+Benchmarks for the database app. Run from the app/ directory, ex:
+
+    python3 benchmark.py parse
+    python3 benchmark.py suite --sizes 10000 100000 1000000 --output results.json
+    python3 benchmark.py suite --baseline results.json
+    python3 benchmark.py startup --output startup.json
+    python3 benchmark.py writes --inserts 2000
+    python3 benchmark.py batch --rows 2000 --form-rows 300
+
+suite builds a seeded synthetic database (real formulas, plausible amounts and property distributions) in a
+scratch directory, grows it through each size and times the main operations at every step. Results are JSON;
+with --baseline, medians are compared against a saved run and the exit status is 1 on a regression.
+
+startup times fresh interpreters instead: importing main, and a uvicorn worker from spawn to its first response
+(on a new database and on an existing one), which is what container restarts and scaling out workers wait for. writes counts the statements (round trips
+to SQLite) and time per add_electrolyte, against the baseline's (legacy.py, copied unchanged), and checks
+concurrent submissions. batch posts rows one form request at a time, then all at once to /electrolytes/batch, through
+the test client, and prints the speedup against --target (100x by default) as met or NOT met: with the per-row
+cost trigger and index upkeep SQLite does for every inserted row, the batch path has measured 15-21x here.
+'''
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+import timeit
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime
+
+# the suite works on a throwaway database, never on db/experiment_db.sqlite; has to be set before main is imported
+SCRATCH_DIR = tempfile.mkdtemp(prefix='benchmark_')
+atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+os.environ['DB_PATH'] = os.path.join(SCRATCH_DIR, 'benchmark.sqlite')
+# batch starts the app in process: its startup snapshot and job table go to scratch too, not ./history and ./jobs
+os.environ['SNAPSHOT_DIR'] = os.path.join(SCRATCH_DIR, 'history')
+os.environ['JOBS_DIR'] = os.path.join(SCRATCH_DIR, 'jobs')
+# and no xlsx/Arrow rendering of it in a worker process, which would compete with what's being timed for the CPU
+os.environ.setdefault('SNAPSHOT_XLSX', '0')
+os.environ.setdefault('SNAPSHOT_ARROW', '0')
+
+import main
+from main import Chemical
+import legacy
+
+# formulas that actually show up in the components table
+FORMULAS = ['CaCl2', 'Ca(ClO4)2', 'Ca(PF6)2', 'Ca(BF4)2', 'C4H6O3', 'C2H6OS', 'C4H8O2S', '(CH3)2NCH',
+            'LiPF6', 'Li(CF3SO2)2N', 'Mg(ClO4)2', 'Zn(CF3SO3)2', 'C3H4O3', 'C5H10O3', 'C4H10O2']
+
+def legacy_parse_formula(formula):
+    '''
+    the original recursive, character-at-a-time parser (plus the ELEMENTS.index sort from __str__), kept here
+    so the benchmark has something to compare against.
+    '''
+    elements = Counter()
+    i = 0
+    while i < len(formula):
+        if formula[i] == '(':
+            count = 1
+            for j in range(i + 1, len(formula)):
+                if formula[j] == '(':
+                    count += 1
+                elif formula[j] == ')':
+                    count -= 1
+                    if count == 0:
+                        break
+            else:
+                raise TypeError(f'Unbalanced parentheses in formula {formula}')
+
+            sub_elements = legacy_parse_formula(formula[i + 1:j])
+            i = j + 1
+
+            factor = ''
+            while i < len(formula) and formula[i].isdigit():
+                factor += formula[i]
+                i += 1
+            factor = int(factor) if factor else 1
+            for element, quantity in sub_elements.items():
+                elements[element] += quantity * factor
+        elif formula[i].isalpha():
+            element = formula[i]
+            i += 1
+            while i < len(formula) and formula[i].islower():
+                element += formula[i]
+                i += 1
+            if element not in Chemical.ELEMENTS:
+                raise TypeError(f'Unknown element {element} in formula {formula}')
+            quantity = ''
+            while i < len(formula) and formula[i].isdigit():
+                quantity += formula[i]
+                i += 1
+            quantity = int(quantity) if quantity else 1
+            elements[element] += quantity
+        else:
+            raise TypeError(f'Invalid character {formula[i]} in formula {formula}')
+    return elements
+
+def legacy_canonical(formula):
+    elements = legacy_parse_formula(formula)
+    sorted_elements = sorted(elements.items(), key=lambda x: Chemical.ELEMENTS.index(x[0]))
+    return ''.join(f'{element}{count}' if count > 1 else f'{element}' for element, count in sorted_elements)
+
+def per_formula_us(fn, number):
+    '''
+    microseconds per formula for fn run over every entry in FORMULAS.
+    '''
+    seconds = min(timeit.repeat(lambda: [fn(f) for f in FORMULAS], number=number, repeat=5))
+    return seconds / (number * len(FORMULAS)) * 1e6
+
+def bench_parse(number):
+    for formula in FORMULAS:
+        assert legacy_canonical(formula) == Chemical.canonical(formula), formula
+
+    # the parser itself, under the lru_cache: what a formula the cache hasn't seen costs, without timing cache_clear()
+    uncached = Chemical.compile_formula.__wrapped__
+    results = {
+        'legacy parse + str': per_formula_us(legacy_canonical, number),
+        'tokenizer, uncached': per_formula_us(lambda formula: uncached(formula)[1], number),
+        'cached canonical': per_formula_us(Chemical.canonical, number),
+        'cached Chemical()': per_formula_us(Chemical, number),
+    }
+    for name, us in results.items():
+        print(f'{name:<28}{us:8.2f} us/formula')
+    print(Chemical.compile_formula.cache_info())
+
+# (formula, $/g) and (formula, $/mL), the kind of thing the components table holds
+SALTS = [('CaCl2', .0207), ('Ca(ClO4)2', .244), ('Ca(PF6)2', 18.04), ('Ca(BF4)2', 2.94), ('LiPF6', 3.1),
+         ('Li(CF3SO2)2N', 2.2), ('LiBF4', 1.9), ('LiClO4', .9), ('NaPF6', 4.5), ('Mg(ClO4)2', .55),
+         ('Zn(CF3SO3)2', 1.3), ('Mg(CF3SO2)2N2', 6.0), ('KPF6', 1.2), ('LiNO3', .3), ('NaClO4', .25)]
+SOLVENTS = [('C4H6O3', .03876), ('C2H6OS', .0302), ('C4H8O2S', .0792), ('(CH3)2NCH', .0277), ('C3H4O3', .05),
+            ('C5H10O3', .06), ('C4H10O2', .09), ('C3H6O3', .07), ('C2H3N', .04), ('C4H8O', .03), ('H2O', .001)]
+
+SQL_QUERIES = {
+    'sql filter': 'SELECT * FROM electrolytes WHERE conductivity > 5000 AND temperature BETWEEN 20 AND 30',
+    'sql aggregate': 'SELECT COUNT(*), AVG(conductivity), MAX(viscosity) FROM electrolytes',
+    'sql join': """SELECT e.id, e.conductivity, c.formula, ec.amount FROM electrolytes e
+                   JOIN electrolyte_components ec ON ec.electrolyte_id = e.id
+                   JOIN components c ON c.id = ec.component_id WHERE c.formula = 'LiF6P'""",
+}
+
+def synthetic_electrolytes(rng, count):
+    '''
+    seeded stream of electrolytes in the add_electrolytes format: one or two salts in g, one to three solvents
+    in mL, and properties drawn from roughly the distributions real measurements have (optional ones sometimes
+    missing).
+    '''
+    for _ in range(count):
+        components = {formula: round(rng.uniform(.01, 2), 3) for formula, _ in rng.sample(SALTS, rng.choice((1, 1, 1, 2)))}
+        components.update({formula: round(rng.uniform(.5, 10), 2) for formula, _ in rng.sample(SOLVENTS, rng.choice((1, 2, 2, 3)))})
+        maybe = lambda value: value if rng.random() < .7 else None
+        low = round(rng.uniform(-3.5, -1.5), 2)
+        yield {
+            'components': components,
+            'conductivity': round(rng.lognormvariate(7.5, 1.0), 2), # uS/cm, median ~1800
+            'conduct_uncert_bound': round(rng.uniform(.5, 5), 2),
+            'concent_uncert_bound': round(rng.uniform(.1, 2), 2),
+            'density': maybe(round(rng.gauss(1.2, .1), 3)),
+            'temperature': maybe(round(rng.gauss(25, 8), 1)),
+            'viscosity': maybe(round(rng.lognormvariate(1.0, .6), 3)),
+            'v_window_low_bound': maybe(low),
+            'v_window_high_bound': maybe(round(low + rng.uniform(2, 5), 2)),
+            'surface_tension': maybe(round(rng.gauss(40, 5), 1)),
+        }
+
+def summary(samples):
+    ms = sorted(sample * 1e3 for sample in samples)
+    return {
+        'n': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 4),
+        'p50_ms': round(statistics.median(ms), 4),
+        'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * .95))], 4),
+    }
+
+def timed(fn, calls):
+    '''
+    times fn(*args) for each args in calls, with the helpers' prints swallowed.
+    '''
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for args in calls:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    return summary(samples)
+
+def load(rng, count, chunk=10000):
+    '''
+    grows the database by count electrolytes through the bulk path; returns seconds taken.
+    '''
+    start = time.perf_counter()
+    electrolytes = synthetic_electrolytes(rng, count)
+    while batch := [electrolyte for _, electrolyte in zip(range(chunk), electrolytes)]:
+        main.add_electrolytes(batch)
+    return time.perf_counter() - start
+
+def upload_workbook(rng, rows):
+    '''
+    an /upload_excel/ workbook of rows new electrolytes, laid out like the export.
+    '''
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    components = workbook.create_sheet('components')
+    components.append(['id', 'formula', 'notes', 'molar_mass', 'price', 'is_salt'])
+    ids = {}
+    for i, (formula, price) in enumerate(SALTS + SOLVENTS, start=1):
+        ids[formula] = i
+        components.append([i, formula, None, Chemical.molar_mass_of(formula), price, int(i <= len(SALTS))])
+    electrolytes = workbook.create_sheet('electrolytes')
+    electrolytes.append(['id'] + list(main.ELECTROLYTE_PROPERTIES))
+    electrolyte_components = workbook.create_sheet('electrolyte_components')
+    electrolyte_components.append(['electrolyte_id', 'component_id', 'amount'])
+    for i, electrolyte in enumerate(synthetic_electrolytes(rng, rows), start=1):
+        electrolytes.append([i] + [electrolyte[name] for name in main.ELECTROLYTE_PROPERTIES])
+        for formula, amount in electrolyte['components'].items():
+            electrolyte_components.append([i, ids[formula], amount])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def export_plan():
+    with main.pool.connection() as conn:
+        return main.export.plan_export(conn, main.TABLES)
+
+def export_ndjson():
+    for _ in main._stream_export(main.export.stream_ndjson, export_plan()):
+        pass
+
+def export_xlsx():
+    os.remove(main._export_xlsx(export_plan()))
+
+def bench_size(rng, operations, xlsx_limit, upload_rows):
+    '''
+    one round of timings against the database as it is now. operations: calls per single-row operation.
+    '''
+    with main.pool.connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM electrolytes')]
+    sample_ids = [rng.choice(ids) for _ in range(operations)]
+    compositions = [main.get_components_by_id(electrolyte_id) for electrolyte_id in sample_ids]
+    results = {
+        'get_components_by_id': timed(main.get_components_by_id, [(electrolyte_id,) for electrolyte_id in sample_ids]),
+        'check_electrolyte_exists': timed(main.check_electrolyte_exists, [(components,) for components in compositions]),
+        'add_electrolyte': timed(lambda electrolyte: main.add_electrolyte(electrolyte.pop('components'), **electrolyte),
+                                 [(electrolyte,) for electrolyte in synthetic_electrolytes(rng, operations)]),
+    }
+    for name, sql in SQL_QUERIES.items():
+        results[name] = timed(main.query_service.page, [(sql,)] * max(5, operations // 10))
+    results['export ndjson'] = timed(export_ndjson, [()])
+    if len(ids) <= xlsx_limit:
+        results['export xlsx'] = timed(export_xlsx, [()])
+    workbook = upload_workbook(rng, upload_rows)
+    results[f'upload {upload_rows} rows'] = timed(main.load_excel, [(io.BytesIO(workbook),)])
+    return results
+
+def compare(results, baseline, tolerance):
+    '''
+    prints current vs baseline medians for every (size, operation) in both; returns the regressions, i.e.
+    medians more than tolerance (fraction) slower.
+    '''
+    regressions = []
+    print(f'{"size":>9}  {"operation":<28}{"baseline ms":>12}{"now ms":>12}{"ratio":>8}', file=sys.stderr)
+    for size, operations in results['results'].items():
+        for name, now in operations.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if not before or not before['p50_ms']:
+                continue
+            ratio = now['p50_ms'] / before['p50_ms']
+            flag = ''
+            if ratio > 1 + tolerance:
+                regressions.append({'size': size, 'operation': name, 'baseline_ms': before['p50_ms'], 'now_ms': now['p50_ms'], 'ratio': round(ratio, 3)})
+                flag = '  REGRESSION'
+            print(f'{size:>9}  {name:<28}{before["p50_ms"]:12.3f}{now["p50_ms"]:12.3f}{ratio:8.2f}{flag}', file=sys.stderr)
+    return regressions
+
+def bench_suite(args):
+    main.migrations.migrate(main.DB)
+    rng = random.Random(args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for formula, price in SALTS:
+            main.add_component_type(Chemical(formula, price=price, is_salt=True))
+        for formula, price in SOLVENTS:
+            main.add_component_type(Chemical(formula, price=price))
+
+    results = {
+        'meta': {
+            'seed': args.seed,
+            'sizes': sorted(args.sizes),
+            'operations': args.operations,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'started': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': {},
+    }
+    parse_us = per_formula_us(Chemical.canonical, 200)
+    loaded = 0
+    for size in sorted(args.sizes):
+        with main.pool.connection() as conn:
+            loaded = conn.execute('SELECT COUNT(*) FROM electrolytes').fetchone()[0]
+        load_seconds = load(rng, max(0, size - loaded))
+        print(f'{size} electrolytes loaded in {load_seconds:.1f}s', file=sys.stderr)
+        operations = bench_size(rng, args.operations, args.xlsx_limit, args.upload_rows)
+        operations['bulk load per 1000 rows'] = summary([load_seconds * 1000 / max(1, size - loaded)])
+        operations['Chemical parse (cached)'] = {'n': 1, 'mean_ms': parse_us / 1e3, 'p50_ms': parse_us / 1e3, 'p95_ms': parse_us / 1e3}
+        results['results'][str(size)] = operations
+    main.query_service.close()
+    main.catalog.close()
+    main.pool.close()
+    report(results, args)
+
+def child_env(db_path):
+    '''
+    environment for app processes started by the benchmark: scratch database and snapshot directory.
+    '''
+    return dict(os.environ, DB_PATH=db_path, SNAPSHOT_DIR=os.path.join(SCRATCH_DIR, 'history'))
+
+def import_times(top):
+    '''
+    one python -X importtime run of "import main"; returns (package, cumulative ms) for the packages it loads,
+    slowest first, timed where each was first imported (so numpy or openpyxl showing up here means something
+    imports them eagerly again).
+    '''
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], env=child_env(main.DB),
+                            capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if '.' not in name and name != 'main' and not name.startswith('_'):
+            imports.append((name, int(cumulative) / 1e3))
+    return sorted(imports, key=lambda item: -item[1])[:top]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def first_response(db_path, path, timeout):
+    '''
+    seconds from spawning a uvicorn worker to the first 200 on path.
+    '''
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port)],
+                              env=child_env(db_path), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f'uvicorn exited with status {server.returncode}')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(.005)
+        raise RuntimeError(f'no response from {path} within {timeout}s')
+    finally:
+        server.terminate()
+        server.wait()
+
+def round_trips(fn, electrolytes):
+    '''
+    inserts every electrolyte through fn; returns (statements per insert, timing summary). Statements are what
+    went through the pool's connections plus the catalog's freshness check.
+    '''
+    catalog = main.catalog.stats()
+    statements = main.metrics.sql_latency.count()
+    timing = timed(lambda electrolyte: fn(electrolyte.pop('components'), **electrolyte), [(electrolyte,) for electrolyte in electrolytes])
+    catalog_lookups = sum(main.catalog.stats()[key] - catalog[key] for key in ('hits', 'misses'))
+    return (main.metrics.sql_latency.count() - statements + catalog_lookups) / len(electrolytes), timing
+
+def concurrent_submissions(rng, threads):
+    '''
+    the same composition from every thread at once, then a different one per thread. returns the number of
+    copies of the shared one that got in (should be 1) and of electrolytes whose stored components don't match
+    what was submitted for them (should be 0).
+    '''
+    def submit_all(electrolytes):
+        ids = [None] * len(electrolytes)
+        barrier = threading.Barrier(len(electrolytes))
+
+        def submit(i, electrolyte):
+            barrier.wait()
+            try:
+                ids[i] = main.add_electrolyte(**electrolyte)
+            except ValueError: # already exists
+                pass
+
+        workers = [threading.Thread(target=submit, args=(i, dict(electrolyte))) for i, electrolyte in enumerate(electrolytes)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return ids
+
+    shared = next(synthetic_electrolytes(rng, 1))
+    copies = sum(electrolyte_id is not None for electrolyte_id in submit_all([shared] * threads))
+    distinct = list(synthetic_electrolytes(rng, threads))
+    ids = submit_all(distinct)
+    canonical = lambda components: {Chemical.canonical(formula): amount for formula, amount in components.items()}
+    mismatched = sum(main.get_components_by_id(electrolyte_id) != canonical(electrolyte['components'])
+                     for electrolyte_id, electrolyte in zip(ids, distinct))
+    return copies, mismatched
+
+def seed(rng, size):
+    '''
+    the SALTS and SOLVENTS components plus size electrolytes, on a migrated database.
+    '''
+    main.migrations.migrate(main.DB)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for formula, price in SALTS:
+            main.add_component_type(Chemical(formula, price=price, is_salt=True))
+        for formula, price in SOLVENTS:
+            main.add_component_type(Chemical(formula, price=price))
+    load(rng, size)
+
+def bench_writes(args):
+    rng = random.Random(args.seed)
+    seed(rng, args.size)
+
+    results = {'meta': {'seed': args.seed, 'size': args.size, 'inserts': args.inserts, 'sqlite': sqlite3.sqlite_version,
+                        'started': datetime.now().isoformat(timespec='seconds')}, 'results': {'writes': {}}}
+    for name, fn in (('baseline add_electrolyte', legacy.add_electrolyte), ('add_electrolyte', main.add_electrolyte)):
+        with contextlib.redirect_stdout(io.StringIO()): # the baseline prints every component row
+            statements, timing = round_trips(fn, list(synthetic_electrolytes(rng, args.inserts)))
+        results['meta'][f'{name} statements per insert'] = round(statements, 2)
+        results['results']['writes'][name] = timing
+        print(f'{name:<26}{statements:6.2f} statements{timing["p50_ms"]:10.3f} ms p50', file=sys.stderr)
+
+    copies, mismatched = concurrent_submissions(rng, args.threads)
+    results['meta']['concurrent copies of one composition'] = copies
+    results['meta']['concurrent inserts with wrong components'] = mismatched
+    print(f'{args.threads} threads: {copies} copy of the shared composition, {mismatched} mismatched inserts', file=sys.stderr)
+    main.query_service.close()
+    main.catalog.close()
+    main.pool.close()
+    report(results, args)
+    if copies != 1 or mismatched:
+        sys.exit(1)
+
+def form_fields(electrolyte):
+    '''
+    the /input_electrolyte/ form for one synthetic electrolyte, blanks for the missing optional properties.
+    '''
+    fields = {name: '' if electrolyte[name] is None else electrolyte[name] for name in main.ELECTROLYTE_PROPERTIES}
+    fields['component_types'] = ' '.join(electrolyte['components'])
+    fields['amounts'] = ' '.join(map(str, electrolyte['components'].values()))
+    return fields
+
+def bench_batch(args):
+    from fastapi.testclient import TestClient
+
+    rng = random.Random(args.seed)
+    seed(rng, args.size)
+    form = [form_fields(electrolyte) for electrolyte in synthetic_electrolytes(rng, args.form_rows)]
+    batch = list(synthetic_electrolytes(rng, args.rows))
+    with TestClient(main.app) as client, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for fields in form:
+            redirect = client.post('/input_electrolyte/', data=fields, follow_redirects=False)
+            assert 'Success' in redirect.headers['location'], redirect.headers['location'] # errors redirect too
+        form_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        response = client.post('/electrolytes/batch', json=batch)
+        batch_seconds = time.perf_counter() - start
+    assert response.status_code == 200 and response.json()['inserted'] == len(batch), response.text[:200]
+
+    form_rate, batch_rate = len(form) / form_seconds, len(batch) / batch_seconds
+    speedup = batch_rate / form_rate
+    results = {'meta': {'seed': args.seed, 'size': args.size, 'form rows': len(form), 'batch rows': len(batch),
+                        'sqlite': sqlite3.sqlite_version, 'started': datetime.now().isoformat(timespec='seconds'),
+                        'form rows/s': round(form_rate, 1), 'batch rows/s': round(batch_rate, 1),
+                        'speedup x': round(speedup, 1), 'target x': args.target, 'meets target': speedup >= args.target},
+               'results': {'batch': {'form row': summary([form_seconds / len(form)]), 'batch row': summary([batch_seconds / len(batch)])}}}
+    print(f'form {form_rate:8.0f} rows/s, batch {batch_rate:8.0f} rows/s: {speedup:.0f}x the form path, '
+          f'target {args.target:.0f}x {"met" if speedup >= args.target else "NOT met"}', file=sys.stderr)
+    report(results, args)
+
+def bench_startup(args):
+    def spawn_import():
+        subprocess.run([sys.executable, '-c', 'import main'], env=child_env(main.DB), check=True)
+
+    def new_database():
+        path = os.path.join(SCRATCH_DIR, f'startup_{time.perf_counter_ns()}.sqlite')
+        return first_response(path, args.path, args.timeout)
+
+    existing = os.path.join(SCRATCH_DIR, 'startup_existing.sqlite')
+    first_response(existing, args.path, args.timeout) # schema and backfills done once, so later starts find them
+    results = {
+        'meta': {
+            'repeat': args.repeat,
+            'path': args.path,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'slowest imports ms': dict(import_times(args.top)),
+        },
+        'results': {'startup': {
+            'import main': timed(spawn_import, [()] * args.repeat),
+            'first response, new database': timed(new_database, [()] * args.repeat),
+            'first response, existing database': timed(lambda: first_response(existing, args.path, args.timeout), [()] * args.repeat),
+        }},
+    }
+    for name, ms in results['meta']['slowest imports ms'].items():
+        print(f'{name:<40}{ms:10.1f} ms', file=sys.stderr)
+    report(results, args)
+
+def report(results, args):
+    '''
+    writes the JSON to args.output (or stdout) and, with args.baseline, exits 1 on a regression.
+    '''
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) over {args.tolerance:.0%}', file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parse = subparsers.add_parser('parse', help='per-formula cost of Chemical parsing, before and after memoization')
+    parse.add_argument('--number', type=int, default=2000)
+    suite = subparsers.add_parser('suite', help='synthetic database at several sizes, JSON timings of the main operations')
+    suite.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='electrolyte counts, ex: 10000 100000 1000000')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--operations', type=int, default=200, help='calls per single-row operation')
+    suite.add_argument('--upload-rows', type=int, default=1000)
+    suite.add_argument('--xlsx-limit', type=int, default=200000, help='skip the xlsx export above this many electrolytes')
+    suite.add_argument('--output', help='write the JSON here instead of stdout')
+    suite.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    suite.add_argument('--tolerance', type=float, default=.2, help='slowdown (fraction of the baseline median) that counts as a regression')
+    startup = subparsers.add_parser('startup', help='import time and time from spawning a worker to its first response')
+    startup.add_argument('--repeat', type=int, default=5, help='fresh processes per measurement')
+    startup.add_argument('--path', default='/', help='request that counts as the first response')
+    startup.add_argument('--top', type=int, default=10, help='slowest top-level imports to report')
+    startup.add_argument('--timeout', type=float, default=60, help='seconds to wait for a worker to answer')
+    startup.add_argument('--output', help='write the JSON here instead of stdout')
+    startup.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    startup.add_argument('--tolerance', type=float, default=.2, help='slowdown (fraction of the baseline median) that counts as a regression')
+    writes = subparsers.add_parser('writes', help='statements and time per add_electrolyte, before and after, plus concurrent submissions')
+    writes.add_argument('--size', type=int, default=10000, help='electrolytes in the database before timing')
+    writes.add_argument('--inserts', type=int, default=1000, help='add_electrolyte calls per implementation')
+    writes.add_argument('--threads', type=int, default=8, help='concurrent submitters')
+    writes.add_argument('--seed', type=int, default=0)
+    writes.add_argument('--output', help='write the JSON here instead of stdout')
+    writes.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    writes.add_argument('--tolerance', type=float, default=.2, help='slowdown (fraction of the baseline median) that counts as a regression')
+    batch = subparsers.add_parser('batch', help='rows/s through /electrolytes/batch against one form POST per row')
+    batch.add_argument('--size', type=int, default=10000, help='electrolytes in the database before timing')
+    batch.add_argument('--rows', type=int, default=2000, help='electrolytes in the one batch request')
+    batch.add_argument('--form-rows', type=int, default=300, help='electrolytes posted through the form, one request each')
+    batch.add_argument('--target', type=float, default=100, help='speedup over the form path the batch endpoint is meant to reach')
+    batch.add_argument('--seed', type=int, default=0)
+    batch.add_argument('--output', help='write the JSON here instead of stdout')
+    batch.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    batch.add_argument('--tolerance', type=float, default=.2, help='slowdown (fraction of the baseline median) that counts as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        bench_parse(args.number)
+    elif args.command == 'suite':
+        bench_suite(args)
+    elif args.command == 'startup':
+        bench_startup(args)
+    elif args.command == 'writes':
+        bench_writes(args)
+    elif args.command == 'batch':
+        bench_batch(args)
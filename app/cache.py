@@ -0,0 +1,118 @@
+'''
+In-process cache of response bodies, keyed on the request and the database version. The version moves whenever
+anything commits to the database: PRAGMA data_version on the cache's own read-only connection catches commits
+from every other connection (other processes included), and the app's write helpers also call invalidate().
+A version change drops every cached body, and the size-bounded LRU drops the least recently used ones when the
+total goes over max_bytes.
+
+ETags are derived from the key and the version (plus a per-process nonce, so a restart can't validate a tag from
+before it), not from the body, so a matching If-None-Match can be answered with 304 without computing anything.
+That only holds for responses that are a function of the database contents alone; callers keep requests whose
+result also depends on something else (random(), the clock) out.
+'''
+
+import hashlib
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    '''
+    cache = ResponseCache(DB, max_bytes=64 * 2**20)
+    version = cache.version()                 # before computing anything
+    cache.etag(key, version) -> '"<hex>"'
+    cache.get(key, version) -> body or None
+    cache.put(key, version, body)
+    '''
+    def __init__(self, db_path, max_bytes=64 * 2**20, max_entry_bytes=8 * 2**20):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes # bigger bodies are never cached, so one export can't flush the rest
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._nonce = secrets.token_hex(8)
+        self._generation = 0
+        self._data_version = None
+        self._entries = OrderedDict() # (key, generation) -> body, least recently used first
+        self._size = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        return self._conn
+
+    def _clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._size = 0
+
+    def version(self):
+        '''
+        the current version; read it before computing a response, so a commit that lands meanwhile makes the
+        stored body unreachable instead of serving it as newer than it is.
+        '''
+        with self._lock:
+            data_version = self._connection().execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._clear()
+            return self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def etag(self, key, version):
+        return '"' + hashlib.sha1(f'{self._nonce}:{version}:{key}'.encode()).hexdigest() + '"'
+
+    def matches(self, if_none_match, etag):
+        '''
+        whether an If-None-Match header value covers etag; counts the 304s it allows.
+        '''
+        if not if_none_match:
+            return False
+        # weak comparison, as If-None-Match calls for: W/"x" and "x" match
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if '*' in tags or etag.removeprefix('W/') in tags:
+            with self._lock:
+                self.not_modified += 1
+            return True
+        return False
+
+    def get(self, key, version):
+        with self._lock:
+            body = self._entries.get((key, version))
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((key, version))
+            self.hits += 1
+            return body
+
+    def put(self, key, version, body):
+        with self._lock:
+            if version != self._generation or len(body) > self.max_entry_bytes:
+                return
+            previous = self._entries.pop((key, version), None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[(key, version)] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "not_modified": self.not_modified,
+                    "entries": len(self._entries), "bytes": self._size}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,91 @@
+'''
+In-process read-through cache of the components table, keyed by canonical formula and by id. It is loaded once,
+and before every lookup it asks its own connection for PRAGMA data_version, which only moves when some other
+connection has committed. When it moved, the components_version counter (bumped by triggers on components, see
+migrations.py) says whether the catalog itself changed, so electrolyte inserts don't cause reloads. The app's
+own write paths also call invalidate() directly.
+'''
+
+import sqlite3
+import threading
+
+COLUMNS = ('id', 'formula', 'notes', 'molar_mass', 'price', 'is_salt')
+
+class ComponentCatalog:
+    '''
+    catalog = ComponentCatalog(DB)
+    catalog.ids(['Cl2Ca', 'H6C4O3']) -> {'Cl2Ca': 1, 'H6C4O3': 2}, unknown formulas left out
+    catalog.get('Cl2Ca') / catalog.get_by_id(1) -> {"id", "formula", "notes", ...} or None
+    '''
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0 # lookups that had to (re)load the catalog first
+        self._conn = None
+        self._data_version = None
+        self._catalog_version = None
+        self._by_formula = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        return self._conn
+
+    def _version(self, conn):
+        try:
+            return conn.execute('SELECT version FROM components_version').fetchone()
+        except sqlite3.OperationalError: # database from before the counter existed: any commit counts
+            return None
+
+    def _fresh(self):
+        conn = self._connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            self.hits += 1
+            return
+        self._data_version = data_version
+        catalog_version = self._version(conn)
+        if catalog_version is not None and catalog_version == self._catalog_version:
+            self.hits += 1
+            return
+
+        self.misses += 1
+        with conn: # one read transaction, so the rows and the counter agree
+            conn.execute('BEGIN')
+            self._catalog_version = self._version(conn)
+            rows = conn.execute(f'SELECT {", ".join(COLUMNS)} FROM components ORDER BY id').fetchall()
+        self._by_id = {row[0]: dict(zip(COLUMNS, row)) for row in rows}
+        self._by_formula = {}
+        for row in self._by_id.values():
+            self._by_formula.setdefault(row['formula'], row) # the lowest id wins on duplicate formulas, like the old queries
+
+    def invalidate(self):
+        with self._lock:
+            self._data_version = self._catalog_version = None
+
+    def ids(self, formulas):
+        with self._lock:
+            self._fresh()
+            return {formula: self._by_formula[formula]['id'] for formula in formulas if formula in self._by_formula}
+
+    def get(self, formula):
+        with self._lock:
+            self._fresh()
+            return self._by_formula.get(formula)
+
+    def get_by_id(self, component_id):
+        with self._lock:
+            self._fresh()
+            return self._by_id.get(component_id)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._by_id)}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
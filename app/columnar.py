@@ -0,0 +1,143 @@
+'''
+Columnar copies of the database for analysis: every table, plus a denormalized "wide" table with one row per
+electrolyte and one column per component amount, written as Arrow IPC files (uncompressed, so they can be
+memory-mapped with zero copies) or Parquet (smaller, for downloads). Columns keep their SQLite types, rows are
+read and written in chunks, so memory stays flat.
+
+In a notebook:
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map('wide.arrow')).read_all() # or columnar.load('wide.arrow')
+'''
+
+import os
+import tempfile
+
+CHUNK_ROWS = 10000
+WIDE = 'wide'
+
+FORMATS = {
+    # format: (media type, file extension)
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _type(declared):
+    import pyarrow as pa
+
+    # SQLite's type affinity rules, roughly
+    declared = (declared or '').upper()
+    if 'INT' in declared:
+        return pa.int64()
+    if any(name in declared for name in ('CHAR', 'CLOB', 'TEXT')):
+        return pa.string()
+    return pa.float64()
+
+def table_schema(conn, table):
+    import pyarrow as pa
+
+    return pa.schema([(name, _type(declared)) for _, name, declared, *_ in conn.execute(f'PRAGMA table_info({_quote(table)})')])
+
+def iter_table(conn, table, chunk_rows=CHUNK_ROWS):
+    '''
+    (schema, iterator of record batches) for one table, in rowid order.
+    '''
+    import pyarrow as pa
+
+    schema = table_schema(conn, table)
+
+    def batches():
+        c = conn.execute(f'SELECT {", ".join(_quote(name) for name in schema.names)} FROM {_quote(table)}')
+        while rows := c.fetchmany(chunk_rows):
+            yield pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)], schema=schema)
+    return schema, batches()
+
+def iter_wide(conn, properties, chunk_rows=CHUNK_ROWS):
+    '''
+    (schema, iterator of record batches) for the wide table: id, the electrolyte properties, then one float
+    column per component in use, named by formula, holding the amount (null where the component isn't in it).
+    '''
+    import pyarrow as pa
+
+    components = conn.execute('''SELECT id, formula FROM components
+                                 WHERE id IN (SELECT component_id FROM electrolyte_components) ORDER BY id''').fetchall()
+    names, position, taken = [], {}, {'id', *properties}
+    for component_id, formula in components:
+        name = formula if formula not in taken else f'{formula}#{component_id}' # duplicate formulas stay apart
+        taken.add(name)
+        position[component_id] = len(names)
+        names.append(name)
+    schema = pa.schema([('id', pa.int64())] + [(name, pa.float64()) for name in properties] + [(name, pa.float64()) for name in names])
+
+    def batches():
+        last_id = None
+        while True:
+            rows = conn.execute(f'''SELECT id, {", ".join(properties)} FROM electrolytes
+                                    {"WHERE id > ?" if last_id is not None else ""} ORDER BY id LIMIT ?''',
+                                ([last_id] if last_id is not None else []) + [chunk_rows]).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            row_of = {row[0]: i for i, row in enumerate(rows)}
+            amounts = [[None] * len(rows) for _ in names]
+            for electrolyte_id, component_id, amount in conn.execute(
+                    'SELECT electrolyte_id, component_id, amount FROM electrolyte_components WHERE electrolyte_id BETWEEN ? AND ?',
+                    (rows[0][0], last_id)):
+                if electrolyte_id in row_of and component_id in position:
+                    amounts[position[component_id]][row_of[electrolyte_id]] = amount
+            columns = list(zip(*rows)) + amounts
+            yield pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+    return schema, batches()
+
+def write(schema, batches, path, format='arrow', progress=None):
+    '''
+    streams batches into one file; arrow is the IPC file format, uncompressed so it can be memory-mapped.
+    progress(rows) is called after every batch with the number of rows in it.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if format == 'arrow':
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                if progress is not None:
+                    progress(batch.num_rows)
+    elif format == 'parquet':
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                if progress is not None:
+                    progress(batch.num_rows)
+    else:
+        raise ValueError(f"Unknown format {format}; choose from {', '.join(FORMATS)}")
+
+def export(conn, table, properties, path, format='arrow', chunk_rows=CHUNK_ROWS, progress=None):
+    '''
+    writes one table (or WIDE) to path.
+    '''
+    schema, batches = iter_wide(conn, properties, chunk_rows) if table == WIDE else iter_table(conn, table, chunk_rows)
+    write(schema, batches, path, format, progress)
+
+def export_tempfile(conn, table, properties, format='arrow'):
+    '''
+    like export.xlsx_tempfile: a fresh temp file the caller deletes when done.
+    '''
+    fd, path = tempfile.mkstemp(suffix=f'.{FORMATS[format][1]}', prefix=f'{table}_')
+    os.close(fd)
+    try:
+        export(conn, table, properties, path, format)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def load(path):
+    '''
+    memory-maps an arrow file and returns its pyarrow Table without copying the column buffers.
+    '''
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
@@ -0,0 +1,63 @@
+'''
+pytest setup. main reads its paths from the environment when it is imported, so they are pointed at a scratch
+directory before any test imports it. Run from app/: python -m pytest -q
+'''
+
+import os
+import tempfile
+
+import pytest
+
+SCRATCH = tempfile.mkdtemp(prefix='alec-tests-')
+os.environ['DB_PATH'] = os.path.join(SCRATCH, 'experiment_db.sqlite')
+os.environ['JOBS_DIR'] = os.path.join(SCRATCH, 'jobs')
+os.environ['SNAPSHOT_DIR'] = os.path.join(SCRATCH, 'history')
+
+# children first, foreign keys are enforced
+TABLES = ('electrolyte_fingerprints', 'electrolyte_costs', 'electrolyte_components', 'electrolytes',
+          'component_elements', 'components')
+
+@pytest.fixture
+def db_path(tmp_path):
+    '''
+    a fresh database file at the latest schema version.
+    '''
+    import migrations
+
+    path = str(tmp_path / 'db.sqlite')
+    migrations.migrate(path)
+    return path
+
+@pytest.fixture
+def app_db():
+    '''
+    the main module, its database migrated and emptied and its in-process caches dropped.
+    '''
+    import main
+    import migrations
+
+    migrations.migrate(main.DB)
+    with main.pool.transaction() as conn:
+        for table in TABLES:
+            conn.execute(f'DELETE FROM {table}')
+    main._invalidate_caches()
+    return main
+
+@pytest.fixture(scope='session')
+def client():
+    '''
+    a TestClient for the whole session: its shutdown stops the app's executors for good.
+    '''
+    import main
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        yield client
+
+def add_components(main, *formulas):
+    '''
+    adds formulas (the first one a salt) to the catalog; returns canonical formula -> component id.
+    '''
+    for i, formula in enumerate(formulas):
+        main.add_component_type(main.Chemical(formula, price=1.0 + i, is_salt=(i == 0)))
+    return main.catalog.ids({main.Chemical.canonical(formula) for formula in formulas})
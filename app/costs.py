@@ -0,0 +1,78 @@
+'''
+Materialized electrolyte costs. electrolyte_costs holds one row per electrolyte, computed from its component
+amounts and the components' price and molar mass; triggers on components and electrolyte_components (see
+migrations.py) delete the rows of exactly the electrolytes a write affects, whoever makes it, and put their ids
+in electrolyte_costs_dirty, which refresh() drains in vectorized batches.
+
+cost = sum(amount * price), in $ since amounts are g (salts) or mL (solvents) and prices $/g or $/mL
+salt_moles = sum(amount / molar_mass) over the salts, so cost / salt_moles is the price per mole of salt
+complete = 0 when a price (or a salt's molar mass) is missing and the numbers undercount
+'''
+
+from database import transaction
+
+CHUNK_ELECTROLYTES = 5000
+
+def _compute(rows):
+    '''
+    rows: (electrolyte_id, amount, price, molar_mass, is_salt), several per electrolyte, NULLs allowed.
+    returns [(electrolyte_id, cost, salt_moles, complete), ...]
+    '''
+    import numpy as np
+
+    ids, amount, price, molar_mass, is_salt = (np.array(column, dtype=float) for column in zip(*rows))
+    electrolyte_ids, index = np.unique(ids, return_inverse=True)
+    has_component = ~np.isnan(amount)
+    salt = has_component & (np.nan_to_num(is_salt) != 0)
+    amount = np.nan_to_num(amount)
+
+    line_cost = amount * price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        line_moles = np.where(salt, amount / molar_mass, 0.0)
+    missing = has_component & (np.isnan(line_cost) | np.isinf(line_moles) | np.isnan(line_moles))
+
+    cost = np.bincount(index, np.nan_to_num(line_cost, posinf=0.0, neginf=0.0), len(electrolyte_ids))
+    salt_moles = np.bincount(index, np.nan_to_num(line_moles, posinf=0.0, neginf=0.0), len(electrolyte_ids))
+    incomplete = np.bincount(index, missing, len(electrolyte_ids)) > 0
+    return list(zip(electrolyte_ids.astype(int).tolist(), cost.tolist(), salt_moles.tolist(), (~incomplete).astype(int).tolist()))
+
+# the first chunk of the dirty list; the same rows every time it's read inside one write transaction
+DIRTY_CHUNK = 'SELECT electrolyte_id FROM electrolyte_costs_dirty ORDER BY electrolyte_id LIMIT ?'
+
+def refresh(conn, chunk_electrolytes=CHUNK_ELECTROLYTES):
+    '''
+    recomputes the rows of the electrolytes on the dirty list, chunk_electrolytes at a time, each chunk in its
+    own write transaction so the inputs can't change between reading and storing. Checks the list with a plain
+    read first, so with nothing to do it never takes the write lock. returns the number computed.
+    '''
+    computed = 0
+    while conn.execute('SELECT 1 FROM electrolyte_costs_dirty LIMIT 1').fetchone() is not None:
+        with transaction(conn, immediate=True):
+            rows = conn.execute(f'''SELECT e.id, ec.amount, c.price, c.molar_mass, c.is_salt
+                                    FROM electrolytes e
+                                    LEFT JOIN electrolyte_components ec ON ec.electrolyte_id = e.id
+                                    LEFT JOIN components c ON c.id = ec.component_id
+                                    WHERE e.id IN ({DIRTY_CHUNK})''', (chunk_electrolytes,)).fetchall()
+            results = _compute(rows) if rows else [] # deleted electrolytes just leave the list
+            conn.executemany('INSERT OR REPLACE INTO electrolyte_costs (electrolyte_id, cost, salt_moles, complete) VALUES (?, ?, ?, ?)', results)
+            conn.execute(f'DELETE FROM electrolyte_costs_dirty WHERE electrolyte_id IN ({DIRTY_CHUNK})', (chunk_electrolytes,))
+            computed += len(results)
+    return computed
+
+COSTS_PAGE = '''SELECT ec.electrolyte_id, ec.cost, ec.salt_moles, ec.complete, e.conductivity
+                FROM electrolyte_costs ec JOIN electrolytes e ON e.id = ec.electrolyte_id
+                WHERE ec.electrolyte_id > ? ORDER BY ec.electrolyte_id LIMIT ?'''
+
+def read(conn, after=0, limit=1000):
+    '''
+    one page of costs in id order, next to conductivity for cost-versus-performance plots.
+    '''
+    rows = conn.execute(COSTS_PAGE, (after, limit)).fetchall()
+    return [{
+        "id": electrolyte_id,
+        "cost": cost,
+        "salt_moles": salt_moles,
+        "cost_per_mol_salt": cost / salt_moles if salt_moles else None,
+        "complete": bool(complete),
+        "conductivity": conductivity,
+    } for electrolyte_id, cost, salt_moles, complete, conductivity in rows]
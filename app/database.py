@@ -0,0 +1,182 @@
+'''
+Pooled sqlite3 connections for the app, plus the executor that keeps blocking database work off the event
+loop. Connections are opened once, tuned once, and handed back out instead of paying for sqlite3.connect on
+every helper call.
+'''
+
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# applied once per connection, right after it is opened
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL', # readers don't block the writer and vice versa
+    'PRAGMA synchronous=NORMAL', # safe with WAL, skips an fsync per commit
+    'PRAGMA cache_size=-65536', # 64 MiB page cache (negative means KiB)
+    'PRAGMA mmap_size=268435456', # 256 MiB memory-mapped reads
+    'PRAGMA foreign_keys=ON',
+    'PRAGMA temp_store=MEMORY',
+)
+
+# for mode=ro connections: journal mode can't be changed from them, and query_only refuses writes even if the
+# file happens to be writable
+READ_ONLY_PRAGMAS = (
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA query_only=ON',
+)
+
+_task = threading.local()
+
+def current_task():
+    '''
+    name of the helper the DatabaseExecutor is running on this thread (None elsewhere), for tagging statement
+    timings.
+    '''
+    return getattr(_task, 'name', None)
+
+@contextmanager
+def transaction(conn, immediate=False):
+    '''
+    runs the block in one transaction on an already checked-out connection. immediate takes the write lock up
+    front, so read-then-write sequences (check for duplicates, then insert) can't interleave with another writer.
+    '''
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    if conn.in_transaction: # the block may have committed on its own
+        conn.commit()
+
+class ConnectionPool:
+    '''
+    Thread-safe pool of sqlite3 connections to one database file. At most max_size connections are ever open;
+    callers past that wait (up to timeout seconds) for one to be released. guard, if set, is called before every
+    checkout and raises to refuse it, ex: to keep a pool to the threads it was sized for. setup, if given, is
+    called with every new connection once its pragmas have run, ex: to install an authorizer.
+
+    with pool.connection() as conn:       # autocommit, for reads
+        ...
+    with pool.transaction() as conn:      # BEGIN ... COMMIT, ROLLBACK on any exception
+        ...
+    '''
+    def __init__(self, path, max_size=8, timeout=30.0, uri=False, pragmas=PRAGMAS, cached_statements=128, factory=sqlite3.Connection,
+                 setup=None):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.uri = uri
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements # per-connection LRU of prepared statements
+        self.factory = factory # connection class, ex: metrics.TimedConnection
+        self.setup = setup
+        self.guard = None
+        self._idle = queue.LifoQueue() # most recently used first, so hot connections keep their caches warm
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _connect(self):
+        # isolation_level=None: no implicit transactions, transaction() issues BEGIN/COMMIT itself
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False, uri=self.uri,
+                               cached_statements=self.cached_statements, factory=self.factory)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    def acquire(self):
+        if self.guard is not None:
+            self.guard()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.max_size:
+                self._opened += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f'No database connection available after {self.timeout}s') from None
+
+    def release(self, conn):
+        if conn.in_transaction: # never hand out a connection with someone else's half-finished work
+            conn.rollback()
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        '''
+        closes a connection instead of returning it to the pool, ex: after it was interrupted.
+        '''
+        conn.close()
+        with self._lock:
+            self._opened -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        '''
+        checks out a connection and runs the block in one transaction on it, see transaction().
+        '''
+        with self.connection() as conn, transaction(conn, immediate):
+            yield conn
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+class DatabaseExecutor:
+    '''
+    Runs blocking sqlite3/spreadsheet work off the event loop. Two bounded thread pools: 'light' for the small form
+    reads/writes, 'heavy' for exports, uploads and ad-hoc SQL, so a slow export can only tie up the heavy
+    workers and the form pages keep being served.
+
+    result = await executor.run(add_electrolyte, components, ...)
+    await executor.run(write_tables_xlsx, path, heavy=True)
+    await executor.run(query_service.page, sql, task='execute_sql') # task: name for current_task(), default fn.__name__
+    '''
+    def __init__(self, max_workers=4, max_heavy_workers=2):
+        self.max_workers = max_workers
+        self.max_heavy_workers = max_heavy_workers
+        self._light = ThreadPoolExecutor(max_workers, thread_name_prefix='db')
+        self._heavy = ThreadPoolExecutor(max_heavy_workers, thread_name_prefix='db-heavy')
+
+    async def run(self, fn, *args, heavy=False, task=None, **kwargs):
+        name = task or getattr(fn, '__name__', 'unknown')
+
+        def call():
+            _task.name = name
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _task.name = None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._heavy if heavy else self._light, call)
+
+    def shutdown(self):
+        self._light.shutdown(wait=True)
+        self._heavy.shutdown(wait=True)
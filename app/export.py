@@ -0,0 +1,128 @@
+'''
+Streaming exports of the database tables. Rows come straight off a cursor in fixed-size chunks, so memory stays
+flat no matter how big the tables get, and every request writes to its own buffer or temp file.
+'''
+
+import csv
+import io
+import json
+import os
+import tempfile
+
+CHUNK_ROWS = 1000
+
+FORMATS = {
+    # format: (media type, file extension)
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+def plan_export(conn, allowed_tables, tables=None, columns=None):
+    '''
+    works out which columns of which tables an export covers, and checks every name against the schema before
+    anything is streamed (names end up in SQL, so only known tables/columns get through).
+    tables: comma-separated table names, default all of allowed_tables
+    columns: comma-separated column names, either bare ('formula') or qualified ('components.formula')
+    returns [(table, [column, ...]), ...]; raises ValueError on unknown names.
+    '''
+    tables = _split(tables) or list(allowed_tables)
+    unknown = [table for table in tables if table not in allowed_tables]
+    if unknown:
+        raise ValueError(f"Unknown table(s) {', '.join(unknown)}; choose from {', '.join(allowed_tables)}")
+
+    requested = _split(columns)
+    matched = set()
+    plan = []
+    for table in tables:
+        table_columns = [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')]
+        if requested:
+            selected = []
+            for column in table_columns:
+                for name in (column, f'{table}.{column}'):
+                    if name in requested:
+                        matched.add(name)
+                        if column not in selected:
+                            selected.append(column)
+            if not selected:
+                continue
+            table_columns = selected
+        plan.append((table, table_columns))
+
+    unmatched = [name for name in requested if name not in matched]
+    if unmatched:
+        raise ValueError(f"Unknown column(s) {', '.join(unmatched)} for table(s) {', '.join(tables)}")
+    return plan
+
+def iter_chunks(conn, table, columns, chunk_rows=CHUNK_ROWS):
+    '''
+    yields lists of row tuples, at most chunk_rows at a time, in rowid order.
+    '''
+    c = conn.cursor()
+    c.execute(f'SELECT {", ".join(_quote(column) for column in columns)} FROM {_quote(table)}')
+    while True:
+        rows = c.fetchmany(chunk_rows)
+        if not rows:
+            break
+        yield rows
+
+def stream_csv(conn, plan, chunk_rows=CHUNK_ROWS):
+    '''
+    csv has no notion of sheets, so this takes a plan with exactly one table. yields encoded chunks.
+    '''
+    (table, columns), = plan
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in iter_chunks(conn, table, columns, chunk_rows):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def stream_ndjson(conn, plan, chunk_rows=CHUNK_ROWS):
+    '''
+    one JSON object per line, tagged with its table: {"table": "components", "id": 1, "formula": "CaCl2", ...}
+    '''
+    for table, columns in plan:
+        for rows in iter_chunks(conn, table, columns, chunk_rows):
+            yield ''.join(json.dumps({'table': table, **dict(zip(columns, row))}) + '\n' for row in rows).encode()
+
+def write_xlsx(conn, plan, path, chunk_rows=CHUNK_ROWS, progress=None):
+    '''
+    writes one sheet per table using openpyxl's write-only mode, which streams rows to disk instead of building
+    the whole workbook in memory. progress(rows) is called after every chunk with the number of rows in it.
+    '''
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for table, columns in plan:
+        sheet = workbook.create_sheet(title=table)
+        sheet.append(columns)
+        for rows in iter_chunks(conn, table, columns, chunk_rows):
+            for row in rows:
+                sheet.append(row)
+            if progress is not None:
+                progress(len(rows))
+    workbook.save(path)
+
+def xlsx_tempfile(conn, plan, chunk_rows=CHUNK_ROWS):
+    '''
+    writes the workbook to a fresh temp file and returns its path; the caller deletes it when done.
+    '''
+    fd, path = tempfile.mkstemp(suffix='.xlsx', prefix='export_')
+    os.close(fd)
+    try:
+        write_xlsx(conn, plan, path, chunk_rows)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,259 @@
+'''
+Import of uploaded workbooks laid out like the /download_excel/ export: one sheet per table, header row first.
+
+Sheets are streamed in chunks into per-connection staging tables, then checked and merged into the live tables
+in one transaction: formulas are canonicalized, component and electrolyte ids are remapped onto the database's
+own, and compositions that already exist are skipped. Nothing is written unless the whole merge succeeds, and
+the caller gets back a report of what was inserted, skipped or rejected.
+'''
+
+from collections import Counter
+
+from database import transaction
+
+CHUNK_ROWS = 1000
+MAX_ISSUES = 200 # rows listed individually in the report; the counts always cover everything
+IMPORT_ORDER = ('components', 'electrolytes', 'electrolyte_components') # parents before children
+
+class ImportReport:
+    def __init__(self):
+        self.counts = {table: Counter() for table in IMPORT_ORDER}
+        self.issues = []
+        self.ignored = []
+
+    def record(self, table, status, row=None, reason=None):
+        self.counts[table][status] += 1
+        if reason is not None and len(self.issues) < MAX_ISSUES:
+            self.issues.append({"sheet": table, "row": row, "status": status, "reason": reason})
+
+    def as_dict(self):
+        return {
+            **{table: {status: counts[status] for status in ('inserted', 'skipped', 'rejected')} for table, counts in self.counts.items()},
+            "issues": self.issues,
+            "ignored": self.ignored,
+        }
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+def _number(value, integer=False):
+    '''
+    spreadsheet cell -> int/float/None; raises ValueError for anything that isn't a number.
+    '''
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str) and value.strip().upper() in ('TRUE', 'FALSE'):
+        return int(value.strip().upper() == 'TRUE')
+    number = float(value)
+    if integer:
+        if not number.is_integer():
+            raise ValueError(f'{value!r} is not a whole number')
+        return int(number)
+    return number
+
+def stage_workbook(conn, file, report, chunk_rows=CHUNK_ROWS):
+    '''
+    copies the known sheets into temp.staging_<table>, chunk_rows rows at a time, with an extra _row column
+    holding the spreadsheet row number. Values are staged as-is; checking happens during the merge.
+    '''
+    from openpyxl import load_workbook
+
+    for table in IMPORT_ORDER:
+        conn.execute(f'DROP TABLE IF EXISTS temp.staging_{table}')
+        conn.execute(f'CREATE TEMP TABLE staging_{table} (_row INTEGER, {", ".join(_columns(conn, table))})')
+
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except Exception as e:
+        raise ValueError(f'Could not read workbook: {e}') from e
+    try:
+        for sheet in workbook.worksheets:
+            table = sheet.title
+            if table not in IMPORT_ORDER:
+                report.ignored.append(f'sheet {table}')
+                continue
+            columns = _columns(conn, table)
+            rows = sheet.iter_rows(values_only=True)
+            positions = {}
+            for i, name in enumerate(next(rows, None) or ()):
+                name = str(name).strip() if name is not None else ''
+                if name in columns and name not in positions:
+                    positions[name] = i
+                elif name:
+                    report.ignored.append(f'column {table}.{name}')
+
+            insert = f'INSERT INTO staging_{table} (_row{"".join(", " + name for name in positions)}) VALUES (?{", ?" * len(positions)})'
+            chunk = []
+            for row_number, values in enumerate(rows, start=2):
+                if all(value is None for value in values):
+                    continue
+                chunk.append((row_number,) + tuple(values[i] if i < len(values) else None for i in positions.values()))
+                if len(chunk) >= chunk_rows:
+                    with transaction(conn): # temp tables only, doesn't touch the main database's lock
+                        conn.executemany(insert, chunk)
+                    chunk.clear()
+            if chunk:
+                with transaction(conn):
+                    conn.executemany(insert, chunk)
+    finally:
+        workbook.close()
+    conn.execute('CREATE INDEX temp.staging_electrolyte_components_electrolyte_id ON staging_electrolyte_components (electrolyte_id)')
+
+def _merge_components(conn, report, canonical, elements, chunk_rows):
+    '''
+    returns (workbook component id -> database id, database id -> canonical formula, every workbook id the sheet
+    defines); ids of rejected rows are defined but not mapped, so nothing can fall back to a database id for them.
+    '''
+    formula_by_id = {}
+    known = {}
+    for component_id, formula in conn.execute('SELECT id, formula FROM components'):
+        try:
+            formula = canonical(formula)
+        except TypeError:
+            pass
+        formula_by_id[component_id] = formula
+        known.setdefault(formula, component_id)
+
+    columns = [column for column in _columns(conn, 'components') if column not in ('id', 'formula')]
+    numeric = [column for column in columns if column != 'notes']
+    insert = f'INSERT INTO components (formula, {", ".join(columns)}) VALUES (?{", ?" * len(columns)})'
+    component_map = {}
+    defined = set()
+    c = conn.execute(f'SELECT _row, id, formula, {", ".join(columns)} FROM staging_components ORDER BY _row')
+    while rows := c.fetchmany(chunk_rows):
+        for row_number, workbook_id, formula, *values in rows:
+            try:
+                workbook_id = _number(workbook_id, integer=True)
+            except (TypeError, ValueError) as e:
+                report.record('components', 'rejected', row_number, str(e.args[0]) if e.args else 'invalid id')
+                continue
+            if workbook_id is not None:
+                defined.add(workbook_id)
+            try:
+                if formula is None or not str(formula).strip():
+                    raise ValueError('missing formula')
+                formula = canonical(str(formula).strip())
+                values = [_number(value) if column in numeric else value for column, value in zip(columns, values)]
+            except (TypeError, ValueError) as e:
+                report.record('components', 'rejected', row_number, str(e.args[0]) if e.args else 'invalid row')
+                continue
+
+            if formula in known:
+                report.record('components', 'skipped', row_number, f'{formula} already in catalog as id {known[formula]}')
+            else:
+                known[formula] = conn.execute(insert, [formula] + values).lastrowid
+                formula_by_id[known[formula]] = formula
+                conn.executemany('INSERT INTO component_elements (component_id, element, count) VALUES (?, ?, ?)',
+                                 [(known[formula], element, count) for element, count in elements(formula)])
+                report.record('components', 'inserted')
+            if workbook_id is not None:
+                component_map[workbook_id] = known[formula]
+    return component_map, formula_by_id, defined
+
+def _resolve_component(component_row, component_id, component_map, formula_by_id, defined):
+    '''
+    workbook component id -> database id. Ids the components sheet defines go through component_map only; the
+    others must already be database ids.
+    '''
+    if component_id in defined:
+        if component_id not in component_map:
+            raise ValueError(f'electrolyte_components row {component_row} references component {component_id}, which was rejected')
+        return component_map[component_id]
+    if component_id not in formula_by_id:
+        raise ValueError(f'electrolyte_components row {component_row} references an unknown component')
+    return component_id
+
+def _merge_electrolytes(conn, report, fingerprint, component_map, formula_by_id, defined, chunk_rows):
+    properties = [column for column in _columns(conn, 'electrolytes') if column != 'id']
+    insert = f'INSERT INTO electrolytes ({", ".join(properties)}) VALUES ({", ".join("?" * len(properties))})'
+    seen_ids = set()
+    seen_fingerprints = set()
+
+    c = conn.execute(f'SELECT _row, id, {", ".join(properties)} FROM staging_electrolytes ORDER BY _row')
+    while rows := c.fetchmany(chunk_rows):
+        workbook_ids = {row[1] for row in rows if row[1] is not None}
+        components = {}
+        if workbook_ids:
+            placeholders = ', '.join('?' * len(workbook_ids))
+            for row_number, electrolyte_id, component_id, amount in conn.execute(
+                    f'SELECT _row, electrolyte_id, component_id, amount FROM staging_electrolyte_components WHERE electrolyte_id IN ({placeholders}) ORDER BY _row',
+                    list(workbook_ids)):
+                components.setdefault(electrolyte_id, []).append((row_number, component_id, amount))
+
+        for row_number, workbook_id, *values in rows:
+            # a repeated id's component rows were already accounted for with its first row
+            component_rows = components.get(workbook_id, []) if workbook_id not in seen_ids else []
+            try:
+                if _number(workbook_id, integer=True) is None:
+                    raise ValueError('missing id, its electrolyte_components rows can\'t be matched')
+                if workbook_id in seen_ids:
+                    raise ValueError(f'id {workbook_id} appears more than once in the sheet')
+                seen_ids.add(workbook_id)
+                values = [_number(value) for value in values]
+                if not component_rows:
+                    raise ValueError('no electrolyte_components rows')
+
+                resolved = {}
+                for component_row, component_id, amount in component_rows:
+                    component_id = _resolve_component(component_row, _number(component_id, integer=True),
+                                                      component_map, formula_by_id, defined)
+                    if component_id in resolved:
+                        raise ValueError(f'component {formula_by_id[component_id]} listed more than once')
+                    amount = _number(amount)
+                    if amount is None:
+                        raise ValueError(f'electrolyte_components row {component_row} has no amount')
+                    resolved[component_id] = amount
+            except (TypeError, ValueError) as e:
+                report.record('electrolytes', 'rejected', row_number, str(e.args[0]) if e.args else 'invalid row')
+                for component_row, *_ in component_rows:
+                    report.record('electrolyte_components', 'rejected')
+                continue
+
+            composition = fingerprint({formula_by_id[component_id]: amount for component_id, amount in resolved.items()})
+            existing = conn.execute('SELECT electrolyte_id FROM electrolyte_fingerprints WHERE fingerprint = ?', (composition,)).fetchone()
+            if existing or composition in seen_fingerprints:
+                reason = f'same composition as electrolyte {existing[0]}' if existing else 'same composition as an earlier row'
+                report.record('electrolytes', 'skipped', row_number, reason)
+                for _ in component_rows:
+                    report.record('electrolyte_components', 'skipped')
+                continue
+            seen_fingerprints.add(composition)
+
+            electrolyte_id = conn.execute(insert, values).lastrowid
+            conn.executemany('INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)',
+                             [(electrolyte_id, component_id, amount) for component_id, amount in resolved.items()])
+            conn.execute('INSERT INTO electrolyte_fingerprints (electrolyte_id, fingerprint) VALUES (?, ?)', (electrolyte_id, composition))
+            report.record('electrolytes', 'inserted')
+            for _ in component_rows:
+                report.record('electrolyte_components', 'inserted')
+
+    orphans = conn.execute('''SELECT _row FROM staging_electrolyte_components
+                              WHERE electrolyte_id IS NULL OR electrolyte_id NOT IN (SELECT id FROM staging_electrolytes WHERE id IS NOT NULL)
+                              ORDER BY _row''')
+    for row_number, in orphans:
+        report.record('electrolyte_components', 'rejected', row_number, 'no matching row in the electrolytes sheet')
+
+def import_workbook(conn, file, canonical, fingerprint, elements, chunk_rows=CHUNK_ROWS, progress=None):
+    '''
+    full pipeline on one checked-out connection. canonical(formula) -> canonical formula string,
+    fingerprint({formula: amount}) -> composition fingerprint and elements(formula) -> ((element, count), ...) for
+    component_elements are passed in by the app (Chemical.canonical, composition_fingerprint and
+    Chemical.compile_formula). Returns the report as a dict; raises ValueError if the file isn't a workbook.
+    progress(fraction, message), if given, is called before each step, outside the merge transaction.
+    '''
+    report = ImportReport()
+    try:
+        if progress is not None:
+            progress(0.0, 'Reading workbook')
+        stage_workbook(conn, file, report, chunk_rows)
+        if progress is not None:
+            progress(0.5, 'Merging')
+        with transaction(conn, immediate=True):
+            component_map, formula_by_id, defined = _merge_components(conn, report, canonical, elements, chunk_rows)
+            _merge_electrolytes(conn, report, fingerprint, component_map, formula_by_id, defined, chunk_rows)
+    finally:
+        for table in IMPORT_ORDER:
+            conn.execute(f'DROP TABLE IF EXISTS temp.staging_{table}')
+    return report.as_dict()
@@ -0,0 +1,285 @@
+'''
+Background jobs for work that outlasts a browser's patience: xlsx and columnar exports, workbook uploads and
+the snapshot renderings. Jobs run in a process pool (openpyxl and pyarrow are CPU-bound, and in a thread they
+hold the GIL against the event loop), at most max_workers at a time, and at most max_pending are accepted and
+not yet finished. Their state is a jobs table in a SQLite file of its own next to the artifacts, so it
+survives restarts, and polling or progress updates never wait on (or bump the data_version of) the
+experiment database.
+
+job_id = runner.submit('export', main.export_job, plan)  # fn(job, *args) runs in a worker, returns a dict
+runner.get(job_id) -> {"id", "kind", "status", "progress", "message", "result", "download", ...} or None
+runner.cancel(job_id)
+
+fn must be importable from the worker (a module-level function); what it returns is the job's result, except
+for "artifact" (a path from job.artifact_path), "filename" and "media_type", which describe the download.
+'''
+
+import json
+import multiprocessing
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+FINISHED = ('done', 'failed', 'cancelled') # the others are queued and running
+COLUMNS = ('id', 'kind', 'status', 'progress', 'message', 'result', 'filename', 'created', 'started', 'finished')
+PROGRESS_INTERVAL = .5 # seconds between progress writes from a worker
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    artifact TEXT,
+    filename TEXT,
+    media_type TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+)
+'''
+
+class Cancelled(Exception):
+    pass
+
+class TooManyJobs(Exception):
+    pass
+
+class JobsUnavailable(Exception):
+    pass
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # someone else's process
+        return True
+    return True
+
+def _finish(conn, job_id, status, message=None, **fields):
+    assignments = ''.join(f', {name} = ?' for name in fields)
+    conn.execute(f'UPDATE jobs SET status = ?, message = ?, finished = ?{assignments} WHERE id = ?',
+                 (status, message, time.time(), *fields.values(), job_id))
+
+class Job:
+    '''
+    what a job function gets in the worker: artifact_path() for its output file, and progress() to report how far
+    it is, which is also where a cancellation request surfaces, as Cancelled.
+    '''
+    def __init__(self, conn, job_id, directory):
+        self.id = job_id
+        self.directory = directory
+        self.artifacts = []
+        self._conn = conn
+        self._reported = 0.0
+
+    def artifact_path(self, extension):
+        path = os.path.join(self.directory, f'{self.id}.{extension}')
+        self.artifacts.append(path)
+        return path
+
+    def progress(self, fraction, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        if self._conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (self.id,)).fetchone()[0]:
+            raise Cancelled()
+        self._conn.execute('UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ?',
+                           (min(max(fraction, 0.0), 1.0), message, self.id))
+
+def _execute(path, directory, job_id, fn, args):
+    '''
+    worker side: runs one job unless it was cancelled while queued, and records how it ended.
+    '''
+    conn = _connect(path)
+    try:
+        started = conn.execute('''UPDATE jobs SET status = 'running', started = ?
+                                  WHERE id = ? AND status = 'queued' AND NOT cancel_requested''', (time.time(), job_id)).rowcount
+        if not started: # cancelled while it waited
+            conn.execute('''UPDATE jobs SET status = 'cancelled', message = 'Cancelled', finished = ?
+                            WHERE id = ? AND status = 'queued' ''', (time.time(), job_id))
+            return
+        job = Job(conn, job_id, directory)
+        try:
+            result = dict(fn(job, *args) or {})
+        except BaseException as e:
+            for artifact in job.artifacts:
+                if os.path.exists(artifact):
+                    os.remove(artifact)
+            if isinstance(e, Cancelled):
+                _finish(conn, job_id, 'cancelled', 'Cancelled')
+            else:
+                _finish(conn, job_id, 'failed', str(e.args[0]) if e.args else type(e).__name__)
+                if not isinstance(e, Exception):
+                    raise
+            return
+        artifact, filename, media_type = result.pop('artifact', None), result.pop('filename', None), result.pop('media_type', None)
+        _finish(conn, job_id, 'done', result.pop('message', None), progress=1.0, result=json.dumps(result),
+                artifact=artifact, filename=filename, media_type=media_type)
+    finally:
+        conn.close()
+
+class JobRunner:
+    '''
+    runner = JobRunner('./jobs', max_workers=2, max_pending=8)
+
+    The worker processes are spawned (not forked from a process full of threads) on the first submit, so
+    importing the app doesn't start them; each one imports the job function's module once.
+    '''
+    def __init__(self, directory, max_workers=2, max_pending=8, keep=timedelta(days=1)):
+        self.directory = directory
+        self.path = os.path.join(directory, 'jobs.sqlite')
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep = keep # finished jobs and their artifacts are pruned after this long
+        self._conn = None
+        self._executor = None
+        self._futures = {} # job id -> future, for jobs this process submitted and that haven't finished
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = _connect(self.path)
+            self._conn.execute(SCHEMA)
+        return self._conn
+
+    def recover(self):
+        '''
+        jobs left queued or running by a process that is gone (each job records the pid of the app process that
+        submitted it, since several app workers can share the directory) will never finish; marks them failed.
+        Call at startup. returns how many.
+        '''
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT id, pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            orphans = [(time.time(), job_id) for job_id, pid in rows if pid is None or not _alive(pid)]
+            conn.executemany("UPDATE jobs SET status = 'failed', message = 'Interrupted by a restart', finished = ? WHERE id = ?", orphans)
+            return len(orphans)
+
+    def submit(self, kind, fn, *args, on_done=None):
+        '''
+        queues fn(job, *args) and returns the job id right away. on_done() runs in this process after the job
+        succeeds, ex: to drop in-process caches. raises TooManyJobs when max_pending jobs are unfinished, and
+        JobsUnavailable when no worker pool can be started.
+        '''
+        with self._lock:
+            conn = self._connection()
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if pending >= self.max_pending:
+                raise TooManyJobs(f'{pending} jobs are already queued or running, try again later')
+            job_id = secrets.token_urlsafe(12)
+            # the row goes in first, since the worker may pick the job up before submit returns
+            conn.execute("INSERT INTO jobs (id, kind, status, created, pid) VALUES (?, ?, 'queued', ?, ?)",
+                         (job_id, kind, time.time(), os.getpid()))
+            try:
+                future = self._submit(job_id, fn, args)
+            except BaseException as e:
+                _finish(conn, job_id, 'failed', str(e.args[0]) if e.args else type(e).__name__)
+                if isinstance(e, BrokenProcessPool):
+                    raise JobsUnavailable('Background workers are unavailable, try again later') from e
+                raise
+            self._futures[job_id] = future
+        future.add_done_callback(lambda future: self._done(job_id, future, on_done))
+        return job_id
+
+    def _submit(self, job_id, fn, args):
+        # under self._lock. once a worker dies the pool refuses everything, so start a new one and try once more
+        for retry in (False, True):
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                return self._executor.submit(_execute, self.path, self.directory, job_id, fn, args)
+            except BrokenProcessPool:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                if retry:
+                    raise
+
+    def _done(self, job_id, future, on_done):
+        with self._lock:
+            self._futures.pop(job_id, None)
+            conn = self._connection()
+            if future.cancelled():
+                _finish(conn, job_id, 'cancelled', 'Cancelled')
+                return
+            if future.exception() is not None: # the worker died, ex: killed or out of memory
+                conn.execute('''UPDATE jobs SET status = 'failed', message = ?, finished = ?
+                                WHERE id = ? AND status IN ('queued', 'running')''', (str(future.exception()), time.time(), job_id))
+                return
+            status = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if on_done is not None and status and status[0] == 'done':
+            on_done()
+
+    def _row(self, conn, job_id):
+        row = conn.execute(f'SELECT {", ".join(COLUMNS)}, artifact IS NOT NULL FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(COLUMNS, row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['download'] = bool(row[-1]) and job['status'] == 'done'
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._row(self._connection(), job_id)
+
+    def artifact(self, job_id):
+        '''
+        (path, filename, media_type) of a finished job's download, or None.
+        '''
+        with self._lock:
+            row = self._connection().execute("SELECT artifact, filename, media_type FROM jobs WHERE id = ? AND status = 'done'",
+                                             (job_id,)).fetchone()
+        return row if row and row[0] and os.path.exists(row[0]) else None
+
+    def cancel(self, job_id):
+        '''
+        a queued job is dropped; a running one stops at its next progress report. returns the job, or None.
+        '''
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status NOT IN {FINISHED}", (job_id,))
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel() # only succeeds while queued; _done records it
+        return self.get(job_id)
+
+    def prune(self, now=None):
+        '''
+        deletes finished jobs older than keep, with their artifacts. returns how many.
+        '''
+        with self._lock:
+            conn = self._connection()
+            cutoff = (now or time.time()) - self.keep.total_seconds()
+            rows = conn.execute(f'SELECT id, artifact FROM jobs WHERE status IN {FINISHED} AND finished < ?', (cutoff,)).fetchall()
+            for _, artifact in rows:
+                if artifact and os.path.exists(artifact):
+                    os.remove(artifact)
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id, _ in rows])
+            return len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
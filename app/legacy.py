@@ -0,0 +1,134 @@
+'''
+add_electrolyte and the check_electrolyte_exists it calls, copied unchanged from the baseline main.py (commit
+a11e441), for the before/after comparison in python3 benchmark.py writes. Nothing in the app uses them.
+
+Only the names around them differ: DB is main's, Chemical is today's (so the cached parser, not the baseline's
+recursive one), and sqlite3.connect hands out connections whose statements metrics counts, the same way it
+counts the pool's.
+'''
+
+import sqlite3 as _sqlite3
+
+from main import DB, Chemical
+from metrics import TimedConnection
+
+class sqlite3:
+    Error = _sqlite3.Error
+
+    @staticmethod
+    def connect(database):
+        return _sqlite3.connect(database, factory=TimedConnection)
+
+def add_electrolyte(components: dict,
+
+                    conductivity: float,
+                    conduct_uncert_bound: float,
+                    concent_uncert_bound: float,
+
+                    density: float = -1,
+                    temperature: float = -1,
+                    viscosity: float = -1,
+                    v_window_low_bound: float = -1,
+                    v_window_high_bound: float = -1,
+                    surface_tension: float = -1
+                    ):
+    """
+    components: dict of chemical formula and amount; e.g. {str: float, ...}
+
+    adds a new electrolyte to database with components as dictionary
+    """
+    if(check_electrolyte_exists(components)):
+        raise ValueError(f'Electrolyte with formula {components} already exists')
+    conn = sqlite3.connect(DB)
+    try:
+        c = conn.cursor()
+
+        attr_dict = {
+            'conductivity': conductivity,
+            'conduct_uncert_bound': conduct_uncert_bound,
+            'concent_uncert_bound': concent_uncert_bound,
+            'density': density,
+            'temperature': temperature,
+            'viscosity': viscosity,
+            'v_window_low_bound': v_window_low_bound,
+            'v_window_high_bound': v_window_high_bound,
+            'surface_tension': surface_tension,
+        }
+
+        c.execute(f'''INSERT INTO electrolytes {tuple(attr_dict.keys())} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+        , tuple(attr_dict.values()))
+
+        conn.commit()
+
+        #GET ID BACK FROM ELECTROLYTES TABLE BY CHECKING ALL ATTRIBUTES
+        # Generate the parts of the WHERE clause
+        clauses = [f"{attr} = ?" for attr in attr_dict.keys()]
+        where_clause = " AND ".join(clauses)
+
+        query = f"SELECT id FROM electrolytes WHERE {where_clause}"
+        
+        c.execute(query, tuple(attr_dict.values()))
+        try:
+            matched_ids = list(c.fetchall()[0])
+        except:
+            matched_ids = []
+
+        c.execute('SELECT MAX(id) FROM electrolytes')
+        electrolyte_id = c.fetchone()[0]
+
+        if (electrolyte_id in matched_ids) and electrolyte_id != matched_ids:
+            matched_ids.remove(electrolyte_id)
+            print(f"Electrolytes with id(s): {matched_ids} have exactly identical attributes.")
+
+        for formula, amount in components.items():
+            chemical = Chemical(formula)
+            c.execute("SELECT ID FROM components WHERE formula=?", (str(chemical),))
+
+            component_id = c.fetchone()[0]
+            print(electrolyte_id,component_id,amount)
+            c.execute("INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)",
+                    (electrolyte_id, component_id, amount))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def check_electrolyte_exists(components: dict):
+    '''
+    Checks if an electrolyte with matching components and amounts already exists in the dictionary.
+    '''
+
+    conn = sqlite3.connect(DB)
+    try:
+        c = conn.cursor()
+
+        #long query string
+        query_string = "SELECT e.id FROM electrolytes e WHERE e.id IN (SELECT ec.electrolyte_id FROM electrolyte_components ec WHERE "
+        query_conditions = []
+        query_values = []
+        for formula, amount in components.items():
+            chemical = Chemical(formula)
+            query_conditions.append("(ec.component_id = (SELECT ID FROM components WHERE formula = ?) AND ec.amount = ?)")
+            query_values.extend([str(chemical), amount])
+        query_string += " OR ".join(query_conditions) + " GROUP BY ec.electrolyte_id HAVING COUNT(ec.electrolyte_id) = ?)"
+        query_values.append(len(components))
+
+        c.execute(query_string, query_values)
+        candidate_ids = [row[0] for row in c.fetchall()]
+
+        #check that each candidate id doesn't have extra components
+        for id in candidate_ids:
+            c.execute("SELECT COUNT(*) FROM Electrolyte_Components WHERE Electrolyte_ID = ?", (id,))
+            if c.fetchone()[0] != len(components):
+                candidate_ids.remove(id)
+        conn.commit()
+        # If we have at least one result, the electrolyte exists
+        return len(candidate_ids) > 0
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+        conn.rollback()
+    finally:
+        conn.close()
+
@@ -3,11 +3,22 @@
 
 import sqlite3
 import re
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
 from collections import Counter
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import asyncio
-from datetime import datetime
-from pydantic import BaseModel
+from datetime import timedelta
+from pydantic import BaseModel, create_model, field_validator
 
 class LogConfig(BaseModel): 
     version: int = 1
@@ -36,11 +47,12 @@ class LogConfig(BaseModel):
         LOGGER_NAME: {"handlers": ["default"], "level": LOG_LEVEL},
     }
 
-from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile, BackgroundTasks
+from fastapi import FastAPI, File, Form, Header, HTTPException, Query, Request, UploadFile, BackgroundTasks, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, FileResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
 from fastapi.middleware.cors import CORSMiddleware
 from logging.config import dictConfig
 import logging
@@ -49,10 +61,68 @@ dictConfig(LogConfig().model_dump())
 logger = logging.getLogger("logger")
 
 
-import pandas as pd
 from urllib.parse import quote
 
-DB = 'db/experiment_db.sqlite'
+from database import ConnectionPool, DatabaseExecutor, READ_ONLY_PRAGMAS, current_task
+import columnar
+import costs
+from cache import ResponseCache
+from catalog import ComponentCatalog
+import export
+import importer
+import jobs
+import metrics
+import migrations
+from query import QueryError, QueryService
+import search
+import similarity
+import snapshots
+
+DB = os.environ.get('DB_PATH', 'db/experiment_db.sqlite') # the benchmark suite points this at a scratch file
+
+# concurrency limits for blocking database work, see DatabaseExecutor
+DB_WORKERS = int(os.environ.get('DB_WORKERS', 4))
+DB_HEAVY_WORKERS = int(os.environ.get('DB_HEAVY_WORKERS', 2))
+
+# one connection per executor thread, +1 for the main thread (CLI commands, scripts). That only holds if nothing
+# else checks one out, so the server installs executor_only as the pool's guard at startup; anything that needs a
+# connection outside the executor (see export_pool) brings its own pool.
+pool = ConnectionPool(DB, max_size=DB_WORKERS + DB_HEAVY_WORKERS + 1, factory=metrics.TimedConnection)
+db_executor = DatabaseExecutor(DB_WORKERS, DB_HEAVY_WORKERS)
+
+def executor_only():
+    if current_task() is None and threading.current_thread() is not threading.main_thread():
+        raise RuntimeError(f'{threading.current_thread().name} is not a DatabaseExecutor thread; run this through db_executor, '
+                           'the main pool is only sized for those')
+
+# csv/ndjson downloads and NDJSON query results hold a connection for as long as the client takes to read them,
+# outside the executor, so they get read-only connections of their own and at most EXPORT_STREAMS at once
+EXPORT_STREAMS = int(os.environ.get('EXPORT_STREAMS', 4)) # more get a 503
+export_pool = ConnectionPool(f'file:{DB}?mode=ro', max_size=EXPORT_STREAMS, uri=True, pragmas=READ_ONLY_PRAGMAS,
+                             factory=metrics.TimedConnection)
+stream_slots = threading.BoundedSemaphore(EXPORT_STREAMS)
+
+# limits for /execute_sql/, see query.QueryService
+SQL_MAX_ROWS = int(os.environ.get('SQL_MAX_ROWS', 10000)) # across all pages of one query
+SQL_PAGE_SIZE = int(os.environ.get('SQL_PAGE_SIZE', 500))
+SQL_TIME_BUDGET = float(os.environ.get('SQL_TIME_BUDGET', 5)) # seconds of SQLite time per request
+SQL_WRITE_TOKEN = os.environ.get('SQL_WRITE_TOKEN') # unset: write mode is off entirely
+SQL_GZIP_LEVEL = int(os.environ.get('SQL_GZIP_LEVEL', 6)) # for pages sent to clients that accept gzip; 0 sends them as is
+SQL_CURSOR_TTL = float(os.environ.get('SQL_CURSOR_TTL', 15)) # seconds an unfinished result's cursor (and read transaction) stays open
+
+# statements at least this slow are logged through the LogConfig logger; 0 turns the slow-query log off
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 250))
+metrics.configure_slow_query_log(SLOW_QUERY_MS / 1000 if SLOW_QUERY_MS > 0 else None, logger)
+
+query_service = QueryService(DB, pool, max_rows=SQL_MAX_ROWS, page_size=SQL_PAGE_SIZE, time_budget=SQL_TIME_BUDGET,
+                             max_streams=EXPORT_STREAMS, cursor_ttl=SQL_CURSOR_TTL, factory=metrics.TimedConnection)
+composition_index = similarity.CompositionIndex(pool) # built on the first similarity search
+catalog = ComponentCatalog(DB) # formula/id -> component row, reloaded only when components change
+
+# bodies of /execute_sql/ pages and exports, keyed on the request and the database version, see cache.py
+RESPONSE_CACHE_MB = float(os.environ.get('RESPONSE_CACHE_MB', 64)) # 0 turns body caching off; ETags and 304s stay
+RESPONSE_CACHE_ENTRY_MB = float(os.environ.get('RESPONSE_CACHE_ENTRY_MB', 8)) # bigger responses are never cached
+response_cache = ResponseCache(DB, max_bytes=int(RESPONSE_CACHE_MB * 2**20), max_entry_bytes=int(RESPONSE_CACHE_ENTRY_MB * 2**20))
 
 class Chemical:
     '''
@@ -65,116 +135,255 @@ class Chemical:
     'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Sb',
     'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd',
     'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir',
-    'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm',
+    'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn', 'Fr', 'Ra', 'Ac', 'Th',
+    'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm',
     'Bk','Cf', 'Es', 'Fm', 'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt',
      'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og']
+    # standard atomic weights (g/mol), same order as ELEMENTS; bracketed values in the IUPAC table (no stable
+    # isotope) are the mass number of the longest-lived isotope
+    ATOMIC_WEIGHTS = [1.008, 4.0026, 6.94, 9.0122, 10.81, 12.011, 14.007, 15.999, 18.998, 20.180, 22.990, 24.305,
+    26.982, 28.085, 30.974, 32.06, 35.45, 39.95, 39.098, 40.078, 44.956, 47.867, 50.942, 51.996, 54.938,
+    55.845, 58.933, 58.693, 63.546, 65.38, 69.723, 72.630, 74.922, 78.971, 79.904, 83.798, 85.468, 87.62,
+    88.906, 91.224, 92.906, 95.95, 98, 101.07, 102.91, 106.42, 107.87, 112.41, 114.82, 118.71, 121.76,
+    127.60, 126.90, 131.29, 132.91, 137.33, 138.91, 140.12, 140.91, 144.24, 145, 150.36, 151.96, 157.25,
+    158.93, 162.50, 164.93, 167.26, 168.93, 173.05, 174.97, 178.49, 180.95, 183.84, 186.21, 190.23, 192.22,
+    195.08, 196.97, 200.59, 204.38, 207.2, 208.98, 209, 210, 222, 223, 226, 227, 232.04,
+    231.04, 238.03, 237, 244, 243, 247,
+    247, 251, 252, 257, 258, 259, 262, 267, 268, 269, 270, 269, 278,
+    281, 282, 285, 286, 289, 290, 293, 294, 294]
+    ELEMENT_NUMBERS = {element: number for number, element in enumerate(ELEMENTS, 1)} #atomic number lookup for sorting
+    N_ELEMENTS = len(ELEMENTS) #118, width of the element-count vectors
+
+    # one token per match: element + count, opening paren, closing paren + multiplier, or anything else (invalid);
+    # plain groups so findall hands back tuples, with '' for the alternatives that didn't match
+    FORMULA_TOKEN = re.compile(r'([A-Za-z][a-z]*)(\d*)|(\()|(\))(\d*)|(.)', re.DOTALL)
+    PARSE_CACHE_SIZE = 4096
+
+    # no per-instance __dict__; the parsed composition is the shared, cached tuple from compile_formula
+    __slots__ = ('_parsed', '_canonical', 'notes', 'molar_mass', 'price', 'is_salt')
+
     def __init__(self, formula=' ', notes='', molar_mass=0, price=0, is_salt = False):
-        self.elements = self.parse_formula(formula)
+        self._parsed, self._canonical = self.compile_formula(formula)
         self.notes = notes
-        self.molar_mass = molar_mass
+        self.molar_mass = molar_mass or self.molar_mass_of(formula) # computed from the formula unless given
         self.price = price # PRICE IS IN TERMS OF $/ML AND $/G
         self.is_salt = is_salt
 
-    def parse_formula(self, formula): #recursive function to parse equivalent formulas
+    @staticmethod
+    @lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def compile_formula(formula):
         '''
-        Recursively parses through a formula string, accounting for parentheses and different orderings for elements.
-        Returns a 'Counter' object, which is really just a dictionary with elements on the left, and amounts on the
-        right.
+        Parses a formula string with an explicit stack instead of recursion, accounting for parentheses and
+        different orderings for elements. Results are memoized per raw formula string, so the same formula is
+        only ever tokenized once; returns an immutable tuple of (element, count) pairs sorted by element number,
+        and the canonical formula string.
         '''
-
-        elements = Counter()
-        i = 0
-        while i < len(formula):
-            if formula[i] == '(':
-                count = 1
-                for j in range(i + 1, len(formula)):
-                    if formula[j] == '(':
-                        count += 1
-                    elif formula[j] == ')':
-                        count -= 1
-                        if count == 0:
-                            break
-                else:
-                    raise TypeError(f'Unbalanced parentheses in formula {formula}')
-
-                sub_elements = self.parse_formula(formula[i + 1:j])
-                i = j + 1
-
-                factor = ''
-                while i < len(formula) and formula[i].isdigit():
-                    factor += formula[i]
-                    i += 1
+        stack = [{}]
+        top = stack[0]
+        for element, count, opening, closing, factor, other in Chemical.FORMULA_TOKEN.findall(formula):
+            if element:
+                if element not in Chemical.ELEMENT_NUMBERS:
+                    raise TypeError(f'Unknown element {element} in formula {formula}')
+                top[element] = top.get(element, 0) + (int(count) if count else 1)
+            elif opening:
+                top = {}
+                stack.append(top)
+            elif closing:
+                if len(stack) == 1:
+                    raise TypeError(f'Invalid character ) in formula {formula}')
+                sub_elements = stack.pop()
+                top = stack[-1]
                 factor = int(factor) if factor else 1
                 for element, quantity in sub_elements.items():
-                    elements[element] += quantity * factor
-            elif formula[i].isalpha():
-                element = formula[i]
-                i += 1
-                while i < len(formula) and formula[i].islower():
-                    element += formula[i]
-                    i += 1
-                if element not in self.ELEMENTS:
-                    raise TypeError(f'Unknown element {element} in formula {formula}')
-                quantity = ''
-                while i < len(formula) and formula[i].isdigit():
-                    quantity += formula[i]
-                    i += 1
-                quantity = int(quantity) if quantity else 1
-                elements[element] += quantity
+                    top[element] = top.get(element, 0) + quantity * factor
             else:
-                raise TypeError(f'Invalid character {formula[i]} in formula {formula}')
-        return elements
+                raise TypeError(f'Invalid character {other} in formula {formula}')
+        if len(stack) != 1:
+            raise TypeError(f'Unbalanced parentheses in formula {formula}')
+
+        parsed = tuple(sorted(top.items(), key=lambda x: Chemical.ELEMENT_NUMBERS[x[0]]))
+        canonical = ''.join(f'{element}{count}' if count > 1 else element for element, count in parsed)
+        return parsed, canonical
+
+    @classmethod
+    def canonical(cls, formula):
+        '''
+        canonical formula string (elements sorted by element number) without building a Chemical.
+        '''
+        return cls.compile_formula(formula)[1]
+
+    def parse_formula(self, formula):
+        '''
+        Returns a 'Counter' object, which is really just a dictionary with elements on the left, and amounts on the
+        right. Backed by the memoized compile_formula.
+        '''
+        return Counter(dict(self.compile_formula(formula)[0]))
+
+    @staticmethod
+    @lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def element_vector(formula):
+        '''
+        composition of a formula as a read-only int32 vector of length 118; index i holds the count of the element
+        with atomic number i + 1 (i.e. ELEMENTS[i]).
+        '''
+        import numpy as np
+
+        vector = np.zeros(Chemical.N_ELEMENTS, dtype=np.int32)
+        for element, count in Chemical.compile_formula(formula)[0]:
+            vector[Chemical.ELEMENT_NUMBERS[element] - 1] = count
+        vector.setflags(write=False)
+        return vector
+
+    @classmethod
+    def element_matrix(cls, formulas):
+        '''
+        bulk constructor: takes a list of formulas and returns one (n_components, 118) int32 matrix, row i being
+        the element counts of formulas[i]. Lets stoichiometry and element filters run over the whole catalog as
+        array operations, ex: element_matrix(formulas)[:, Chemical.ELEMENT_NUMBERS['F'] - 1] > 0
+        '''
+        import numpy as np
+
+        matrix = np.zeros((len(formulas), cls.N_ELEMENTS), dtype=np.int32)
+        for row, formula in enumerate(formulas):
+            matrix[row] = cls.element_vector(formula)
+        return matrix
+
+    @classmethod
+    def molar_mass_of(cls, formula):
+        '''
+        molar mass in g/mol from the parsed composition and ATOMIC_WEIGHTS.
+        '''
+        return sum(cls.ATOMIC_WEIGHTS[cls.ELEMENT_NUMBERS[element] - 1] * count for element, count in cls.compile_formula(formula)[0])
+
+    @classmethod
+    def molar_masses(cls, formulas):
+        '''
+        vectorized molar_mass_of: one (n, 118) @ (118,) product over element_matrix, returns an array of g/mol.
+        '''
+        import numpy as np
+
+        return cls.element_matrix(formulas) @ np.array(cls.ATOMIC_WEIGHTS)
+
+    @property
+    def elements(self):
+        '''
+        dictionary with elements on the left, and amounts on the right.
+        '''
+        return Counter(dict(self._parsed))
+
+    @property
+    def vector(self):
+        '''
+        element counts as a length-118 array indexed by atomic number - 1.
+        '''
+        return self.element_vector(self._canonical)
 
     def __eq__(self, other):
         '''
         equivalence check which compares elements.
         '''
         if isinstance(other, Chemical):
-            return self.elements == other.elements
+            return self._parsed == other._parsed
         return False
 
     def __str__(self):
         '''
         outputs formula as a string with elements sorted by element number
         '''
-        sorted_elements = sorted(self.elements.items(), key=lambda x: self.ELEMENTS.index(x[0]))
-        return ''.join(f'{element}{count}' if count > 1 else f'{element}' for element, count in sorted_elements)
+        return self._canonical
+
+def composition_fingerprint(components: dict):
+    '''
+    takes in dictionary of components and amounts, ex: {"formula1": 3.23, "formula2": .57}
+    returns a hex digest that is the same for every equivalent composition: formulas are canonicalized
+    through Chemical and sorted, amounts are normalized to floats (so 1 and 1.0 match).
+    '''
+    return _fingerprint((Chemical.canonical(formula), float(amount)) for formula, amount in components.items())
+
+def _fingerprint(canonical):
+    # composition_fingerprint of (canonical formula, float amount) pairs that are already at hand
+    parts = sorted(f'{formula}:{amount!r}' for formula, amount in canonical)
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+# statements the request paths share (and HOT_QUERIES checks the plans of)
+FINGERPRINT_MATCHES = "SELECT electrolyte_id FROM electrolyte_fingerprints WHERE fingerprint = ?"
+FINGERPRINT_EXISTS = "SELECT 1 FROM electrolyte_fingerprints WHERE fingerprint = ? LIMIT 1"
+COMPONENT_BY_FORMULA = "SELECT * FROM components WHERE formula = ?"
+
+def backfill_fingerprints(rebuild: bool = False):
+    '''
+    computes fingerprints for every electrolyte that doesn't have one yet (or for all of them, if rebuild).
+    run this once on databases created before the electrolyte_fingerprints table existed, and after
+    bulk loads that bypass add_electrolyte. returns the number of fingerprints written.
+    '''
+    written = 0
+    try:
+        with pool.transaction() as conn:
+            c = conn.cursor()
+            if rebuild:
+                c.execute("DELETE FROM electrolyte_fingerprints")
+
+            c.execute("""
+            SELECT ec.electrolyte_id, c.formula, ec.amount
+            FROM electrolyte_components ec
+            JOIN components c ON ec.component_id = c.id
+            WHERE ec.electrolyte_id NOT IN (SELECT electrolyte_id FROM electrolyte_fingerprints)
+            ORDER BY ec.electrolyte_id
+            """)
+            compositions = {}
+            for electrolyte_id, formula, amount in c.fetchall():
+                compositions.setdefault(electrolyte_id, {})[formula] = amount
+
+            rows = []
+            for electrolyte_id, components in compositions.items():
+                try:
+                    rows.append((electrolyte_id, composition_fingerprint(components)))
+                except TypeError as e:
+                    print(f"Skipping electrolyte {electrolyte_id}: {e.args[0]}")
+            c.executemany("INSERT OR REPLACE INTO electrolyte_fingerprints (electrolyte_id, fingerprint) VALUES (?, ?)", rows)
+            written = len(rows)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+    return written
+
+def backfill_component_elements(rebuild: bool = False):
+    '''
+    fills component_elements for every component that has no rows in it yet (or for all of them, if rebuild).
+    run this once on databases created before the table existed, and after editing formulas by hand.
+    returns the number of components indexed.
+    '''
+    indexed = 0
+    try:
+        with pool.transaction() as conn:
+            c = conn.cursor()
+            if rebuild:
+                c.execute("DELETE FROM component_elements")
+            c.execute("SELECT id, formula FROM components WHERE id NOT IN (SELECT component_id FROM component_elements)")
+            components = []
+            for component_id, formula in c.fetchall():
+                try:
+                    components.append((component_id, Chemical.compile_formula(formula)[0]))
+                except (TypeError, AttributeError) as e:
+                    print(f"Skipping component {component_id}: {e.args[0]}")
+            search.index_elements(c, components)
+            indexed = len(components)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+    return indexed
 
 def get_electrolyte_by_components(components: dict):
     '''
     takes in dictionary of components and amounts, ex: {"formula1": 3.23, "formula2": .57}
     returns id of an electrolyte.
     '''
-    conn = sqlite3.connect(DB, isolation_level='IMMEDIATE')
+    candidate_ids = []
     try:
-        c = conn.cursor()
-
-        #creating long query string with all the requirements for amount and formula
-        query_string = "SELECT e.id FROM electrolytes e WHERE e.id IN (SELECT ec.electrolyte_id FROM electrolyte_components ec WHERE "
-        query_conditions = []
-        query_values = []
-        for formula, amount in components.items():
-            chemical = Chemical(formula)
-            query_conditions.append("(ec.component_id = (SELECT id FROM components WHERE formula = ?) AND ec.amount = ?)")
-            query_values.extend([str(chemical), amount])
-        query_string += " OR ".join(query_conditions) + " GROUP BY ec.electrolyte_id HAVING COUNT(ec.electrolyte_id) = ?)"
-        query_values.append(len(components))
-
-        c.execute(query_string, query_values)
-        candidate_ids = [row[0] for row in c.fetchall()]
-
-        #check that each candidate id doesn't have extra components
-        
-        for id in candidate_ids:
-            c.execute("SELECT COUNT(*) FROM Electrolyte_Components WHERE Electrolyte_ID = ?", (id,))
-            if c.fetchone()[0] != len(components):
-                candidate_ids.remove(id)
-        conn.commit()
+        with pool.connection() as conn:
+            c = conn.cursor()
+            c.execute(FINGERPRINT_MATCHES, (composition_fingerprint(components),))
+            candidate_ids = [row[0] for row in c.fetchall()]
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    finally:
-        conn.close()
     
     if(len(candidate_ids) > 1):
         raise ValueError(f"{len(candidate_ids)} total duplicate electrolytes found with components {str(components)}")
@@ -196,127 +405,182 @@ def add_electrolyte(components: dict,
     """
     components: dict of chemical formula and amount; e.g. {str: float, ...}
 
-    adds a new electrolyte to database with components as dictionary
+    adds a new electrolyte to database with components as dictionary, returns its id
     """
-    if(check_electrolyte_exists(components)):
-        raise ValueError(f'Electrolyte with formula {components} already exists')
-    conn = sqlite3.connect(DB)
-    try:
-        c = conn.cursor()
+    # everything that needs no lock first: formulas, component ids (from the catalog), the fingerprint
+    canonical = {formula: Chemical.canonical(formula) for formula in components}
+    if len(set(canonical.values())) != len(canonical): # ex: LiPF6 and F6PLi, which would collide in electrolyte_components
+        raise ValueError(f'same component listed more than once: {", ".join(components)}')
+    component_ids = _component_ids(canonical.values())
+    for formula, name in canonical.items():
+        if name not in component_ids:
+            raise ValueError(f'Unknown component {formula}, add it on the components page first')
+    fingerprint = composition_fingerprint(components)
+    properties = {
+        'conductivity': conductivity,
+        'conduct_uncert_bound': conduct_uncert_bound,
+        'concent_uncert_bound': concent_uncert_bound,
+        'density': density,
+        'temperature': temperature,
+        'viscosity': viscosity,
+        'v_window_low_bound': v_window_low_bound,
+        'v_window_high_bound': v_window_high_bound,
+        'surface_tension': surface_tension,
+    }
 
-        attr_dict = {
-            'conductivity': conductivity,
-            'conduct_uncert_bound': conduct_uncert_bound,
-            'concent_uncert_bound': concent_uncert_bound,
-            'density': density,
-            'temperature': temperature,
-            'viscosity': viscosity,
-            'v_window_low_bound': v_window_low_bound,
-            'v_window_high_bound': v_window_high_bound,
-            'surface_tension': surface_tension,
-        }
-
-        c.execute(f'''INSERT INTO electrolytes {tuple(attr_dict.keys())} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
-        , tuple(attr_dict.values()))
-
-        conn.commit()
-
-        #GET ID BACK FROM ELECTROLYTES TABLE BY CHECKING ALL ATTRIBUTES
-        # Generate the parts of the WHERE clause
-        clauses = [f"{attr} = ?" for attr in attr_dict.keys()]
-        where_clause = " AND ".join(clauses)
-
-        query = f"SELECT id FROM electrolytes WHERE {where_clause}"
-        
-        c.execute(query, tuple(attr_dict.values()))
-        try:
-            matched_ids = list(c.fetchall()[0])
-        except:
-            matched_ids = []
-
-        c.execute('SELECT MAX(id) FROM electrolytes')
-        electrolyte_id = c.fetchone()[0]
-
-        if (electrolyte_id in matched_ids) and electrolyte_id != matched_ids:
-            matched_ids.remove(electrolyte_id)
-            print(f"Electrolytes with id(s): {matched_ids} have exactly identical attributes.")
-
-        for formula, amount in components.items():
-            chemical = Chemical(formula)
-            c.execute("SELECT ID FROM components WHERE formula=?", (str(chemical),))
-
-            component_id = c.fetchone()[0]
-            print(electrolyte_id,component_id,amount)
-            c.execute("INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)",
-                    (electrolyte_id, component_id, amount))
-            conn.commit()
+    try:
+        # one write transaction, four statements: concurrent submissions of the same composition queue on the
+        # lock, and the second one sees the first one's fingerprint
+        with pool.transaction(immediate=True) as conn:
+            c = conn.cursor()
+            c.execute(FINGERPRINT_EXISTS, (fingerprint,))
+            if c.fetchone() is not None:
+                raise ValueError(f'Electrolyte with formula {components} already exists')
+
+            c.execute(f"INSERT INTO electrolytes ({', '.join(properties)}) VALUES ({', '.join('?' * len(properties))})",
+                      tuple(properties.values()))
+            electrolyte_id = c.lastrowid # this connection's own insert, unlike MAX(id)
+
+            c.executemany("INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)",
+                          [(electrolyte_id, component_ids[canonical[formula]], amount) for formula, amount in components.items()])
+            c.execute("INSERT OR REPLACE INTO electrolyte_fingerprints (electrolyte_id, fingerprint) VALUES (?, ?)",
+                      (electrolyte_id, fingerprint))
+        composition_index.add(electrolyte_id, {canonical[formula]: amount for formula, amount in components.items()})
+        response_cache.invalidate()
+        return electrolyte_id
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    finally:
-        conn.close()
 
-def check_electrolyte_exists(components: dict):
+ELECTROLYTE_PROPERTIES = ('conductivity', 'conduct_uncert_bound', 'concent_uncert_bound', 'density', 'temperature',
+                          'viscosity', 'v_window_low_bound', 'v_window_high_bound', 'surface_tension')
+SQL_VARIABLE_CHUNK = 900 # stay under SQLITE_MAX_VARIABLE_NUMBER on old builds
+
+# name: (statement, example parameters) for the statements the request paths run most, taken from the code that
+# runs them; python3 main.py check_query_plans (and test_migrations.py) fail when one scans a whole table
+HOT_QUERIES = {
+    'component by formula': (COMPONENT_BY_FORMULA, ('Cl2Ca',)),
+    'duplicate check': (FINGERPRINT_EXISTS, ('',)),
+    'electrolytes with a fingerprint': (FINGERPRINT_MATCHES, ('',)),
+    'composition of an electrolyte': (search.COMPOSITIONS.format('?'), (1,)),
+    'compositions of a page': (search.COMPOSITIONS.format('?, ?, ?'), (1, 2, 3)),
+    'electrolytes with a component': (search.page_sql(ELECTROLYTE_PROPERTIES, [search.HAS_COMPONENT, 'id > ?'], 'id ASC'), (1, 0, 51)),
+    'property range': (search.page_sql(ELECTROLYTE_PROPERTIES, ['conductivity >= ?', 'conductivity <= ?', 'conductivity IS NOT NULL',
+                                                                '(conductivity, id) > (?, ?)'], 'conductivity ASC, id ASC'),
+                       (1000, 2000, 1000, 0, 51)),
+    'property sort, rows without a value': (search.page_sql(ELECTROLYTE_PROPERTIES, ['conductivity IS NULL', 'id > ?'], 'id ASC'), (0, 51)),
+    **{f'element search, {table}': (sql, args + [51])
+       for table, (sql, args) in search.element_queries([('Li', '>=', 1), ('F', '>=', 6)]).items()},
+    'costs page': (costs.COSTS_PAGE, (0, 1000)),
+}
+
+def _chunks(items, size=SQL_VARIABLE_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _component_ids(formulas):
     '''
-    Checks if an electrolyte with matching components and amounts already exists in the dictionary.
+    canonical formula -> component id for every formula that is in the components table, from the catalog cache.
     '''
+    return catalog.ids(set(formulas))
 
-    conn = sqlite3.connect(DB)
-    try:
+def add_electrolytes(electrolytes: list):
+    '''
+    bulk version of add_electrolyte. electrolytes is a list of dicts with a 'components' dict
+    ({formula: amount, ...}) plus any of ELECTROLYTE_PROPERTIES. Everything that can be inserted is inserted in
+    one transaction; returns one status dict per input row, in order:
+    {"index": i, "status": "inserted" | "duplicate" | "rejected", "id": ..., "detail": ...}
+    '''
+    results = [{"index": i, "status": "rejected", "id": None, "detail": None} for i in range(len(electrolytes))]
+
+    #canonicalize and fingerprint in python first, no database needed; each distinct formula is parsed once
+    canonical_of, invalid = {}, {}
+    for formula in {formula for electrolyte in electrolytes for formula in electrolyte['components']}:
+        try:
+            canonical_of[formula] = Chemical.canonical(formula)
+        except TypeError as e:
+            invalid[formula] = str(e.args[0]) if e.args else 'invalid components'
+    prepared = {}
+    for i, electrolyte in enumerate(electrolytes):
+        components = electrolyte['components']
+        try:
+            canonical = [(canonical_of[formula], float(amount)) for formula, amount in components.items()]
+        except KeyError as e:
+            results[i]["detail"] = invalid[e.args[0]]
+            continue
+        except (TypeError, ValueError) as e:
+            results[i]["detail"] = str(e.args[0]) if e.args else 'invalid components'
+            continue
+        if len({formula for formula, _ in canonical}) != len(canonical):
+            results[i]["detail"] = 'same component listed more than once'
+            continue
+        prepared[i] = (canonical, _fingerprint(canonical))
+
+    with pool.transaction(immediate=True) as conn:
         c = conn.cursor()
+        component_ids = _component_ids((formula for canonical, _ in prepared.values() for formula, _ in canonical))
+
+        existing = {}
+        fingerprints = {fingerprint for _, fingerprint in prepared.values()}
+        for chunk in _chunks(fingerprints):
+            c.execute(f"SELECT fingerprint, electrolyte_id FROM electrolyte_fingerprints WHERE fingerprint IN ({','.join('?' * len(chunk))})", chunk)
+            existing.update(c.fetchall())
+
+        #the write lock is held, so MAX(id) + 1 onwards is ours to hand out
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM electrolytes")
+        next_id = c.fetchone()[0] + 1
+
+        electrolyte_rows, component_rows, fingerprint_rows, added = [], [], [], []
+        for i, (canonical, fingerprint) in prepared.items():
+            missing = [formula for formula, _ in canonical if formula not in component_ids]
+            if missing:
+                results[i]["detail"] = f"unknown component(s) {', '.join(missing)}"
+                continue
+            if fingerprint in existing:
+                results[i].update(status="duplicate", id=existing[fingerprint], detail=f"same composition as electrolyte {existing[fingerprint]}")
+                continue
+
+            electrolyte_id = next_id
+            next_id += 1
+            existing[fingerprint] = electrolyte_id # later rows in the same batch are duplicates of this one
+            electrolyte_rows.append((electrolyte_id, *map(electrolytes[i].get, ELECTROLYTE_PROPERTIES)))
+            component_rows.extend((electrolyte_id, component_ids[formula], amount) for formula, amount in canonical)
+            added.append((electrolyte_id, dict(canonical)))
+            fingerprint_rows.append((electrolyte_id, fingerprint))
+            results[i].update(status="inserted", id=electrolyte_id)
+
+        c.executemany(f"INSERT INTO electrolytes (id, {', '.join(ELECTROLYTE_PROPERTIES)}) VALUES ({', '.join('?' * (len(ELECTROLYTE_PROPERTIES) + 1))})", electrolyte_rows)
+        c.executemany("INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)", component_rows)
+        c.executemany("INSERT INTO electrolyte_fingerprints (electrolyte_id, fingerprint) VALUES (?, ?)", fingerprint_rows)
+    for electrolyte_id, components in added:
+        composition_index.add(electrolyte_id, components)
+    response_cache.invalidate()
+    return results
+
+def _electrolyte_exists(c, components: dict):
+    c.execute(FINGERPRINT_EXISTS, (composition_fingerprint(components),))
+    return c.fetchone() is not None
 
-        #long query string
-        query_string = "SELECT e.id FROM electrolytes e WHERE e.id IN (SELECT ec.electrolyte_id FROM electrolyte_components ec WHERE "
-        query_conditions = []
-        query_values = []
-        for formula, amount in components.items():
-            chemical = Chemical(formula)
-            query_conditions.append("(ec.component_id = (SELECT ID FROM components WHERE formula = ?) AND ec.amount = ?)")
-            query_values.extend([str(chemical), amount])
-        query_string += " OR ".join(query_conditions) + " GROUP BY ec.electrolyte_id HAVING COUNT(ec.electrolyte_id) = ?)"
-        query_values.append(len(components))
-
-        c.execute(query_string, query_values)
-        candidate_ids = [row[0] for row in c.fetchall()]
-
-        #check that each candidate id doesn't have extra components
-        for id in candidate_ids:
-            c.execute("SELECT COUNT(*) FROM Electrolyte_Components WHERE Electrolyte_ID = ?", (id,))
-            if c.fetchone()[0] != len(components):
-                candidate_ids.remove(id)
-        conn.commit()
-        # If we have at least one result, the electrolyte exists
-        return len(candidate_ids) > 0
+def check_electrolyte_exists(components: dict):
+    '''
+    Checks if an electrolyte with matching components and amounts already exists in the dictionary.
+    '''
+    try:
+        with pool.connection() as conn:
+            # If we have at least one result, the electrolyte exists
+            return _electrolyte_exists(conn.cursor(), components)
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def get_components_by_id(electrolyte_id):
     '''
     takes in electrolyte id, and returns dictionary of components and amounts per component
     '''
-    conn = sqlite3.connect(DB)
     try:
-        c = conn.cursor()
-
-        query = """
-        SELECT c.formula, ec.amount
-        FROM electrolyte_components ec 
-        JOIN components c ON ec.component_id = c.id
-        WHERE ec.electrolyte_id = ?
-        """
-
-        c.execute(query, (electrolyte_id,))
-        result = c.fetchall()
-        # Return the components
-        return {row[0]: row[1] for row in result}
+        with pool.connection() as conn:
+            return search.components_of(conn, [electrolyte_id])[electrolyte_id]
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def add_component_type(
     chemical: Chemical
@@ -324,25 +588,24 @@ def add_component_type(
     '''
     self-evident--only takes in Chemical class
     '''
-    conn = sqlite3.connect(DB)
     try:
-        c = conn.cursor()
+        with pool.transaction(immediate=True) as conn:
+            c = conn.cursor()
 
-        #check if chemical is already in database
-        c.execute("SELECT * FROM components WHERE formula = ?", (chemical.__str__(),))
-        conn.commit()
-        rows = c.fetchall()
+            #check if chemical is already in database
+            c.execute(COMPONENT_BY_FORMULA, (chemical.__str__(),))
+            rows = c.fetchall()
 
-        if(len(rows) != 0):
-            print(f'{str(len(rows))} entries with formula {chemical.__str__()} already in database')
-        else:
-            c.execute("INSERT INTO components (formula, notes, molar_mass, price, is_salt) VALUES (?,?,?,?,?)", (str(chemical),chemical.notes, chemical.molar_mass, chemical.price, chemical.is_salt))
-            conn.commit()
+            if(len(rows) != 0):
+                print(f'{str(len(rows))} entries with formula {chemical.__str__()} already in database')
+            else:
+                c.execute("INSERT INTO components (formula, notes, molar_mass, price, is_salt) VALUES (?,?,?,?,?)", (str(chemical),chemical.notes, chemical.molar_mass, chemical.price, chemical.is_salt))
+                search.index_elements(c, [(c.lastrowid, chemical._parsed)])
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
     finally:
-        conn.close()
+        catalog.invalidate()
+        response_cache.invalidate()
 
 def get_component_type(
     formula: str
@@ -350,28 +613,17 @@ def get_component_type(
     '''
     returns chemical type of a component, from just its formula.
     '''
-    formatted_formula = Chemical(formula).__str__()
+    formatted_formula = Chemical.canonical(formula)
 
-    conn = sqlite3.connect(DB)
     try:
-        c = conn.cursor()
-
-        c.execute("SELECT * FROM components WHERE formula = ?", (Chemical(formula).__str__(),))
-        conn.commit()
-        rows = c.fetchall()
-
-        if len(rows) > 1:
-            print(f'Multiple components found for formula {formula}')
-        elif len(rows) == 0:
+        row = catalog.get(formatted_formula)
+        if row is None:
             print(f'No components found for formula {formula}')
         else:
-            print(rows[0][1], rows[0][2], rows[0][3], rows[0][4])
-            return Chemical(rows[0][1], rows[0][2], rows[0][3], rows[0][4])
+            print(row['formula'], row['notes'], row['molar_mass'], row['price'])
+            return Chemical(row['formula'], row['notes'], row['molar_mass'], row['price'])
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def remove_component_type(
     formula: str
@@ -379,40 +631,77 @@ def remove_component_type(
     '''
     removes component from table just from formula
     '''
-    conn = sqlite3.connect(DB)
     try:
-        c = conn.cursor()
+        with pool.transaction() as conn:
+            c = conn.cursor()
 
-        formatted = Chemical(formula).__str__()
-        print(formatted)
+            formatted = Chemical.canonical(formula)
+            print(formatted)
 
-        c.execute("SELECT * FROM components WHERE formula = ?", (formatted,))
-        conn.commit()
-        fetched = c.fetchall()
-        if len(fetched) == 0:
-            print(f'No components found for formula {formula}')
-        else:
-            c.execute("DELETE FROM components WHERE formula = ?", (formatted,))
-            print("Deleted " + str(len(fetched)) + f" entries for formula {formula}.")
-            conn.commit()
+            c.execute(COMPONENT_BY_FORMULA, (formatted,))
+            fetched = c.fetchall()
+            if len(fetched) == 0:
+                print(f'No components found for formula {formula}')
+            else:
+                # foreign keys are enforced, so this fails while an electrolyte still uses the component
+                c.execute("DELETE FROM components WHERE formula = ?", (formatted,))
+                print("Deleted " + str(len(fetched)) + f" entries for formula {formula}.")
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
     finally:
-        conn.close()
+        catalog.invalidate()
+        response_cache.invalidate()
 
 def remove_electrolyte_by_id(id:int):
-    conn = sqlite3.connect(DB)
     try:
-        c = conn.cursor()
-        c.execute("DELETE FROM electrolytes WHERE id=?", (id,))
-        c.execute("DELETE FROM electrolyte_components WHERE electrolyte_id=?", (id,))
-        conn.commit()
+        with pool.transaction() as conn:
+            c = conn.cursor()
+            # children first, foreign keys are enforced
+            c.execute("DELETE FROM electrolyte_fingerprints WHERE electrolyte_id=?", (id,))
+            c.execute("DELETE FROM electrolyte_components WHERE electrolyte_id=?", (id,))
+            c.execute("DELETE FROM electrolytes WHERE id=?", (id,))
+        composition_index.remove(id)
+        response_cache.invalidate()
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    finally:
-        conn.close()
+
+def check_molar_masses(tolerance: float = 0.01, fix: bool = False):
+    '''
+    recomputes every component's molar mass from its formula in one vectorized pass, and returns the ones whose
+    stored molar_mass is off by more than tolerance (relative), ex: [{"id": 3, "formula": "CaCl2", "stored": 100.0,
+    "computed": 110.98}, ...]. Unparseable formulas are returned with computed = None. fix writes the computed
+    values over the flagged ones.
+    '''
+    import numpy as np
+
+    flagged = []
+    try:
+        with pool.transaction(immediate=fix) as conn:
+            rows = conn.execute("SELECT id, formula, molar_mass FROM components").fetchall()
+            parsed = []
+            for component_id, formula, stored in rows:
+                try:
+                    Chemical.compile_formula(formula)
+                    parsed.append((component_id, formula, stored))
+                except (TypeError, AttributeError):
+                    flagged.append({"id": component_id, "formula": formula, "stored": stored, "computed": None})
+
+            computed = Chemical.molar_masses([formula for _, formula, _ in parsed])
+            stored = np.array([np.nan if value is None else value for _, _, value in parsed], dtype=float)
+            # missing stored values count as wrong
+            off = ~(np.abs(stored - computed) <= tolerance * computed)
+            for i in np.flatnonzero(off):
+                component_id, formula, value = parsed[i]
+                flagged.append({"id": component_id, "formula": formula, "stored": value, "computed": round(float(computed[i]), 4)})
+
+            if fix:
+                conn.executemany("UPDATE components SET molar_mass = ? WHERE id = ?",
+                                 [(row["computed"], row["id"]) for row in flagged if row["computed"] is not None])
+                catalog.invalidate()
+                response_cache.invalidate()
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+    return flagged
 
 app = FastAPI()
 
@@ -424,34 +713,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-async def write_excel():
-    def get_the_time():
-        now = datetime.now()
-        return str(now.strftime("%Y-%m-%d_%H-%M-%S"))
-    conn = sqlite3.connect(DB)
-
-    # List your tables here
-    file_name = f"table_{get_the_time()}.xlsx"
-    filepath = './history/' + file_name
-    tables = ["electrolytes", "electrolyte_components", "components"]
-    with pd.ExcelWriter(filepath) as writer:
-        for table in tables:
-            df = pd.read_sql_query(f"SELECT * from {table}", conn)
-            df.to_excel(writer, sheet_name=table, index = False)
+def _route_of(scope):
+    '''
+    route template for metrics labels (ex: /jobs/{job_id}), so labels don't grow with every distinct URL.
+    '''
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', 'unknown')
+    return 'unmatched'
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    method, route = request.method, _route_of(request.scope)
+    metrics.http_in_flight.inc()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.http_requests.inc(method, route, '500')
+        metrics.http_errors.inc(method, route)
+        raise
+    finally:
+        metrics.http_in_flight.dec()
+        metrics.http_latency.observe(time.perf_counter() - started, method, route)
+    metrics.http_requests.inc(method, route, str(response.status_code))
+    if response.status_code >= 500:
+        metrics.http_errors.inc(method, route)
+    return response
 
-    conn.close()
-    return FileResponse(filepath, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename=file_name)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    '''
+    Prometheus text format: request latency/in-flight/errors, SQLite statement timings by helper, cache counters.
+    '''
+    stats, cached = catalog.stats(), response_cache.stats()
+    extra = (metrics.render_value('components_catalog_hits_total', 'Component lookups served from the in-process catalog.', 'counter', stats['hits'])
+             + metrics.render_value('components_catalog_misses_total', 'Component lookups that had to reload the catalog.', 'counter', stats['misses'])
+             + metrics.render_value('response_cache_hits_total', 'Responses served from the response cache.', 'counter', cached['hits'])
+             + metrics.render_value('response_cache_misses_total', 'Cacheable responses that had to be computed.', 'counter', cached['misses'])
+             + metrics.render_value('response_cache_not_modified_total', 'Conditional requests answered with 304.', 'counter', cached['not_modified'])
+             + metrics.render_value('response_cache_bytes', 'Size of the cached response bodies.', 'gauge', cached['bytes']))
+    return PlainTextResponse(metrics.render(extra), media_type='text/plain; version=0.0.4')
+
+TABLES = ["electrolytes", "electrolyte_components", "components"]
+
+# hourly snapshots into history/ (or SNAPSHOT_DIR), see snapshots.Snapshotter
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', 3600)) # seconds between checks
+SNAPSHOT_XLSX = os.environ.get('SNAPSHOT_XLSX', '1') == '1' # also render an xlsx next to each binary backup
+SNAPSHOT_ARROW = os.environ.get('SNAPSHOT_ARROW', '1') == '1' # and memory-mappable Arrow files, see columnar.py
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', './history')
+snapshotter = snapshots.Snapshotter(DB, SNAPSHOT_DIR, TABLES, xlsx=False, columnar=False, # rendered by render_snapshot_job
+                                    hourly=timedelta(hours=int(os.environ.get('SNAPSHOT_KEEP_HOURS', 24))),
+                                    daily=timedelta(days=int(os.environ.get('SNAPSHOT_KEEP_DAYS', 30))))
+
+# background jobs (exports, uploads, snapshot renderings) in worker processes, see jobs.JobRunner
+JOBS_DIR = os.environ.get('JOBS_DIR', './jobs') # job table and download artifacts
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2)) # jobs running at once
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 8)) # queued + running before new ones get a 429
+job_runner = jobs.JobRunner(JOBS_DIR, JOB_WORKERS, JOB_MAX_PENDING, keep=timedelta(hours=int(os.environ.get('JOB_KEEP_HOURS', 24))))
+
+def render_snapshot_job(job, path):
+    '''
+    worker side of the hourly snapshot: the xlsx and Arrow renderings of the backup at path.
+    '''
+    snapshots.render(path, TABLES, ELECTROLYTE_PROPERTIES, SNAPSHOT_XLSX, SNAPSHOT_ARROW)
+    return {"snapshot": path}
 
 async def save_tables():
     while True:
-        await write_excel()
-        #logger.debug("write_excel run")
-        await asyncio.sleep(3600)
+        try:
+            path = await db_executor.run(snapshotter.run, heavy=True)
+            if path:
+                logger.info(f"Snapshot written to {path}")
+                if SNAPSHOT_XLSX or SNAPSHOT_ARROW:
+                    await db_executor.run(job_runner.submit, 'snapshot', render_snapshot_job, path)
+            await db_executor.run(job_runner.prune)
+        except Exception as e:
+            logger.error(f"Snapshot failed: {e}")
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+async def expire_cursors():
+    # a parked /execute_sql/ cursor holds a read transaction; don't leave it to the next request to close
+    while True:
+        await asyncio.sleep(max(1.0, SQL_CURSOR_TTL / 3))
+        try:
+            await db_executor.run(query_service.expire)
+        except Exception as e:
+            logger.error(f"Closing expired SQL cursors failed: {e}")
+
+def bootstrap():
+    '''
+    applies pending schema migrations, then fills the derived tables for rows that predate them. Idempotent and quick once done, so it runs in-process before the app takes requests (and before the CLI
+    commands) rather than as separate python processes in start.sh.
+    '''
+    migrations.migrate(DB, logger)
+    count = backfill_fingerprints()
+    if count:
+        logger.info(f"Wrote {count} electrolyte fingerprints")
+    count = backfill_component_elements()
+    if count:
+        logger.info(f"Indexed the elements of {count} components")
 
 @app.on_event("startup")
 async def startup_event():
+    pool.guard = executor_only
+    await db_executor.run(bootstrap, heavy=True, task='bootstrap')
+    count = await db_executor.run(job_runner.recover)
+    if count:
+        logger.info(f"Marked {count} interrupted jobs as failed")
     logger.info("Server Started")
     asyncio.create_task(save_tables())
+    asyncio.create_task(expire_cursors())
+
+@app.on_event("shutdown")
+def shutdown_event():
+    db_executor.shutdown()
+    job_runner.close()
+    snapshotter.close()
+    query_service.close()
+    catalog.close()
+    response_cache.close()
+    export_pool.close()
+    pool.close()
 
 app.mount("/static", StaticFiles(directory="../static"), name="static")
 app.mount("/favicon.ico", StaticFiles(directory="../static"), name="favicon")
@@ -466,6 +850,19 @@ templates = Jinja2Templates(directory="../templates")
 async def static(request: Request):
     return templates.TemplateResponse("alec.html", {"request": request})
 
+def str2dict(string1: str, string2: str):
+    '''
+    the form's component_types and amounts fields -> {formula: amount}, ex: ("CaCl2 C4H6O3", ".75 3")
+    '''
+    # Split the strings into lists
+    str_list = string1.split()
+    float_list = [float(x) for x in string2.split()]
+
+    if len(str_list) != len(float_list): raise ValueError
+    # Create a dictionary from the two lists
+    dictionary = dict(zip(str_list, float_list))
+    return dictionary
+
 @app.post("/input_electrolyte/")
 async def input_electrolyte(
     request: Request,
@@ -482,16 +879,6 @@ async def input_electrolyte(
     v_window_high_bound: Optional[float] = Form(None),
     surface_tension: Optional[float] = Form(None),
 ):
-    def str2dict(string1 = component_types, string2 = amounts):
-        # Split the strings into lists
-        str_list = string1.split()
-        float_list = [float(x) for x in string2.split()]
-
-        if len(str_list) != len(float_list): raise ValueError
-        # Create a dictionary from the two lists
-        dictionary = dict(zip(str_list, float_list))
-        return dictionary
-    
     components = str2dict(component_types, amounts)
 
     def str_to_float(s):
@@ -505,7 +892,7 @@ async def input_electrolyte(
     surface_tension = str_to_float(surface_tension)
 
     try:
-        add_electrolyte(
+        await db_executor.run(add_electrolyte,
             components,
             conductivity,
             conduct_uncert_bound,
@@ -532,6 +919,145 @@ async def input_electrolyte(
     response = RedirectResponse(url=url, status_code=303)
     return response
 
+class ElectrolyteIn(BaseModel):
+    '''
+    one measurement for /electrolytes/batch, same fields as the /input_electrolyte/ form.
+    '''
+    components: Dict[str, float] # {formula: amount}, salts in g and solvents in mL
+    conductivity: float
+    conduct_uncert_bound: float
+    concent_uncert_bound: float
+
+    density: Optional[float] = None
+    temperature: Optional[float] = None
+    viscosity: Optional[float] = None
+    v_window_low_bound: Optional[float] = None
+    v_window_high_bound: Optional[float] = None
+    surface_tension: Optional[float] = None
+
+    @field_validator('components')
+    @classmethod
+    def components_not_empty(cls, components):
+        if not components:
+            raise ValueError('an electrolyte needs at least one component')
+        return components
+
+@app.post("/electrolytes/batch")
+async def input_electrolytes_batch(electrolytes: List[ElectrolyteIn]):
+    '''
+    JSON bulk insert for instrument runs: [{"components": {"CaCl2": .75, "C4H6O3": 3}, "conductivity": ..., ...}, ...]
+    returns per-row status, see add_electrolytes.
+    '''
+    results = await db_executor.run(add_electrolytes, [electrolyte.model_dump() for electrolyte in electrolytes])
+    counts = Counter(result["status"] for result in results)
+    # plain JSON types already; a returned dict would go through jsonable_encoder, which costs more than the inserts' Python side
+    return JSONResponse({"inserted": counts["inserted"], "duplicate": counts["duplicate"], "rejected": counts["rejected"], "results": results})
+
+# min_<property> / max_<property> query parameters for every electrolyte property, inclusive
+PropertyRanges = create_model('PropertyRanges', **{f'{bound}_{name}': (Optional[float], None)
+                                                   for name in ELECTROLYTE_PROPERTIES for bound in ('min', 'max')})
+
+def find_electrolytes(ranges: dict, components: list, sort: str, descending: bool, limit: int, cursor: Optional[str]):
+    '''
+    blocking part of GET /electrolytes: resolves component formulas to ids, then see search.search_electrolytes.
+    raises ValueError on unknown components or bad parameters.
+    '''
+    formulas = [Chemical.canonical(formula) for formula in components]
+    with pool.transaction() as conn: # the page and its components come from the same snapshot
+        component_ids = _component_ids(formulas)
+        unknown = [formula for formula in formulas if formula not in component_ids]
+        if unknown:
+            raise ValueError(f"Unknown component(s) {', '.join(unknown)}")
+        return search.search_electrolytes(conn, ELECTROLYTE_PROPERTIES, ranges, [component_ids[formula] for formula in formulas],
+                                          sort, descending, limit, cursor)
+
+@app.get("/electrolytes")
+async def list_electrolytes(
+    bounds: PropertyRanges = Depends(),
+    component: List[str] = Query([]), # repeatable, electrolytes containing all of them
+    sort: str = 'id', # id or any property; rows without a value for it come last
+    order: str = 'asc',
+    limit: int = search.DEFAULT_LIMIT,
+    cursor: Optional[str] = None, # next_cursor from the previous page
+):
+    '''
+    filtered, sorted, keyset-paginated electrolytes with their components, ex:
+    /electrolytes?min_conductivity=500&max_temperature=30&component=CaCl2&sort=conductivity&order=desc
+    returns {"electrolytes": [{"id": ..., "conductivity": ..., ..., "components": {formula: amount}}, ...], "next_cursor": ...}
+    '''
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    ranges = {name: (getattr(bounds, f'min_{name}'), getattr(bounds, f'max_{name}')) for name in ELECTROLYTE_PROPERTIES}
+    try:
+        return await db_executor.run(find_electrolytes, ranges, component, sort, order == 'desc', limit, cursor)
+    except TypeError:
+        raise HTTPException(status_code=400, detail="Your formula syntaxes are wrong somehow.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+
+def find_by_elements(where: str, limit: int):
+    constraints = search.parse_element_constraints(where, Chemical.ELEMENT_NUMBERS)
+    with pool.transaction() as conn:
+        return {"constraints": [f'{element}{op}{count}' for element, op, count in constraints],
+                **search.element_search(conn, constraints, limit)}
+
+@app.get("/elements/search")
+async def search_by_elements(where: str, limit: int = search.MAX_LIMIT):
+    '''
+    components and electrolytes by element counts, ex: /elements/search?where=Li>=1,F>=6,Cl=0
+    (URL-encoded), see search.element_search.
+    '''
+    try:
+        return await db_executor.run(find_by_elements, where, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+
+def similar_electrolytes(components: dict, k: int, metric: str):
+    canonical = {}
+    for formula, amount in components.items():
+        canonical[Chemical.canonical(formula)] = canonical.get(Chemical.canonical(formula), 0) + amount
+    nearest = composition_index.nearest(canonical, k, metric)
+    with pool.connection() as conn:
+        electrolyte_components = search.components_of(conn, [electrolyte_id for electrolyte_id, _ in nearest])
+    # an electrolyte deleted since the matrix was read has no components left, leave it out
+    return [{"id": electrolyte_id, "distance": distance, "components": electrolyte_components[electrolyte_id]}
+            for electrolyte_id, distance in nearest if electrolyte_components[electrolyte_id]]
+
+@app.post("/electrolytes/similar")
+async def electrolytes_similar(
+    component_types: str = Form(...),
+    amounts: str = Form(...),
+    k: int = Form(10),
+    metric: str = Form('cosine'), # or 'l1'
+):
+    '''
+    the k electrolytes whose normalized composition is closest to the given one, same component_types/amounts
+    fields as /input_electrolyte/. returns [{"id": ..., "distance": ..., "components": {formula: amount}}, ...]
+    '''
+    try:
+        components = str2dict(component_types, amounts)
+        return await db_executor.run(similar_electrolytes, components, k, metric, heavy=True)
+    except TypeError:
+        raise HTTPException(status_code=400, detail="Your formula syntaxes are wrong somehow.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=e.args[0] if e.args else "component_types and amounts don't match up")
+
+def electrolyte_costs(after: int, limit: int):
+    '''
+    recomputes the costs invalidated since the last call, then reads a page of them, see costs.py.
+    '''
+    with pool.connection() as conn:
+        costs.refresh(conn)
+        return costs.read(conn, after, limit)
+
+@app.get("/electrolytes/costs")
+async def list_electrolyte_costs(after: int = 0, limit: int = 1000):
+    '''
+    [{"id", "cost", "salt_moles", "cost_per_mol_salt", "complete", "conductivity"}, ...] in id order, for ids past
+    after; pass the last id back as after for the next page.
+    '''
+    return await db_executor.run(electrolyte_costs, after, max(1, min(limit, 10000)), heavy=True)
+
 @app.get("/input_electrolyte/", response_class=HTMLResponse)
 async def input_electrolyte_form(request: Request, message: Optional[str] = None):
     return templates.TemplateResponse("alec.html", {"request": request, "message": message})
@@ -541,7 +1067,7 @@ async def input_component(
     request: Request, #NONE OF THESE ARE ACTUALLY OPTIONAL, FASTAPI IS JUST WEIRD
     formula: Optional[str] = Form(...),
     notes: Optional[str] = Form(None),
-    molar_mass: Optional[float] = Form(...),
+    molar_mass: Optional[float] = Form(None), # computed from the formula when left blank
     price: Optional[float] = Form(...),
     is_salt: Optional[bool] = Form(None),
 ):
@@ -549,7 +1075,7 @@ async def input_component(
         _is_salt = is_salt == "on"
         response_str = 'Success!'
         component = Chemical(formula, notes, molar_mass, price, _is_salt)
-        add_component_type(component)
+        await db_executor.run(add_component_type, component)
 
     except Exception as e:
         response_str = "Error Occurred, see message and try again: " + str(e.args[0])
@@ -560,45 +1086,411 @@ async def input_component(
     return response
 
 
+@app.get("/components/molar_masses")
+async def components_molar_masses(tolerance: float = 0.01, fix: bool = False):
+    '''
+    components whose stored molar mass disagrees with their formula by more than tolerance (relative).
+    '''
+    flagged = await db_executor.run(check_molar_masses, tolerance, fix, heavy=True)
+    return {"tolerance": tolerance, "fixed": fix, "flagged": flagged}
+
+@app.get("/components/cache")
+async def components_cache():
+    '''
+    hit/miss counters of the in-process components catalog.
+    '''
+    return catalog.stats()
+
 @app.get("/input_component/", response_class=HTMLResponse)
 async def input_component_form(request: Request, message: Optional[str] = None):
     return templates.TemplateResponse("alec.html", {"request": request, "message": message})
 
+# results that depend on more than the database contents; they skip the response cache and get no ETag
+NONDETERMINISTIC_SQL = re.compile(r"\b(random|randomblob|changes|total_changes|last_insert_rowid|current_date|current_time|current_timestamp)\b"
+                                  r"|'now'|\b(date|time|datetime|julianday|unixepoch)\s*\(\s*\)", re.IGNORECASE)
+
+def _invalidate_caches():
+    # blocking: the catalog and response cache take their locks, which their readers hold over SQLite calls
+    composition_index.invalidate()
+    catalog.invalidate()
+    response_cache.invalidate()
+
+async def _validators(request: Request, key: str, weak: bool = False):
+    '''
+    (version, headers, not_modified) for a response that is a function of the database contents and key alone:
+    headers carry its ETag, and not_modified says the client's If-None-Match already has it (GETs only).
+    weak is for bodies that are equivalent but not byte-identical when rebuilt, ex: xlsx, which has timestamps in it.
+    '''
+    version = await db_executor.run(response_cache.version)
+    etag = response_cache.etag(key, version)
+    headers = {"ETag": f'W/{etag}' if weak else etag, "Cache-Control": "no-cache"} # revalidate every time, it's cheap
+    not_modified = request.method == 'GET' and response_cache.matches(request.headers.get('if-none-match'), headers["ETag"])
+    return version, headers, not_modified
+
+SQL_PAGE_FORMATS = {'json': 'rows', 'columns': 'columns'} # format -> QueryService.page layout
+
+def _accepts_gzip(request: Request):
+    for coding in request.headers.get('accept-encoding', '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() == 'gzip' and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            return True
+    return False
+
+def _render_page(sql_query, cursor, page_size, layout, compress):
+    '''
+    blocking: one page as the JSON bytes to send, gzipped if compress.
+    '''
+    body = JSONResponse(content=query_service.page(sql_query, cursor, page_size, layout)).body
+    return gzip.compress(body, compresslevel=SQL_GZIP_LEVEL) if compress else body
+
+async def _sql_page(request: Request, sql_query: str, cursor: Optional[str], page_size: Optional[int], format: str):
+    '''
+    a read-only page, from response_cache when it can be. Bodies are stored as sent, so a gzipped page is
+    compressed once per database version, not once per request.
+    '''
+    layout = SQL_PAGE_FORMATS[format]
+    compress = SQL_GZIP_LEVEL > 0 and _accepts_gzip(request)
+    key = json.dumps(['execute_sql', sql_query, cursor, page_size, layout, compress]) # each encoding has its own ETag
+    cacheable = not NONDETERMINISTIC_SQL.search(sql_query)
+    headers, body = {}, None
+    if cacheable:
+        version, headers, not_modified = await _validators(request, key)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        body = response_cache.get(key, version)
+    if body is None:
+        body = await db_executor.run(_render_page, sql_query, cursor, page_size, layout, compress, heavy=True, task='execute_sql')
+        if cacheable:
+            response_cache.put(key, version, body)
+    headers["Vary"] = "Accept-Encoding"
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type='application/json', headers=headers)
+
 @app.post("/execute_sql/")
-async def execute_sql(sql_query: str = Form(...)):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute(sql_query)
-    results = c.fetchall()
-    conn.commit()
-    conn.close()
+async def execute_sql(
+    request: Request,
+    sql_query: str = Form(...),
+    cursor: Optional[str] = Form(None), # next_cursor from the previous page
+    page_size: Optional[int] = Form(None),
+    format: str = Form('json'), # 'columns' for column-major pages, or 'ndjson' to stream every row (up to SQL_MAX_ROWS)
+    write: bool = Form(False),
+    x_sql_write_token: Optional[str] = Header(None),
+):
+    '''
+    runs one statement read-only, under a time budget and row cap, and returns a page of it:
+    {"columns": [...], "rows": [[...], ...], "row_offset": n, "next_cursor": token or null, "truncated": bool,
+     "query_id": id}; GET /execute_sql/ continues from next_cursor, or revalidates by query_id.
+    format=columns returns {"columns": [{"name": ..., "type": ...}, ...], "data": [[...], ...], "row_count": n, ...}
+    instead, one array per column; pages are gzipped for clients that accept it.
+    write=true runs it on a writable connection instead, and needs the X-SQL-Write-Token header.
+    '''
+    if not write and format not in SQL_PAGE_FORMATS and format != 'ndjson':
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}; choose from {', '.join(SQL_PAGE_FORMATS)}, ndjson")
+    try:
+        if write:
+            if not SQL_WRITE_TOKEN or not secrets.compare_digest(x_sql_write_token or '', SQL_WRITE_TOKEN):
+                raise HTTPException(status_code=403, detail="Write mode needs a valid X-SQL-Write-Token header")
+            results = await db_executor.run(query_service.execute_write, sql_query, heavy=True, task='execute_sql')
+            await db_executor.run(_invalidate_caches)
+        elif format == 'ndjson':
+            _take_stream_slot()
+            try:
+                lines = await db_executor.run(query_service.stream, sql_query, heavy=True, task='execute_sql')
+            except BaseException:
+                stream_slots.release()
+                raise
+            return StreamingResponse(_slotted(lines), media_type='application/x-ndjson')
+        else:
+            return await _sql_page(request, sql_query, cursor, page_size, format)
+    except QueryError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.args[0])
     return JSONResponse(content=results)
 
+@app.get("/execute_sql/")
+async def execute_sql_page(request: Request, query_id: Optional[str] = None, cursor: Optional[str] = None,
+                           page_size: Optional[int] = None, format: str = 'json'):
+    '''
+    read-only pages of a statement POSTed to /execute_sql/, by reference: query_id (from any of its pages) gets the
+    first page again, cursor the one after a previous page. The statement itself never goes in the URL, where it
+    would hit length limits and end up in access logs; a 404 means the server has forgotten it, POST it again.
+    Pages come with an ETag, and sending it back in If-None-Match gets a 304 until the database changes.
+    format is json or columns.
+    '''
+    if format not in SQL_PAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}; choose from {', '.join(SQL_PAGE_FORMATS)}")
+    try:
+        sql_query = query_service.statement(query_id, cursor)
+        return await _sql_page(request, sql_query, cursor, page_size, format)
+    except QueryError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.args[0])
+
+def _stream_export(stream, plan):
+    # one read transaction for the whole download, so every table comes from the same snapshot
+    with export_pool.transaction() as conn:
+        yield from stream(conn, plan)
+
+def _take_stream_slot():
+    if not stream_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail=f"{EXPORT_STREAMS} downloads are already streaming, try again shortly",
+                            headers={"Retry-After": "5"})
+
+def _slotted(chunks):
+    '''
+    chunks, holding the slot from _take_stream_slot until they run out or the response is closed or collected.
+    Started here, so that also holds for a response that never gets to send anything.
+    '''
+    def guarded():
+        try:
+            yield b''
+            yield from chunks
+        finally:
+            chunks.close()
+            stream_slots.release()
+    started = guarded()
+    next(started)
+    return started
+
+def _export_xlsx(plan):
+    with pool.transaction() as conn:
+        return export.xlsx_tempfile(conn, plan)
+
+def _cache_file(key, version, path):
+    '''
+    moves a finished export into response_cache and returns its body, or None (file left alone) if it's too big.
+    '''
+    if os.path.getsize(path) > response_cache.max_entry_bytes:
+        return None
+    with open(path, 'rb') as file:
+        body = file.read()
+    os.remove(path)
+    response_cache.put(key, version, body)
+    return body
+
+def _row_progress(job, total):
+    '''
+    progress(rows) callback for the exporters that reports to job as a fraction of total rows.
+    '''
+    done = 0
+    def progress(rows):
+        nonlocal done
+        done += rows
+        job.progress(done / max(total, 1), f"{done} of {total} rows")
+    return progress
+
+def export_job(job, plan, filename):
+    '''
+    worker side of /download_excel/?format=xlsx&background=1.
+    '''
+    path = job.artifact_path('xlsx')
+    with pool.transaction() as conn:
+        total = sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table, _ in plan)
+        export.write_xlsx(conn, plan, path, progress=_row_progress(job, total))
+    return {"artifact": path, "filename": filename, "media_type": export.FORMATS['xlsx'][0], "rows": total}
+
+async def _submit(kind, fn, *args, on_done=None):
+    '''
+    queues a job and answers 202 with where to follow it, 429 when too many are already waiting, or 503 when
+    the worker processes can't be started.
+    '''
+    try:
+        job_id = await db_executor.run(job_runner.submit, kind, fn, *args, on_done=on_done)
+    except jobs.TooManyJobs as e:
+        raise HTTPException(status_code=429, detail=e.args[0])
+    except jobs.JobsUnavailable as e:
+        raise HTTPException(status_code=503, detail=e.args[0])
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
 @app.get("/download_excel/")
-async def download_excel():
+async def download_excel(request: Request, format: str = 'xlsx', tables: Optional[str] = None, columns: Optional[str] = None,
+                         background: bool = False):
+    '''
+    exports the tables as xlsx (default), csv or ndjson, streamed from the database in chunks. tables and columns
+    are optional comma-separated filters, ex: /download_excel/?format=csv&tables=components&columns=formula,molar_mass
+    background=1 (xlsx only) answers 202 with a job id right away instead, see /jobs/{job_id}.
+    Every download has an ETag, so If-None-Match gets a 304 while the database is unchanged; xlsx files up to
+    RESPONSE_CACHE_ENTRY_MB are also kept in the response cache (csv and ndjson stream, so they are rebuilt).
+    At most EXPORT_STREAMS csv/ndjson downloads stream at once; past that, a 503 with Retry-After.
+    '''
     print("Download Excel function called.")  # Log message
-    conn = sqlite3.connect(DB)
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}; choose from {', '.join(export.FORMATS)}")
 
-    # List your tables here
-    tables = ["electrolytes", "electrolyte_components", "components"]
-    with pd.ExcelWriter('tables.xlsx') as writer:
-        for table in tables:
-            df = pd.read_sql_query(f"SELECT * from {table}", conn)
-            df.to_excel(writer, sheet_name=table, index = False)
+    def plan_export():
+        with pool.connection() as conn:
+            return export.plan_export(conn, TABLES, tables, columns)
+    try:
+        plan = await db_executor.run(plan_export)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+    if format == 'csv' and len(plan) != 1:
+        raise HTTPException(status_code=400, detail="csv exports one table at a time, pick it with ?tables=")
+
+    media_type, extension = export.FORMATS[format]
+    filename = f"{plan[0][0] if len(plan) == 1 and tables else 'tables'}.{extension}"
+
+    if format == 'xlsx' and background:
+        return await _submit('export', export_job, plan, filename)
+
+    key = json.dumps(['download_excel', format, plan]) # the resolved plan, so equivalent filters share an entry
+    version, headers, not_modified = await _validators(request, key, weak=format == 'xlsx')
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if format == 'xlsx':
+        body = response_cache.get(key, version)
+        if body is not None:
+            return Response(body, media_type=media_type, headers=headers)
+        # zip container, so it can't go out before it's finished: build it in a per-request temp file instead
+        path = await db_executor.run(_export_xlsx, plan, heavy=True)
+        body = await db_executor.run(_cache_file, key, version, path)
+        if body is not None:
+            return Response(body, media_type=media_type, headers=headers)
+        cleanup = BackgroundTasks()
+        cleanup.add_task(os.remove, path)
+        return FileResponse(path, media_type=media_type, headers=headers, background=cleanup)
+
+    stream = export.stream_csv if format == 'csv' else export.stream_ndjson
+    _take_stream_slot()
+    return StreamingResponse(_slotted(_stream_export(stream, plan)), media_type=media_type, headers=headers)
+
+def _export_columnar(table, format):
+    with pool.transaction() as conn:
+        return columnar.export_tempfile(conn, table, ELECTROLYTE_PROPERTIES, format)
+
+def columnar_job(job, table, format):
+    '''
+    worker side of /download_columnar/?background=1.
+    '''
+    media_type, extension = columnar.FORMATS[format]
+    path = job.artifact_path(extension)
+    with pool.transaction() as conn:
+        total = conn.execute(f'SELECT COUNT(*) FROM "{"electrolytes" if table == columnar.WIDE else table}"').fetchone()[0]
+        columnar.export(conn, table, ELECTROLYTE_PROPERTIES, path, format, progress=_row_progress(job, total))
+    return {"artifact": path, "filename": f"{table}.{extension}", "media_type": media_type, "rows": total}
+
+@app.get("/download_columnar/")
+async def download_columnar(table: str = columnar.WIDE, format: str = 'arrow', background: bool = False):
+    '''
+    one table as a typed columnar file: arrow (IPC file, memory-mappable, default) or parquet. table is one of
+    TABLES or 'wide' (default): one row per electrolyte, one amount column per component. background=1 answers
+    202 with a job id right away instead.
+    '''
+    if format not in columnar.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}; choose from {', '.join(columnar.FORMATS)}")
+    if table != columnar.WIDE and table not in TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table {table}; choose from {columnar.WIDE}, {', '.join(TABLES)}")
+    if background:
+        return await _submit('export', columnar_job, table, format)
+    path = await db_executor.run(_export_columnar, table, format, heavy=True)
+    cleanup = BackgroundTasks()
+    cleanup.add_task(os.remove, path)
+    media_type, extension = columnar.FORMATS[format]
+    return FileResponse(path, media_type=media_type, filename=f"{table}.{extension}", background=cleanup)
+
+def load_excel(file):
+    '''
+    blocking: stages, checks and merges an uploaded workbook, see importer.import_workbook.
+    '''
+    with pool.connection() as conn:
+        return importer.import_workbook(conn, file, Chemical.canonical, composition_fingerprint, lambda formula: Chemical.compile_formula(formula)[0])
 
-    conn.close()
+def import_job(job, path):
+    '''
+    worker side of /upload_excel/?background=1; path is the saved upload, removed when done.
+    '''
+    try:
+        with open(path, 'rb') as file, pool.connection() as conn:
+            report = importer.import_workbook(conn, file, Chemical.canonical, composition_fingerprint,
+                                              lambda formula: Chemical.compile_formula(formula)[0], progress=job.progress)
+    finally:
+        os.remove(path)
+    return {"message": "Data successfully uploaded from Excel file", **report}
 
-    return FileResponse('tables.xlsx', media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename='tables.xlsx')
+def _save_upload(file):
+    fd, path = tempfile.mkstemp(suffix='.xlsx', prefix='upload_', dir=JOBS_DIR)
+    with os.fdopen(fd, 'wb') as saved:
+        shutil.copyfileobj(file, saved)
+    return path
 
 @app.post("/upload_excel/")
-async def upload_excel(file: UploadFile = File(...)):
-    df_dict = pd.read_excel(file.file, sheet_name=None)
-
-    conn = sqlite3.connect(DB)
-
-    for table_name, df in df_dict.items():
-        df.to_sql(table_name, conn, if_exists='append', index=False)
-
-    conn.close()
+async def upload_excel(file: UploadFile = File(...), background: bool = False):
+    '''
+    imports a workbook laid out like the export. background=1 answers 202 with a job id right away instead of
+    the report, which is then the job's result.
+    '''
+    if background:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        path = await db_executor.run(_save_upload, file.file)
+        try:
+            return await _submit('import', import_job, path, on_done=_invalidate_caches)
+        except HTTPException:
+            os.remove(path)
+            raise
+    try:
+        report = await db_executor.run(load_excel, file.file, heavy=True)
+        await db_executor.run(_invalidate_caches)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+    return {"detail": "Data successfully uploaded from Excel file", **report}
 
-    return {"detail": "Data successfully uploaded from Excel file"}
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    '''
+    status (queued, running, done, failed or cancelled), progress from 0 to 1, a message and, once done, the
+    result and a download_url if the job made a file.
+    '''
+    job = await db_executor.run(job_runner.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.pop("download"):
+        job["download_url"] = f"/jobs/{job_id}/download"
+    return job
+
+@app.get("/jobs/{job_id}/download")
+async def download_job(job_id: str):
+    artifact = await db_executor.run(job_runner.artifact, job_id)
+    if artifact is None:
+        job = await db_executor.run(job_runner.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}, nothing to download")
+    path, filename, media_type = artifact
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    '''
+    a queued job is dropped, a running one stops at its next progress update; finished jobs are left alone.
+    '''
+    job = await db_executor.run(job_runner.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("download")
+    return job
+
+if __name__ == "__main__":
+    migrations.migrate(DB)
+    # python3 main.py backfill_fingerprints [--rebuild]
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill_fingerprints':
+        count = backfill_fingerprints(rebuild='--rebuild' in sys.argv[2:])
+        print(f"Wrote {count} electrolyte fingerprints.")
+    # python3 main.py check_molar_masses [--fix]
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check_molar_masses':
+        for row in check_molar_masses(fix='--fix' in sys.argv[2:]):
+            print(f"{row['id']}\t{row['formula']}\tstored {row['stored']}\tcomputed {row['computed']}")
+    # python3 main.py backfill_component_elements [--rebuild]
+    elif len(sys.argv) > 1 and sys.argv[1] == 'backfill_component_elements':
+        count = backfill_component_elements(rebuild='--rebuild' in sys.argv[2:])
+        print(f"Indexed the elements of {count} components.")
+    # python3 main.py check_query_plans: exits 1 if a hot query scans a whole table, see HOT_QUERIES
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check_query_plans':
+        with pool.connection() as conn:
+            for name, (sql, parameters) in HOT_QUERIES.items():
+                print(f"{name}:")
+                for line in migrations.query_plan(conn, sql, parameters):
+                    print(f"    {line}")
+            scans = migrations.full_scans(conn, HOT_QUERIES)
+        for name, lines in scans.items():
+            print(f"FULL SCAN in {name}: {'; '.join(lines)}")
+        sys.exit(1 if scans else 0)
@@ -0,0 +1,177 @@
+'''
+In-process metrics, served at /metrics in the Prometheus text format. The HTTP middleware in main.py records
+per-route latency, in-flight and error counts; TimedConnection (the pools' connection factory) times every
+SQLite statement and tags it with the helper the DatabaseExecutor is running, and statements slower than the
+configured threshold are also written to the slow-query log.
+'''
+
+import bisect
+import sqlite3
+import threading
+import time
+
+from database import current_task
+
+HTTP_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+class _Metric:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self, kind):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {kind}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self._header(self.kind) + [f'{self.name}{_labels(self.labels, key)} {value:g}' for key, value in sorted(values.items())]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(_Metric):
+    def __init__(self, name, help, labels=(), buckets=HTTP_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def count(self, *labels):
+        '''
+        observations so far for labels, or across all label values when none are given.
+        '''
+        with self._lock:
+            return sum(sum(buckets) for key, (buckets, _) in self._values.items() if not labels or key == labels)
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(buckets), total) for key, (buckets, total) in self._values.items()}
+        lines = self._header('histogram')
+        for key, (buckets, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {cumulative}')
+        return lines
+
+http_requests = Counter('http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status'))
+http_errors = Counter('http_request_errors_total', 'HTTP requests that failed with a 5xx or an exception.', ('method', 'route'))
+http_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being handled right now.')
+http_latency = Histogram('http_request_duration_seconds', 'Time until the response starts, by route.', ('method', 'route'))
+sql_latency = Histogram('sqlite_statement_duration_seconds', 'SQLite statement execution time, by calling helper.', ('helper',), SQL_BUCKETS)
+sql_slow = Counter('sqlite_slow_statements_total', 'Statements over the slow-query threshold, by calling helper.', ('helper',))
+
+http_in_flight.inc(amount=0) # so the gauge is there from the first scrape
+
+METRICS = [http_requests, http_errors, http_in_flight, http_latency, sql_latency, sql_slow]
+
+# slow-query log, see configure_slow_query_log
+_slow_seconds = None
+_slow_logger = None
+
+def configure_slow_query_log(seconds, logger):
+    '''
+    statements slower than seconds are logged as warnings on logger; None turns the log off.
+    '''
+    global _slow_seconds, _slow_logger
+    _slow_seconds, _slow_logger = seconds, logger
+
+def _record(sql, started):
+    elapsed = time.perf_counter() - started
+    helper = current_task() or 'other'
+    sql_latency.observe(elapsed, helper)
+    if _slow_seconds is not None and elapsed >= _slow_seconds:
+        sql_slow.inc(helper)
+        if _slow_logger is not None:
+            _slow_logger.warning(f'slow query {elapsed * 1e3:.1f} ms in {helper}: {" ".join(str(sql).split())[:500]}')
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, started)
+
+class TimedConnection(sqlite3.Connection):
+    '''
+    connection factory for sqlite3.connect: statements run through it or its cursors are timed (execution up to
+    the first row; fetching the rest isn't included).
+    '''
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, started)
+
+    def commit(self): # transaction() commits through the method, and that's where the fsync happens
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record('COMMIT', started)
+
+def render(extra=()):
+    '''
+    every metric in the Prometheus text exposition format; extra is more lines, ex: from render_value.
+    '''
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += extra
+    return '\n'.join(lines) + '\n'
+
+def render_value(name, help, kind, value):
+    '''
+    lines for a value read at scrape time instead of recorded, ex: cache counters kept elsewhere.
+    '''
+    return [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {value:g}']
@@ -0,0 +1,311 @@
+'''
+Versioned schema. PRAGMA user_version holds the number of the last migration applied to a database; migrate()
+applies the newer ones in order, each in its own write transaction together with the version bump, so a
+migration is either fully in or not at all, and two workers starting at once apply it exactly once. Migrations
+are only ever appended: a schema change is a new entry at the end of MIGRATIONS, never an edit to an old one.
+
+full_scans() runs EXPLAIN QUERY PLAN over a set of statements (main.HOT_QUERIES, the ones the request paths run
+most) to catch a missing or unusable index; python3 main.py check_query_plans exits 1 when one scans a whole table.
+'''
+
+import re
+import sqlite3
+
+from database import transaction
+
+# the columns every table of the baseline schema must have, whichever code created it
+BASELINE_COLUMNS = {
+    'components': ('id', 'formula', 'notes', 'molar_mass', 'price', 'is_salt'),
+    'electrolyte_components': ('electrolyte_id', 'component_id', 'amount'),
+    'electrolytes': ('id', 'conductivity', 'conduct_uncert_bound', 'concent_uncert_bound', 'density', 'temperature',
+                     'viscosity', 'v_window_low_bound', 'v_window_high_bound', 'surface_tension'),
+    'electrolyte_fingerprints': ('electrolyte_id', 'fingerprint'),
+    'component_elements': ('component_id', 'element', 'count'),
+    'components_version': ('id', 'version'),
+    'electrolyte_costs': ('electrolyte_id', 'cost', 'salt_moles', 'complete'),
+}
+
+def _index(conn, name, table, columns):
+    '''
+    creates index name on table (columns), or recreates it if a database already has one by that name on other columns.
+    '''
+    existing = [row[2] for row in conn.execute(f'PRAGMA index_info({name})')]
+    if existing and existing != list(columns):
+        conn.execute(f'DROP INDEX {name}')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+def _trigger(conn, name, definition):
+    '''
+    (re)creates trigger name, so one left by older code gets the current body; triggers hold no data.
+    '''
+    conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute(f'CREATE TRIGGER {name} {definition}')
+
+def _verify_columns(conn, *tables):
+    '''
+    raises RuntimeError (rolling the migration back, so user_version isn't stamped) if one of tables was already
+    there without some of its BASELINE_COLUMNS.
+    '''
+    for table in tables:
+        present = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        missing = [column for column in BASELINE_COLUMNS[table] if column not in present]
+        if missing:
+            raise RuntimeError(f"Can't adopt this database: table {table} has no column {', '.join(missing)}")
+
+def _baseline(conn):
+    '''
+    the schema as test.start_server created it before versioning. Tables are IF NOT EXISTS and then checked for
+    their columns, indexes are checked for theirs and triggers recreated, so it also adopts databases made by that
+    code, whichever version of it.
+    '''
+    c = conn.cursor()
+
+    #THIS DATABASE IS A LOOKUP TABLE FOR COMPONENTS
+    #NEEDS STRICT CONVENTIONS FOR FORMULA FORMATTING
+    c.execute('''
+            CREATE TABLE IF NOT EXISTS components
+            (
+            id INTEGER PRIMARY KEY,
+            formula TEXT,
+            notes TEXT,
+            molar_mass REAL,
+            price REAL,
+            is_salt INTEGER
+            );
+            ''')
+
+    #NEEDS SPECIFICATION FOR DECIMAL
+    #THIS TABLE IS FOR THE LIST OF ACTUAL COMPONENTS IN ELECTROLYTES
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS electrolyte_components (
+        electrolyte_id INT,
+        component_id INT,
+        amount REAL,
+        PRIMARY KEY (electrolyte_id, component_id),
+        FOREIGN KEY (electrolyte_id) REFERENCES electrolytes(id),
+        FOREIGN KEY (component_id) REFERENCES components(id)
+    );
+            ''')
+    #THIS TABLE IS FOR THE LIST OF ACTUAL ELECTROLYTES THINK ABOUT REMOVING FORMULA
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS electrolytes (
+        id INTEGER PRIMARY KEY,
+        conductivity REAL,
+        conduct_uncert_bound REAL,
+        concent_uncert_bound REAL,
+
+        density REAL,
+        temperature REAL,
+        viscosity REAL,
+        v_window_low_bound REAL,
+        v_window_high_bound REAL,
+        surface_tension REAL
+    );
+    ''')
+    _verify_columns(conn, 'components', 'electrolyte_components', 'electrolytes')
+
+    #CANONICAL FINGERPRINT OF EACH ELECTROLYTE'S COMPOSITION, FOR DUPLICATE DETECTION
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS electrolyte_fingerprints (
+        electrolyte_id INTEGER PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        FOREIGN KEY (electrolyte_id) REFERENCES electrolytes(id)
+    );
+    ''')
+    _verify_columns(conn, 'electrolyte_fingerprints')
+    _index(conn, 'idx_electrolyte_fingerprints_fingerprint', 'electrolyte_fingerprints', ('fingerprint',))
+
+    #ONE INDEX PER PROPERTY FOR RANGE FILTERS AND SORTING IN GET /electrolytes (THE ROWID IS IMPLICITLY THE LAST KEY)
+    for column in BASELINE_COLUMNS['electrolytes'][1:]:
+        _index(conn, f'idx_electrolytes_{column}', 'electrolytes', (column,))
+    #ELEMENT COUNTS OF EVERY COMPONENT (INVERTED INDEX FOR ELEMENT SEARCHES), FILLED FROM THE PARSED FORMULA
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS component_elements (
+        component_id INTEGER,
+        element TEXT,
+        count INTEGER,
+        PRIMARY KEY (component_id, element),
+        FOREIGN KEY (component_id) REFERENCES components(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    ''')
+    _verify_columns(conn, 'component_elements')
+    _index(conn, 'idx_component_elements_element_count', 'component_elements', ('element', 'count'))
+    #COMPONENT FILTERS (WHICH ELECTROLYTES CONTAIN A COMPONENT) ARE INDEXED BY MIGRATION 3
+
+    #BUMPED ON EVERY CHANGE TO components, SO THE IN-PROCESS CATALOG CACHE (catalog.py) KNOWS WHEN TO RELOAD
+    c.execute('CREATE TABLE IF NOT EXISTS components_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)')
+    _verify_columns(conn, 'components_version')
+    c.execute('INSERT OR IGNORE INTO components_version (id, version) VALUES (0, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        _trigger(conn, f'components_version_{event.lower()}', f'''AFTER {event} ON components
+        BEGIN
+            UPDATE components_version SET version = version + 1;
+        END;
+        ''')
+
+    #MATERIALIZED COST OF EACH ELECTROLYTE (SEE costs.py), ROWS ARE DELETED BY THE TRIGGERS BELOW WHEN THEIR INPUTS CHANGE
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS electrolyte_costs (
+        electrolyte_id INTEGER PRIMARY KEY,
+        cost REAL,
+        salt_moles REAL,
+        complete INTEGER,
+        FOREIGN KEY (electrolyte_id) REFERENCES electrolytes(id) ON DELETE CASCADE
+    );
+    ''')
+    _verify_columns(conn, 'electrolyte_costs')
+    _trigger(conn, 'electrolyte_costs_component_update', '''AFTER UPDATE OF price, molar_mass, is_salt ON components
+    BEGIN
+        DELETE FROM electrolyte_costs WHERE electrolyte_id IN (SELECT electrolyte_id FROM electrolyte_components WHERE component_id = NEW.id);
+    END;
+    ''')
+    _trigger(conn, 'electrolyte_costs_insert', '''AFTER INSERT ON electrolyte_components
+    BEGIN
+        DELETE FROM electrolyte_costs WHERE electrolyte_id = NEW.electrolyte_id;
+    END;
+    ''')
+    _trigger(conn, 'electrolyte_costs_update', '''AFTER UPDATE ON electrolyte_components
+    BEGIN
+        DELETE FROM electrolyte_costs WHERE electrolyte_id IN (OLD.electrolyte_id, NEW.electrolyte_id);
+    END;
+    ''')
+    _trigger(conn, 'electrolyte_costs_delete', '''AFTER DELETE ON electrolyte_components
+    BEGIN
+        DELETE FROM electrolyte_costs WHERE electrolyte_id = OLD.electrolyte_id;
+    END;
+    ''')
+
+def _unique_formulas(conn):
+    '''
+    merges components that share a formula into the lowest id (an electrolyte listing several of them gets one
+    row with the amounts added up), then makes formulas unique so lookups by formula are an index search.
+    '''
+    duplicates = conn.execute('''SELECT formula, MIN(id) FROM components
+                                WHERE formula IS NOT NULL GROUP BY formula HAVING COUNT(*) > 1''').fetchall()
+    for formula, keep in duplicates:
+        ids = [row[0] for row in conn.execute('SELECT id FROM components WHERE formula = ?', (formula,))]
+        others = [component_id for component_id in ids if component_id != keep]
+        ids_sql, others_sql = ', '.join('?' * len(ids)), ', '.join('?' * len(others))
+        merged = conn.execute(f'''SELECT electrolyte_id, SUM(amount) FROM electrolyte_components
+                                  WHERE component_id IN ({ids_sql}) GROUP BY electrolyte_id''', ids).fetchall()
+        # fingerprints of merged electrolytes are stale; bootstrap's backfill recomputes them
+        conn.execute(f'''DELETE FROM electrolyte_fingerprints WHERE electrolyte_id IN
+                        (SELECT electrolyte_id FROM electrolyte_components WHERE component_id IN ({others_sql}))''', others)
+        conn.execute(f'DELETE FROM electrolyte_components WHERE component_id IN ({ids_sql})', ids)
+        conn.executemany('INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)',
+                         [(electrolyte_id, keep, amount) for electrolyte_id, amount in merged])
+        conn.execute(f'DELETE FROM component_elements WHERE component_id IN ({others_sql})', others)
+        conn.execute(f'DELETE FROM components WHERE id IN ({others_sql})', others)
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_components_formula ON components (formula)')
+
+def _cost_dirty_list(conn):
+    '''
+    the cost triggers also record which electrolytes they invalidated in electrolyte_costs_dirty, so costs.refresh
+    finds its work with an index read instead of an anti-join over every electrolyte, and only takes the write
+    lock when there is some. New electrolytes go on the list too, they may have no components to trigger on.
+    '''
+    conn.execute('CREATE TABLE IF NOT EXISTS electrolyte_costs_dirty (electrolyte_id INTEGER PRIMARY KEY)')
+    conn.execute('''INSERT OR IGNORE INTO electrolyte_costs_dirty (electrolyte_id)
+                    SELECT id FROM electrolytes WHERE id NOT IN (SELECT electrolyte_id FROM electrolyte_costs)''')
+    triggers = {
+        'electrolyte_costs_component_update': ('AFTER UPDATE OF price, molar_mass, is_salt ON components',
+                                               'SELECT electrolyte_id FROM electrolyte_components WHERE component_id = NEW.id'),
+        'electrolyte_costs_insert': ('AFTER INSERT ON electrolyte_components', 'SELECT NEW.electrolyte_id'),
+        'electrolyte_costs_update': ('AFTER UPDATE ON electrolyte_components', 'VALUES (OLD.electrolyte_id), (NEW.electrolyte_id)'),
+        'electrolyte_costs_delete': ('AFTER DELETE ON electrolyte_components', 'SELECT OLD.electrolyte_id'),
+    }
+    for name, (event, affected) in triggers.items():
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute(f'''
+        CREATE TRIGGER {name} {event}
+        BEGIN
+            DELETE FROM electrolyte_costs WHERE electrolyte_id IN ({affected});
+            INSERT OR IGNORE INTO electrolyte_costs_dirty (electrolyte_id) {affected};
+        END;
+        ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS electrolyte_costs_new AFTER INSERT ON electrolytes
+    BEGIN
+        INSERT OR IGNORE INTO electrolyte_costs_dirty (electrolyte_id) VALUES (NEW.id);
+    END;
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS electrolyte_costs_removed AFTER DELETE ON electrolytes
+    BEGIN
+        DELETE FROM electrolyte_costs_dirty WHERE electrolyte_id = OLD.id;
+    END;
+    ''')
+
+def _skip_costs_of_new_electrolytes(conn):
+    '''
+    an electrolyte with no row in electrolyte_costs is already on the dirty list (electrolyte_costs_new put it
+    there, or the trigger that deleted its row did), so electrolyte_costs_insert only has work when a row exists.
+    That leaves out every component row of a new electrolyte, which is most of what bulk inserts write.
+    '''
+    _trigger(conn, 'electrolyte_costs_insert', '''AFTER INSERT ON electrolyte_components
+    WHEN EXISTS (SELECT 1 FROM electrolyte_costs WHERE electrolyte_id = NEW.electrolyte_id)
+    BEGIN
+        DELETE FROM electrolyte_costs WHERE electrolyte_id = NEW.electrolyte_id;
+        INSERT OR IGNORE INTO electrolyte_costs_dirty (electrolyte_id) VALUES (NEW.electrolyte_id);
+    END;
+    ''')
+
+# (version, description, fn(conn) or list of statements); append only
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline),
+    (2, 'unique components.formula', _unique_formulas),
+    (3, 'index electrolyte_components on (component_id, amount)', [
+        'CREATE INDEX IF NOT EXISTS idx_electrolyte_components_component_id_amount ON electrolyte_components (component_id, amount)',
+        'DROP INDEX IF EXISTS idx_electrolyte_components_component_id', # a prefix of the new one
+    ]),
+    (4, 'list of electrolytes whose costs need recomputing', _cost_dirty_list),
+    (5, 'cost invalidation skips component rows of new electrolytes', _skip_costs_of_new_electrolytes),
+]
+LATEST = MIGRATIONS[-1][0]
+
+def version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db_path, logger=None):
+    '''
+    brings the database at db_path up to LATEST. returns (version before, version after). raises RuntimeError
+    for a database from newer code than this.
+    '''
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        before = version(conn)
+        if before > LATEST:
+            raise RuntimeError(f'{db_path} is at schema version {before}, newer than this code ({LATEST})')
+        for number, description, step in MIGRATIONS:
+            with transaction(conn, immediate=True):
+                if version(conn) >= number: # read under the write lock: another worker may have just applied it
+                    continue
+                if callable(step):
+                    step(conn)
+                else:
+                    for sql in step:
+                        conn.execute(sql)
+                conn.execute(f'PRAGMA user_version = {int(number)}')
+            if logger is not None:
+                logger.info(f'Applied schema migration {number}: {description}')
+        return before, version(conn)
+    finally:
+        conn.close()
+
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)')
+
+def query_plan(conn, sql, parameters=()):
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+
+def full_scans(conn, queries):
+    '''
+    queries: {name: (statement, example parameters)}
+    returns {name: [plan lines]} for every one whose plan scans a table (or a whole index) instead of searching it.
+    '''
+    scans = {}
+    for name, (sql, parameters) in queries.items():
+        lines = [line for line in query_plan(conn, sql, parameters) if FULL_SCAN.match(line)]
+        if lines:
+            scans[name] = lines
+    return scans
@@ -0,0 +1,367 @@
+'''
+Bounded execution of ad-hoc SQL for /execute_sql/. Queries run on read-only connections, under a wall-clock
+time budget enforced from inside SQLite (progress handler), and never return more than max_rows rows in total.
+Results come back a page at a time with a continuation cursor, or as NDJSON. Writing is a separate,
+explicitly privileged call.
+'''
+
+import base64
+import hashlib
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from database import ConnectionPool, READ_ONLY_PRAGMAS
+
+PROGRESS_STEPS = 10000 # SQLite VM instructions between time budget checks
+SKIP_CHUNK = 1000
+LAYOUTS = ('rows', 'columns')
+STORAGE_CLASSES = {int: 'integer', float: 'real', str: 'text', bytes: 'blob'}
+# the only pragmas ad-hoc reads may run: schema introspection, which takes a table or index name, and settings
+# that can be read but never assigned
+INTROSPECTION_PRAGMAS = {'table_info', 'table_xinfo', 'index_list', 'index_info', 'index_xinfo', 'foreign_key_list',
+                         'integrity_check', 'quick_check'}
+READABLE_PRAGMAS = {'table_list', 'database_list', 'collation_list', 'function_list', 'module_list', 'pragma_list',
+                    'compile_options', 'user_version', 'schema_version', 'data_version', 'application_id', 'encoding',
+                    'page_size', 'page_count', 'freelist_count', 'journal_mode', 'foreign_keys', 'query_only'}
+
+class QueryError(Exception):
+    '''
+    the statement can't be run (syntax, write on the read-only path, over budget, bad cursor...);
+    status_code is what the endpoint should answer with.
+    '''
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class _Budget:
+    '''
+    seconds SQLite may spend on one request, possibly spread over several fetches; time spent outside
+    (ex: waiting on a slow client between NDJSON chunks) doesn't count.
+    '''
+    def __init__(self, conn, seconds):
+        self.conn = conn
+        self.seconds = seconds
+        self.remaining = seconds
+        self.deadline = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        self.deadline = self.started + self.remaining
+        self.conn.set_progress_handler(lambda: time.monotonic() > self.deadline, PROGRESS_STEPS)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.set_progress_handler(None, 0)
+        self.remaining -= time.monotonic() - self.started
+        if isinstance(exc, sqlite3.OperationalError) and 'interrupted' in str(exc):
+            raise QueryError(f'Query exceeded its {self.seconds:g}s time budget', 408) from exc
+        if isinstance(exc, sqlite3.Error):
+            raise QueryError(str(exc)) from exc
+
+def _authorize(action, arg1, arg2, db_name, trigger):
+    '''
+    authorizer for the read pool's connections. mode=ro and query_only stop writes to the open database, but
+    not ATTACH (or VACUUM INTO, which attaches its target): either creates files, and an attached database is
+    writable once query_only is turned off. So no attaching, and no pragma that could turn it off.
+    '''
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA:
+        name = arg1.lower()
+        if name in INTROSPECTION_PRAGMAS or (name in READABLE_PRAGMAS and arg2 is None):
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+def _lock_down(conn):
+    conn.set_authorizer(_authorize)
+    conn.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, 0)
+
+def _jsonable(row):
+    return [value.hex() if isinstance(value, bytes) else value for value in row]
+
+def _columns(cursor):
+    return [column[0] for column in cursor.description] if cursor.description else []
+
+def _storage_class(values):
+    # SQLite has no declared type for an expression, so go by the first value that isn't NULL
+    for value in values:
+        if value is not None:
+            return STORAGE_CLASSES.get(type(value), 'text')
+    return 'null'
+
+class _OpenCursor:
+    __slots__ = ('conn', 'cursor', 'pending', 'expires')
+
+    def __init__(self, conn, cursor, pending, expires):
+        self.conn = conn
+        self.cursor = cursor
+        self.pending = pending # row read ahead to find out whether there was another page
+        self.expires = expires
+
+class QueryService:
+    '''
+    page(sql, cursor=None, page_size=None) -> {"columns", "rows", "row_offset", "next_cursor", "truncated", "query_id"}
+    page(sql, ..., layout='columns') -> {"columns": [{"name", "type"}, ...], "data", "row_count", "row_offset", ...}
+    stream(sql) -> iterator of NDJSON lines
+    execute_write(sql) -> same shape as page(), plus "rowcount"
+    statement(query_id) -> the sql of a recent page(), so clients can refer to it instead of sending it again
+
+    Cursors for unfinished results are kept open in a small LRU (max_open_cursors, cursor_ttl seconds), so the
+    next page continues where the last one stopped. If a cursor was evicted, the query is simply re-run and the
+    rows before the offset skipped, so continuation tokens never go stale, only slower. An open cursor holds a
+    read transaction, which keeps WAL checkpoints from getting past it, so the TTL is short and expire() should be
+    called every few seconds to close the ones nobody came back for.
+    '''
+    def __init__(self, db_path, write_pool, max_rows=10000, page_size=500, max_page_size=5000, time_budget=5.0,
+                 max_streams=4, max_open_cursors=4, cursor_ttl=15.0, cached_statements=256, known_statements=256,
+                 factory=sqlite3.Connection):
+        self.write_pool = write_pool
+        self.max_rows = max_rows
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.time_budget = time_budget
+        self.max_open_cursors = max_open_cursors
+        self.cursor_ttl = cursor_ttl
+        # open cursors and NDJSON streams (the caller keeps at most max_streams going) each hold a connection
+        # between requests; the rest are for running pages
+        self.read_pool = ConnectionPool(f'file:{db_path}?mode=ro', max_size=max_open_cursors + max_streams + 4, uri=True,
+                                        pragmas=READ_ONLY_PRAGMAS, cached_statements=cached_statements, factory=factory,
+                                        setup=_lock_down)
+        self._open = OrderedDict()
+        self.known_statements = known_statements
+        self._statements = OrderedDict() # query_id -> sql, least recently used first
+        self._lock = threading.Lock()
+
+    # continuation tokens: which query, how far in, and which open cursor (if it's still around)
+    @staticmethod
+    def _hash(sql):
+        return hashlib.sha1(sql.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _encode(query_hash, offset, key):
+        return base64.urlsafe_b64encode(json.dumps([query_hash, offset, key]).encode()).decode()
+
+    @staticmethod
+    def _decode(token):
+        try:
+            query_hash, offset, key = json.loads(base64.urlsafe_b64decode(token.encode()))
+            return str(query_hash), int(offset), str(key)
+        except (ValueError, TypeError):
+            raise QueryError('Invalid cursor') from None
+
+    def _remember(self, query_id, sql):
+        with self._lock:
+            self._statements[query_id] = sql
+            self._statements.move_to_end(query_id)
+            while len(self._statements) > self.known_statements:
+                self._statements.popitem(last=False)
+
+    def statement(self, query_id=None, cursor=None):
+        '''
+        the sql of query_id, or of the query cursor continues. raises QueryError (404) once it's been forgotten
+        (least recently used, or from before a restart): the client sends the statement again.
+        '''
+        if query_id is None:
+            if not cursor:
+                raise QueryError('Give the query_id of a statement, or a cursor')
+            query_id = self._decode(cursor)[0]
+        with self._lock:
+            sql = self._statements.get(query_id)
+            if sql is not None:
+                self._statements.move_to_end(query_id)
+        if sql is None:
+            raise QueryError('Unknown or expired query_id, send the statement again', 404)
+        return sql
+
+    def _close(self, entry):
+        entry.cursor.close()
+        self.read_pool.release(entry.conn)
+
+    def _take(self, key):
+        with self._lock:
+            entry = self._open.pop(key, None)
+        if entry is not None and entry.expires < time.monotonic():
+            self._close(entry)
+            entry = None
+        return entry
+
+    def _expired(self):
+        # under self._lock
+        now = time.monotonic()
+        return [self._open.pop(key) for key, entry in list(self._open.items()) if entry.expires < now]
+
+    def expire(self):
+        '''
+        closes the open cursors past their TTL, ending their read transactions. returns how many.
+        '''
+        with self._lock:
+            expired = self._expired()
+        for entry in expired:
+            self._close(entry)
+        return len(expired)
+
+    def _keep(self, entry):
+        key = secrets.token_urlsafe(8)
+        with self._lock:
+            evicted = self._expired()
+            while len(self._open) >= self.max_open_cursors:
+                evicted.append(self._open.popitem(last=False)[1])
+            self._open[key] = entry
+        for old in evicted:
+            self._close(old)
+        return key
+
+    def _execute(self, conn, budget, sql, offset=0):
+        cursor = conn.cursor()
+        with budget:
+            cursor.execute(sql)
+            remaining = offset
+            while remaining:
+                skipped = cursor.fetchmany(min(remaining, SKIP_CHUNK))
+                if not skipped:
+                    break
+                remaining -= len(skipped)
+        return cursor
+
+    def page(self, sql, cursor=None, page_size=None, layout='rows'):
+        '''
+        layout='columns' returns the page column-major instead: "data" holds one array per column (no brackets
+        and separators per row, so it's smaller on the wire) and each column comes with the SQLite storage class
+        of its values on this page (integer, real, text, blob, or null when they all are).
+        '''
+        sql = sql.strip()
+        if not sql:
+            raise QueryError('Empty query')
+        if layout not in LAYOUTS:
+            raise QueryError(f"Unknown layout {layout}; choose from {', '.join(LAYOUTS)}")
+        query_hash = self._hash(sql)
+        self._remember(query_hash, sql)
+        page_size = max(1, min(page_size or self.page_size, self.max_page_size))
+
+        offset, entry = 0, None
+        if cursor:
+            token_hash, offset, key = self._decode(cursor)
+            if token_hash != query_hash:
+                raise QueryError('Cursor belongs to a different query')
+            entry = self._take(key)
+
+        if entry is None:
+            conn = self.read_pool.acquire()
+            budget = _Budget(conn, self.time_budget)
+            try:
+                entry = _OpenCursor(conn, self._execute(conn, budget, sql, offset), [], 0)
+            except BaseException:
+                self.read_pool.release(conn)
+                raise
+        else:
+            budget = _Budget(entry.conn, self.time_budget)
+
+        limit = max(0, min(page_size, self.max_rows - offset))
+        try:
+            rows = entry.pending
+            with budget:
+                rows += entry.cursor.fetchmany(limit + 1 - len(rows))
+        except BaseException:
+            self._close(entry)
+            raise
+
+        columns = _columns(entry.cursor)
+        more = len(rows) > limit
+        entry.pending = rows[limit:]
+        rows = rows[:limit]
+        next_offset = offset + len(rows)
+        next_cursor = None
+        if more and next_offset < self.max_rows:
+            entry.expires = time.monotonic() + self.cursor_ttl
+            next_cursor = self._encode(query_hash, next_offset, self._keep(entry))
+        else:
+            self._close(entry)
+
+        if layout == 'columns':
+            data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+            body = {"columns": [{"name": name, "type": _storage_class(values)} for name, values in zip(columns, data)],
+                    "data": [_jsonable(values) for values in data], "row_count": len(rows)}
+        else:
+            body = {"columns": columns, "rows": [_jsonable(row) for row in rows]}
+        return {
+            **body,
+            "row_offset": offset,
+            "next_cursor": next_cursor,
+            "truncated": more and next_offset >= self.max_rows,
+            "query_id": query_hash,
+        }
+
+    def stream(self, sql, chunk_rows=SKIP_CHUNK):
+        '''
+        runs the statement right away (so errors surface before any response is sent) and returns an iterator of
+        NDJSON lines: {"columns": [...]}, then one JSON array per row, then {"row_count": n, "truncated": bool}.
+        '''
+        sql = sql.strip()
+        if not sql:
+            raise QueryError('Empty query')
+        conn = self.read_pool.acquire()
+        budget = _Budget(conn, self.time_budget)
+        try:
+            cursor = self._execute(conn, budget, sql)
+        except BaseException:
+            self.read_pool.release(conn)
+            raise
+
+        def lines():
+            count, truncated = 0, False
+            try:
+                yield b''
+                yield (json.dumps({"columns": _columns(cursor)}) + '\n').encode()
+                while count < self.max_rows:
+                    with budget:
+                        rows = cursor.fetchmany(min(chunk_rows, self.max_rows - count))
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield ''.join(json.dumps(_jsonable(row)) + '\n' for row in rows).encode()
+                else:
+                    with budget:
+                        truncated = cursor.fetchone() is not None
+                yield (json.dumps({"row_count": count, "truncated": truncated}) + '\n').encode()
+            except QueryError as e:
+                yield (json.dumps({"error": e.args[0], "row_count": count}) + '\n').encode()
+            finally:
+                cursor.close()
+                self.read_pool.release(conn)
+        started = lines()
+        next(started) # into the try, so closing or collecting it before the first line still releases conn
+        return started
+
+    def execute_write(self, sql):
+        '''
+        privileged: runs the statement in a write transaction on the main pool, same time budget and row cap.
+        '''
+        sql = sql.strip()
+        if not sql:
+            raise QueryError('Empty query')
+        with self.write_pool.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            with _Budget(conn, self.time_budget):
+                cursor.execute(sql)
+                rows = cursor.fetchmany(self.max_rows + 1) if cursor.description else []
+            return {
+                "columns": _columns(cursor),
+                "rows": [_jsonable(row) for row in rows[:self.max_rows]],
+                "row_offset": 0,
+                "next_cursor": None,
+                "truncated": len(rows) > self.max_rows,
+                "rowcount": cursor.rowcount,
+            }
+
+    def close(self):
+        with self._lock:
+            entries = list(self._open.values())
+            self._open.clear()
+        for entry in entries:
+            self._close(entry)
+        self.read_pool.close()
@@ -0,0 +1,216 @@
+'''
+Property range queries over electrolytes, for GET /electrolytes. Every property column has its own index (see
+migrations.py), so a min/max filter or a sort on one of them is an index range scan rather than a table
+scan. Pages are keyset (seek) pages: the continuation cursor holds the sort value and id of the last row sent,
+and the next page starts right after it in the index, so page 100 costs the same as page 1.
+
+Element searches ("Li>=1, F>=6, Cl=0") go through component_elements, an inverted index of component id ->
+element counts kept next to the components table, so they never re-parse formulas.
+'''
+
+import base64
+import json
+import re
+
+MAX_LIMIT = 500
+DEFAULT_LIMIT = 50
+
+ELEMENT_CONSTRAINT = re.compile(r'^\s*([A-Z][a-z]?)\s*(>=|<=|!=|=|>|<)\s*(\d+)\s*$')
+# whether an element that isn't there at all (count 0) satisfies "element <op> n"
+ADMITS_ZERO = {
+    '=': lambda n: n == 0,
+    '!=': lambda n: n != 0,
+    '>=': lambda n: n <= 0,
+    '>': lambda n: False,
+    '<=': lambda n: True,
+    '<': lambda n: n > 0,
+}
+
+# electrolyte id, formula, amount of every component of the electrolytes listed in {}
+COMPOSITIONS = '''SELECT ec.electrolyte_id, c.formula, ec.amount
+                  FROM electrolyte_components ec
+                  JOIN components c ON ec.component_id = c.id
+                  WHERE ec.electrolyte_id IN ({})'''
+# the condition on electrolytes for component_ids
+HAS_COMPONENT = 'id IN (SELECT electrolyte_id FROM electrolyte_components WHERE component_id = ?)'
+# the ids having a component_elements row for an element with a count meeting {}, per table
+ELEMENT_MATCHES = {
+    'components': 'SELECT ce.component_id FROM component_elements ce WHERE ce.element = ? AND {}',
+    'electrolytes': '''SELECT ec.electrolyte_id FROM component_elements ce
+                       JOIN electrolyte_components ec ON ec.component_id = ce.component_id
+                       WHERE ce.element = ? AND {}''',
+}
+
+def _encode(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def _decode(token, sort, descending):
+    try:
+        order, nulls, value, last_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        nulls, value, last_id = bool(nulls), (None if value is None else float(value)), int(last_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor') from None
+    if order != [sort, descending]:
+        raise ValueError('Cursor belongs to a different sort order')
+    return nulls, value, last_id
+
+def components_of(conn, electrolyte_ids):
+    '''
+    electrolyte id -> {formula: amount} for all of electrolyte_ids in one join, instead of one
+    get_components_by_id call per electrolyte.
+    '''
+    components = {electrolyte_id: {} for electrolyte_id in electrolyte_ids}
+    if not components:
+        return components
+    rows = conn.execute(COMPOSITIONS.format(", ".join("?" * len(components))), list(components))
+    for electrolyte_id, formula, amount in rows:
+        components[electrolyte_id][formula] = amount
+    return components
+
+def page_sql(properties, conditions, order):
+    '''
+    the statement for one page of search_electrolytes; its last parameter is the row limit.
+    '''
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+    return f'SELECT id, {", ".join(properties)} FROM electrolytes{where} ORDER BY {order} LIMIT ?'
+
+def search_electrolytes(conn, properties, ranges=None, component_ids=(), sort='id', descending=False,
+                        limit=DEFAULT_LIMIT, cursor=None):
+    '''
+    properties: the electrolytes columns that may be filtered/sorted on (names go into SQL, only these get through)
+    ranges: {property: (min or None, max or None)}, bounds inclusive
+    component_ids: only electrolytes containing all of these components
+    sort: 'id' or one of properties; rows without a value for the sort property come after all the others
+    returns {"electrolytes": [{"id", <properties>, "components": {formula: amount}}, ...], "next_cursor": token or None}
+    raises ValueError on unknown names or a bad cursor.
+    '''
+    if sort != 'id' and sort not in properties:
+        raise ValueError(f"Can't sort by {sort}; choose from id, {', '.join(properties)}")
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+
+    where, args = [], []
+    for name, (low, high) in (ranges or {}).items():
+        if name not in properties:
+            raise ValueError(f"Unknown property {name}")
+        if low is not None:
+            where.append(f'{name} >= ?')
+            args.append(low)
+        if high is not None:
+            where.append(f'{name} <= ?')
+            args.append(high)
+    for component_id in component_ids:
+        where.append(HAS_COMPONENT)
+        args.append(component_id)
+
+    nulls, value, last_id = _decode(cursor, sort, descending) if cursor else (False, None, None)
+    direction, seek = ('DESC', '<') if descending else ('ASC', '>')
+
+    def page(conditions, conditions_args, order, wanted):
+        return conn.execute(page_sql(properties, where + conditions, order), args + conditions_args + [wanted]).fetchall()
+
+    # read one row past the page to know whether there is a next one
+    if sort == 'id':
+        rows = page([f'id {seek} ?'] if last_id is not None else [], [last_id] if last_id is not None else [],
+                    f'id {direction}', limit + 1)
+    else:
+        rows = []
+        if not nulls:
+            # (sort, id) row value comparison: one seek into the (sort, rowid) index
+            rows = page([f'{sort} IS NOT NULL'] + ([f'({sort}, id) {seek} (?, ?)'] if last_id is not None else []),
+                        [value, last_id] if last_id is not None else [], f'{sort} {direction}, id {direction}', limit + 1)
+        if len(rows) <= limit:
+            resume = nulls and last_id is not None
+            rows += page([f'{sort} IS NULL'] + ([f'id {seek} ?'] if resume else []), [last_id] if resume else [],
+                         f'id {direction}', limit + 1 - len(rows))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = dict(zip(('id',) + tuple(properties), rows[-1]))
+        last_value = None if sort == 'id' else last[sort]
+        next_cursor = _encode([[sort, descending], sort != 'id' and last_value is None, last_value, last['id']])
+
+    components = components_of(conn, [row[0] for row in rows])
+    return {
+        "electrolytes": [{**dict(zip(('id',) + tuple(properties), row)), "components": components[row[0]]} for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+def index_elements(conn, components):
+    '''
+    (re)writes component_elements for components, an iterable of (component_id, ((element, count), ...)) as
+    returned by Chemical.compile_formula. Runs in the caller's transaction.
+    '''
+    components = list(components)
+    conn.executemany('DELETE FROM component_elements WHERE component_id = ?', [(component_id,) for component_id, _ in components])
+    conn.executemany('INSERT INTO component_elements (component_id, element, count) VALUES (?, ?, ?)',
+                     [(component_id, element, count) for component_id, parsed in components for element, count in parsed])
+
+def parse_element_constraints(text, elements):
+    '''
+    "Li>=1, F>=6, Cl=0" -> [('Li', '>=', 1), ('F', '>=', 6), ('Cl', '=', 0)]; operators are = != >= > <= <.
+    raises ValueError on anything else, or on symbols that aren't in elements.
+    '''
+    constraints = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        match = ELEMENT_CONSTRAINT.match(part)
+        if not match:
+            raise ValueError(f"Can't read element constraint {part.strip()!r}, expected ex: Li>=1")
+        element, op, count = match.groups()
+        if element not in elements:
+            raise ValueError(f"Unknown element {element}")
+        constraints.append((element, op, int(count)))
+    if not constraints:
+        raise ValueError('No element constraints given')
+    return constraints
+
+def _element_conditions(constraints, matching):
+    '''
+    one IN / NOT IN clause per constraint. matching is the ELEMENT_MATCHES subquery listing the ids that have a
+    component_elements row for the element meeting a condition. A constraint that count 0 fails ("Li>=1") needs such a row;
+    one that count 0 meets ("Cl=0", "Cl<2") only rules out rows that break it, so elements that aren't there pass.
+    '''
+    where, args = [], []
+    for element, op, count in constraints:
+        if ADMITS_ZERO[op](count):
+            where.append(f'id NOT IN ({matching.format(f"NOT (ce.count {op} ?)")})')
+        else:
+            where.append(f'id IN ({matching.format(f"ce.count {op} ?")})')
+        args += [element, count]
+    return where, args
+
+def element_queries(constraints):
+    '''
+    {table: (sql, parameters but the row limit)} for the components and the electrolytes meeting constraints.
+    '''
+    queries = {}
+    for table, columns in (('components', 'id, formula'), ('electrolytes', 'id')):
+        where, args = _element_conditions(constraints, ELEMENT_MATCHES[table])
+        queries[table] = (f'SELECT {columns} FROM {table} WHERE {" AND ".join(where)} ORDER BY id LIMIT ?', args)
+    return queries
+
+def element_search(conn, constraints, limit=MAX_LIMIT):
+    '''
+    components whose formula meets every constraint, and electrolytes that do when their components are taken
+    together: an element that must be present has to be in at least one component with the required count, one
+    that must be absent (or below a count) can't break the constraint in any of them. Each is one SQL query,
+    driven by the (element, count) index.
+    returns {"components": [{"id", "formula"}], "electrolytes": [{"id", "components"}], "truncated": bool}
+    '''
+    limit = max(1, min(limit or MAX_LIMIT, MAX_LIMIT))
+    queries = element_queries(constraints)
+    sql, args = queries['components']
+    components = conn.execute(sql, args + [limit + 1]).fetchall()
+    sql, args = queries['electrolytes']
+    electrolyte_ids = [row[0] for row in conn.execute(sql, args + [limit + 1])]
+
+    truncated = len(components) > limit or len(electrolyte_ids) > limit
+    electrolyte_ids = electrolyte_ids[:limit]
+    electrolyte_components = components_of(conn, electrolyte_ids)
+    return {
+        "components": [{"id": component_id, "formula": formula} for component_id, formula in components[:limit]],
+        "electrolytes": [{"id": electrolyte_id, "components": electrolyte_components[electrolyte_id]} for electrolyte_id in electrolyte_ids],
+        "truncated": truncated,
+    }
@@ -0,0 +1,151 @@
+'''
+Nearest-neighbour search over electrolyte compositions. Every electrolyte is a row of a dense
+electrolytes x components matrix, amounts normalized to fractions of the row total (salts are entered in g and
+solvents in mL, so this is a fraction of "stuff", not a mole or mass fraction). The matrix lives in memory, is
+built from electrolyte_components on first use and then kept current by add()/remove() from the write helpers;
+anything that writes behind their back (workbook uploads, SQL write mode) calls invalidate() instead.
+'''
+
+import threading
+
+METRICS = ('cosine', 'l1')
+
+class CompositionIndex:
+    '''
+    index = CompositionIndex(pool)
+    index.nearest({"Cl2Ca": .75, "H6C4O3": 3}, k=5, metric='cosine') -> [(electrolyte_id, distance), ...]
+    index.add(electrolyte_id, {formula: amount}) / index.remove(electrolyte_id) after committing
+
+    formulas are matched as given, so pass canonical ones (what the components table holds).
+    '''
+    def __init__(self, pool, initial_rows=1024, initial_columns=64):
+        self.pool = pool
+        self.initial_rows = initial_rows
+        self.initial_columns = initial_columns
+        self._lock = threading.Lock()
+        self._built = False
+        self._stale = False # set without the lock, which a rebuild holds for as long as it takes
+
+    def _reset(self):
+        import numpy as np
+
+        self._matrix = np.zeros((self.initial_rows, self.initial_columns)) # capacity, grown by doubling
+        self._norms = np.zeros(self.initial_rows) # L2 norm of each normalized row, for cosine
+        self._ids = np.zeros(self.initial_rows, dtype=np.int64)
+        self._rows = {} # electrolyte id -> row
+        self._columns = {} # formula -> column
+
+    def _column(self, formula):
+        import numpy as np
+
+        column = self._columns.get(formula)
+        if column is None:
+            column = self._columns[formula] = len(self._columns)
+            if column >= self._matrix.shape[1]:
+                grown = np.zeros((self._matrix.shape[0], self._matrix.shape[1] * 2))
+                grown[:, :self._matrix.shape[1]] = self._matrix
+                self._matrix = grown
+        return column
+
+    def _put(self, electrolyte_id, components):
+        import numpy as np
+
+        row = self._rows.get(electrolyte_id)
+        if row is None:
+            row = self._rows[electrolyte_id] = len(self._rows)
+            if row >= self._matrix.shape[0]:
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+                self._norms = np.concatenate([self._norms, np.zeros_like(self._norms)])
+                self._ids = np.concatenate([self._ids, np.zeros_like(self._ids)])
+        columns = [self._column(formula) for formula in components]
+        self._matrix[row] = 0
+        total = sum(components.values())
+        if total > 0:
+            self._matrix[row, columns] = [amount / total for amount in components.values()]
+        self._norms[row] = np.linalg.norm(self._matrix[row])
+        self._ids[row] = electrolyte_id
+
+    def _build(self):
+        self._reset()
+        compositions = {}
+        with self.pool.connection() as conn:
+            for electrolyte_id, formula, amount in conn.execute('''SELECT ec.electrolyte_id, c.formula, ec.amount
+                                                                  FROM electrolyte_components ec
+                                                                  JOIN components c ON ec.component_id = c.id'''):
+                compositions.setdefault(electrolyte_id, {})[formula] = amount or 0
+        for electrolyte_id, components in compositions.items():
+            self._put(electrolyte_id, components)
+        self._built = True
+
+    def add(self, electrolyte_id, components):
+        '''
+        inserts or replaces one electrolyte's row; a no-op until the index is first built, which reads it anyway.
+        '''
+        with self._lock:
+            if self._built:
+                self._put(electrolyte_id, components)
+
+    def remove(self, electrolyte_id):
+        with self._lock:
+            if not self._built or electrolyte_id not in self._rows:
+                return
+            # move the last row into the hole, so live rows stay contiguous
+            row, last = self._rows.pop(electrolyte_id), len(self._rows)
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._norms[row] = self._norms[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._matrix[last] = 0
+
+    def invalidate(self):
+        '''
+        marks the matrix stale; the next search rebuilds it from the database. Doesn't wait for a search or
+        rebuild in progress, so it's safe to call from the event loop; one already rebuilding leaves it stale.
+        '''
+        self._stale = True
+
+    def nearest(self, components, k=10, metric='cosine'):
+        '''
+        components: {formula: amount}, normalized the same way as the stored rows. Components no electrolyte uses
+        have no column; they still count towards the query's norm (cosine) and its distance to every row (l1).
+        returns up to k (electrolyte_id, distance) pairs, closest first.
+        '''
+        import numpy as np
+
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric}; choose from {', '.join(METRICS)}")
+        total = sum(components.values())
+        if total <= 0:
+            raise ValueError('Amounts must add up to more than 0')
+        with self._lock: # build and search on one consistent matrix
+            if self._stale or not self._built:
+                self._stale = False # before reading, so an invalidate() during the build still counts
+                self._build()
+            n = len(self._rows)
+            if n == 0:
+                return []
+            matrix = self._matrix[:n]
+            query = np.zeros(matrix.shape[1])
+            unmatched = []
+            for formula, amount in components.items():
+                if formula in self._columns:
+                    query[self._columns[formula]] = amount / total
+                else:
+                    unmatched.append(amount / total)
+
+            if metric == 'cosine':
+                norm = np.sqrt(query @ query + sum(fraction ** 2 for fraction in unmatched))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    distances = 1 - (matrix @ query) / (self._norms[:n] * norm)
+                distances = np.maximum(np.nan_to_num(distances, nan=1.0), 0) # empty rows count as unrelated; no -1e-16 for exact matches
+            else:
+                distances = np.abs(matrix - query).sum(axis=1) + sum(unmatched)
+            ids = self._ids[:n].copy()
+
+        k = max(0, min(k, n))
+        if k == 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k] # top-k without sorting everything
+        nearest = nearest[np.lexsort((ids[nearest], distances[nearest]))]
+        return [(int(ids[i]), float(distances[i])) for i in nearest]
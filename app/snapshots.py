@@ -0,0 +1,142 @@
+'''
+Periodic snapshots of the database into history/. A snapshot is only taken when something was committed since
+the last one; the copy itself is SQLite's online backup (consistent, and cheap next to rendering a workbook),
+the xlsx and columnar (Arrow, see columnar.py) renderings are optional and made from that copy, and old
+snapshots are thinned out by a retention policy.
+'''
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import columnar
+import export
+
+TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+# kind, time, extension; ex: experiment_db_<time>.sqlite, table_<time>.xlsx, columnar_wide_<time>.arrow
+SNAPSHOT_NAME = re.compile(r'^(experiment_db|table|columnar_\w+?)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.(sqlite|xlsx|arrow)$')
+
+def backup(src, path):
+    '''
+    consistent copy of the database behind connection src into a new file at path, via the online backup API.
+    '''
+    dest = sqlite3.connect(path)
+    try:
+        src.backup(dest)
+        dest.execute('PRAGMA journal_mode=DELETE') # self-contained file, no -wal/-shm next to it
+    finally:
+        dest.close()
+
+def render_xlsx(db_path, tables, xlsx_path):
+    '''
+    one sheet per table, read from a (backup) database file rather than the live one.
+    '''
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        plan = export.plan_export(conn, tables)
+        export.write_xlsx(conn, plan, xlsx_path)
+    finally:
+        conn.close()
+
+def render_columnar(db_path, tables, properties, directory, stamp):
+    '''
+    one memory-mappable Arrow file per table plus the wide table, read from a (backup) database file.
+    '''
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        for table in list(tables) + [columnar.WIDE]:
+            columnar.export(conn, table, properties, os.path.join(directory, f'columnar_{table}_{stamp}.arrow'))
+    finally:
+        conn.close()
+
+def render(backup_path, tables, properties=(), xlsx=True, columnar=False):
+    '''
+    the xlsx and/or Arrow renderings of a backup made by Snapshotter.run, next to it and with its time stamp.
+    '''
+    directory, name = os.path.split(backup_path)
+    stamp = SNAPSHOT_NAME.match(name).group(2)
+    if xlsx:
+        render_xlsx(backup_path, tables, os.path.join(directory, f'table_{stamp}.xlsx'))
+    if columnar:
+        render_columnar(backup_path, tables, properties, directory, stamp)
+
+def prune(directory, now, hourly=timedelta(days=1), daily=timedelta(days=30)):
+    '''
+    retention: every snapshot younger than hourly is kept, then only the newest one of each day until daily,
+    everything older is deleted. Each kind of file (the backup, the workbook, each columnar table) is thinned
+    independently; files that don't look like snapshots are never touched. returns the deleted paths.
+    '''
+    snapshots = {}
+    for name in os.listdir(directory):
+        match = SNAPSHOT_NAME.match(name)
+        if match:
+            taken = datetime.strptime(match.group(2), TIME_FORMAT)
+            snapshots.setdefault((match.group(1), match.group(3)), []).append((taken, name))
+
+    deleted = []
+    for entries in snapshots.values():
+        kept_days = set()
+        for taken, name in sorted(entries, reverse=True):
+            age = now - taken
+            if age <= hourly:
+                continue
+            if age <= daily and taken.date() not in kept_days:
+                kept_days.add(taken.date())
+                continue
+            path = os.path.join(directory, name)
+            os.remove(path)
+            deleted.append(path)
+    return deleted
+
+class Snapshotter:
+    '''
+    Keeps its own read-only connection to the database; PRAGMA data_version on that connection changes whenever
+    any other connection commits, which is how run() knows whether there is anything new to snapshot.
+    Blocking, call it off the event loop.
+    '''
+    def __init__(self, db_path, directory, tables, xlsx=True, hourly=timedelta(days=1), daily=timedelta(days=30),
+                 columnar=False, properties=()):
+        self.db_path = db_path
+        self.directory = directory
+        self.tables = tables
+        self.xlsx = xlsx
+        self.columnar = columnar
+        self.properties = properties # electrolyte property columns for the wide table
+        self.hourly = hourly
+        self.daily = daily
+        self._conn = None
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        return self._conn
+
+    def run(self, force=False):
+        '''
+        takes a snapshot if the database changed since the last one (or force), then prunes.
+        returns the path of the new backup, or None if it was skipped.
+        '''
+        with self._lock:
+            conn = self._connection()
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            now = datetime.now()
+            path = None
+            if force or data_version != self._data_version:
+                os.makedirs(self.directory, exist_ok=True)
+                stamp = now.strftime(TIME_FORMAT)
+                path = os.path.join(self.directory, f'experiment_db_{stamp}.sqlite')
+                backup(conn, path)
+                render(path, self.tables, self.properties, self.xlsx, self.columnar)
+                self._data_version = data_version
+            prune(self.directory, now, self.hourly, self.daily)
+            return path
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-python3 -c 'from test import start_server; start_server()'
+# the schema and the fingerprint/element backfills run inside the app at startup, see main.bootstrap
 chmod -R 777 db
 uvicorn main:app --host 0.0.0.0 --port 8000
 echo 'start.sh run'
@@ -11,57 +11,15 @@ from fastapi.responses import RedirectResponse
 
 from urllib.parse import quote
 
-DB = 'db/experiment_db.sqlite'
-
-def start_server():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-
-    #THIS DATABASE IS A LOOKUP TABLE FOR COMPONENTS
-    #NEEDS STRICT CONVENTIONS FOR FORMULA FORMATTING
-    c.execute('''
-            CREATE TABLE IF NOT EXISTS components
-            (
-            id INTEGER PRIMARY KEY,
-            formula TEXT,
-            notes TEXT,
-            molar_mass REAL,
-            price REAL,
-            is_salt INTEGER
-            );
-            ''')
+from migrations import migrate
 
-    #NEEDS SPECIFICATION FOR DECIMAL
-    #THIS TABLE IS FOR THE LIST OF ACTUAL COMPONENTS IN ELECTROLYTES
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS electrolyte_components (
-        electrolyte_id INT,
-        component_id INT,
-        amount REAL,
-        PRIMARY KEY (electrolyte_id, component_id),
-        FOREIGN KEY (electrolyte_id) REFERENCES electrolytes(id),
-        FOREIGN KEY (component_id) REFERENCES components(id)
-    );
-            ''')
-    #THIS TABLE IS FOR THE LIST OF ACTUAL ELECTROLYTES THINK ABOUT REMOVING FORMULA
-
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS electrolytes (
-        id INTEGER PRIMARY KEY,
-        conductivity REAL,
-        conduct_uncert_bound REAL,
-        concent_uncert_bound REAL,
+DB = 'db/experiment_db.sqlite'
 
-        density REAL,
-        temperature REAL,
-        viscosity REAL,
-        v_window_low_bound REAL,
-        v_window_high_bound REAL,
-        surface_tension REAL
-    );
-    ''')
-    conn.commit()
-    conn.close()
+def start_server(db=DB):
+    '''
+    creates or upgrades the schema; it is versioned now, see migrations.py.
+    '''
+    migrate(db)
 
 '''
 dimethyl_formamide = Chemical('(CH3)2NCH',0,.0277)#$/ml
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from conftest import add_components
+
+def electrolyte_rows(main):
+    with main.pool.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM electrolytes').fetchone()[0]
+
+def test_add_electrolyte_returns_its_id(app_db):
+    ids = add_components(app_db, 'CaCl2', 'C4H6O3')
+    electrolyte_id = app_db.add_electrolyte({'CaCl2': 0.75, 'C4H6O3': 3.0}, 12.5, 0.1, 0.2, temperature=25.0)
+    assert app_db.get_components_by_id(electrolyte_id) == {'Cl2Ca': 0.75, 'H6C4O3': 3.0}
+    assert app_db.get_electrolyte_by_components({'C4H6O3': 3, 'Ca(Cl)2': 0.75}) == electrolyte_id
+    with app_db.pool.connection() as conn:
+        assert conn.execute('SELECT conductivity, temperature FROM electrolytes WHERE id = ?', (electrolyte_id,)).fetchone() == (12.5, 25.0)
+        assert conn.execute('SELECT component_id FROM electrolyte_components WHERE electrolyte_id = ? ORDER BY 1',
+                            (electrolyte_id,)).fetchall() == sorted([(ids['Cl2Ca'],), (ids['H6C4O3'],)])
+
+def test_duplicates_and_unknown_components_are_refused(app_db):
+    add_components(app_db, 'CaCl2', 'C4H6O3')
+    app_db.add_electrolyte({'CaCl2': 1.0, 'C4H6O3': 2.0}, 1.0, 0.1, 0.1)
+    with pytest.raises(ValueError, match='already exists'):
+        app_db.add_electrolyte({'C4H6O3': 2, 'CaCl2': 1}, 9.0, 0.1, 0.1)
+    with pytest.raises(ValueError, match='Unknown component LiPF6'):
+        app_db.add_electrolyte({'LiPF6': 1.0}, 1.0, 0.1, 0.1)
+    assert electrolyte_rows(app_db) == 1
+
+def test_formulas_for_the_same_component_are_refused(app_db, client):
+    add_components(app_db, 'LiPF6', 'C4H6O3')
+    with pytest.raises(ValueError, match='more than once'):
+        app_db.add_electrolyte({'LiPF6': 1.0, 'F6PLi': 2.0, 'C4H6O3': 3.0}, 1.0, 0.1, 0.1)
+    form = {'component_types': 'LiPF6 F6PLi', 'amounts': '1 2', 'conductivity': 1.0, 'conduct_uncert_bound': 0.1,
+            'concent_uncert_bound': 0.1}
+    redirect = client.post('/input_electrolyte/', data=form, follow_redirects=False)
+    assert 'Success' not in redirect.headers['location']
+    assert electrolyte_rows(app_db) == 0
+
+def test_a_failed_insert_leaves_nothing_behind(app_db):
+    add_components(app_db, 'CaCl2')
+    with app_db.pool.transaction() as conn:
+        conn.execute('''CREATE TRIGGER refuse_fingerprints BEFORE INSERT ON electrolyte_fingerprints
+                        BEGIN SELECT RAISE(ABORT, 'refused'); END''')
+    try:
+        assert app_db.add_electrolyte({'CaCl2': 1.0}, 1.0, 0.1, 0.1) is None # the last of the four statements fails
+    finally:
+        with app_db.pool.transaction() as conn:
+            conn.execute('DROP TRIGGER IF EXISTS refuse_fingerprints')
+    assert electrolyte_rows(app_db) == 0
+    with app_db.pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM electrolyte_components').fetchone()[0] == 0
+
+def test_concurrent_submissions_insert_once(app_db, monkeypatch):
+    add_components(app_db, 'CaCl2', 'C4H6O3')
+    monkeypatch.setattr(app_db.pool, 'guard', None) # plain threads stand in for the executor's
+    inserted, refused = [], []
+    start = threading.Barrier(8)
+
+    def submit():
+        start.wait()
+        try:
+            inserted.append(app_db.add_electrolyte({'CaCl2': 1.0, 'C4H6O3': 2.0}, 1.0, 0.1, 0.1))
+        except ValueError:
+            refused.append(True)
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(inserted) == 1 and inserted[0] is not None
+    assert len(refused) == 7
+    assert electrolyte_rows(app_db) == 1
+
+def test_batch_statuses(app_db, client):
+    add_components(app_db, 'CaCl2', 'C4H6O3', 'LiPF6')
+    stored = app_db.add_electrolyte({'CaCl2': 1.0}, 1.0, 0.1, 0.1)
+    row = {'conductivity': 1.0, 'conduct_uncert_bound': 0.1, 'concent_uncert_bound': 0.1}
+    batch = [
+        {'components': {'LiPF6': 1.0, 'C4H6O3': 3.0}, **row},
+        {'components': {'C4H6O3': 3, 'F6PLi': 1}, **row}, # the row above, spelled differently
+        {'components': {'Ca(Cl)2': 1.0}, **row}, # already stored
+        {'components': {'Xx2': 1.0}, **row},
+        {'components': {'LiPF6': 1.0, 'F6PLi': 2.0}, **row},
+        {'components': {'LiBF4': 1.0}, **row},
+    ]
+    response = client.post('/electrolytes/batch', json=batch)
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [result['status'] for result in results] == ['inserted', 'duplicate', 'duplicate', 'rejected', 'rejected', 'rejected']
+    assert results[1]['id'] == results[0]['id'] and results[2]['id'] == stored
+    assert 'Unknown element Xx' in results[3]['detail']
+    assert 'more than once' in results[4]['detail']
+    assert 'LiBF4' in results[5]['detail']
+    assert app_db.get_components_by_id(results[0]['id']) == {'LiF6P': 1.0, 'H6C4O3': 3.0}
+    assert electrolyte_rows(app_db) == 2
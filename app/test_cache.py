@@ -0,0 +1,73 @@
+import sqlite3
+
+from cache import ResponseCache
+from conftest import add_components
+
+def test_commits_from_any_connection_move_the_version(db_path):
+    cache = ResponseCache(db_path)
+    try:
+        version = cache.version()
+        cache.put('key', version, b'body')
+        assert cache.get('key', cache.version()) == b'body'
+        etag = cache.etag('key', version)
+
+        other = sqlite3.connect(db_path, isolation_level=None) # not the app's, so only data_version can tell
+        other.execute("INSERT INTO components (formula) VALUES ('Cl2Ca')")
+        other.close()
+        assert cache.version() != version
+        assert cache.get('key', cache.version()) is None
+        assert cache.etag('key', cache.version()) != etag
+
+        # a body computed from before the commit isn't stored under the new version
+        cache.put('key', version, b'stale')
+        assert cache.stats()['entries'] == 0
+    finally:
+        cache.close()
+
+def test_size_bounded_lru(db_path):
+    cache = ResponseCache(db_path, max_bytes=10, max_entry_bytes=6)
+    try:
+        version = cache.version()
+        cache.put('a', version, b'aaaa')
+        cache.put('b', version, b'bbbb')
+        assert cache.get('a', version) == b'aaaa' # now b is the least recently used
+        cache.put('c', version, b'cccc')
+        assert cache.get('b', version) is None
+        assert cache.get('a', version) == b'aaaa' and cache.get('c', version) == b'cccc'
+        cache.put('d', version, b'ddddddd') # over max_entry_bytes, never stored
+        assert cache.get('d', version) is None
+        assert cache.stats()['bytes'] == 8
+        cache.invalidate()
+        assert cache.get('a', cache.version()) is None
+    finally:
+        cache.close()
+
+def test_if_none_match_uses_weak_comparison(db_path):
+    cache = ResponseCache(db_path)
+    try:
+        etag = cache.etag('key', cache.version())
+        assert cache.matches(f'"other", W/{etag}', etag)
+        assert cache.matches('*', etag)
+        assert not cache.matches('"other"', etag)
+        assert not cache.matches(None, etag)
+        assert cache.stats()['not_modified'] == 2
+    finally:
+        cache.close()
+
+def test_downloads_revalidate_until_a_write(client, app_db):
+    add_components(app_db, 'CaCl2')
+    params = {'format': 'xlsx', 'tables': 'components'}
+    first = client.get('/download_excel/', params=params)
+    assert first.status_code == 200
+    etag = first.headers['etag']
+    assert etag.startswith('W/')
+
+    revalidated = client.get('/download_excel/', params=params, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['etag'] == etag
+
+    add_components(app_db, 'LiPF6') # any write helper
+    changed = client.get('/download_excel/', params=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
+    assert changed.content != first.content
@@ -0,0 +1,44 @@
+import pytest
+
+from main import Chemical
+
+def column(element):
+    return Chemical.ELEMENT_NUMBERS[element] - 1
+
+def test_chemical_has_no_instance_dict():
+    chemical = Chemical('Ca(Cl)2', notes='salt', price=1.5, is_salt=True)
+    assert not hasattr(chemical, '__dict__')
+    with pytest.raises(AttributeError):
+        chemical.colour = 'white'
+    assert str(chemical) == 'Cl2Ca'
+    assert chemical.elements == {'Cl': 2, 'Ca': 1}
+    assert chemical == Chemical('CaCl2')
+
+def test_vectors_are_indexed_by_atomic_number():
+    vector = Chemical('LiPF6').vector
+    assert vector.shape == (Chemical.N_ELEMENTS,)
+    assert vector[column('Li')] == 1 and vector[column('P')] == 1 and vector[column('F')] == 6
+    assert vector.sum() == 8
+    with pytest.raises(ValueError):
+        vector[0] = 1 # shared through the cache, so read-only
+
+def test_element_matrix_matches_the_vectors():
+    formulas = ['CaCl2', 'C4H6O3', 'LiPF6', 'Al2(SO4)3']
+    matrix = Chemical.element_matrix(formulas)
+    assert matrix.shape == (4, Chemical.N_ELEMENTS)
+    for row, formula in zip(matrix, formulas):
+        assert (row == Chemical(formula).vector).all()
+    assert matrix[3, column('O')] == 12
+    assert list(matrix[:, column('F')] > 0) == [False, False, True, False]
+    assert Chemical.molar_masses(formulas) == pytest.approx([Chemical.molar_mass_of(formula) for formula in formulas])
+
+def test_bad_formulas_are_refused():
+    for formula in ('Xx2', 'Ca(Cl2', 'CaCl)2', 'Ca-Cl'):
+        with pytest.raises(TypeError):
+            Chemical(formula)
+
+def test_nested_groups_and_repeated_elements():
+    parse = Chemical.compile_formula.__wrapped__ # the parser itself, not a cached result
+    assert parse('CH3(CH2)2OH') == ((('H', 8), ('C', 3), ('O', 1)), 'H8C3O')
+    assert parse('K4(Fe(CN)6)') == ((('C', 6), ('N', 6), ('K', 4), ('Fe', 1)), 'C6N6K4Fe')
+    assert parse('Ca(Cl)2') == parse('CaCl2')
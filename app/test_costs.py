@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+import costs
+from conftest import add_components
+
+def dirty(main):
+    with main.pool.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT electrolyte_id FROM electrolyte_costs_dirty ORDER BY 1')]
+
+def test_costs_follow_writes(app_db):
+    ids = add_components(app_db, 'CaCl2', 'C4H6O3', 'LiPF6')
+    first = app_db.add_electrolyte({'CaCl2': 2.0, 'C4H6O3': 10.0}, 1.0, 0.1, 0.1)
+    second = app_db.add_electrolyte({'LiPF6': 1.0, 'C4H6O3': 10.0}, 1.0, 0.1, 0.1)
+    assert dirty(app_db) == [first, second]
+
+    rows = {row['id']: row for row in app_db.electrolyte_costs(0, 100)}
+    assert rows[first]['cost'] == pytest.approx(2.0 * 1.0 + 10.0 * 2.0)
+    assert rows[second]['cost'] == pytest.approx(1.0 * 3.0 + 10.0 * 2.0)
+    assert dirty(app_db) == []
+
+    # a price change puts exactly the electrolytes that use the component back on the list
+    with app_db.pool.transaction() as conn:
+        conn.execute('UPDATE components SET price = 5.0 WHERE id = ?', (ids['Cl2Ca'],))
+    assert dirty(app_db) == [first]
+    rows = {row['id']: row for row in app_db.electrolyte_costs(0, 100)}
+    assert rows[first]['cost'] == pytest.approx(2.0 * 5.0 + 10.0 * 2.0)
+
+    app_db.remove_electrolyte_by_id(second)
+    assert [row['id'] for row in app_db.electrolyte_costs(0, 100)] == [first]
+    assert dirty(app_db) == []
+
+def test_components_added_later_invalidate_the_cost(app_db):
+    ids = add_components(app_db, 'CaCl2', 'C4H6O3')
+    electrolyte_id = app_db.add_electrolyte({'CaCl2': 2.0}, 1.0, 0.1, 0.1)
+    assert [row['cost'] for row in app_db.electrolyte_costs(0, 100)] == [pytest.approx(2.0)]
+    with app_db.pool.transaction() as conn: # behind the helpers' back, like an upload
+        conn.execute('INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, 10.0)',
+                     (electrolyte_id, ids['H6C4O3']))
+    assert dirty(app_db) == [electrolyte_id]
+    assert [row['cost'] for row in app_db.electrolyte_costs(0, 100)] == [pytest.approx(2.0 + 10.0 * 2.0)]
+
+def test_refresh_without_work_never_takes_the_write_lock(app_db):
+    add_components(app_db, 'CaCl2')
+    app_db.add_electrolyte({'CaCl2': 1.0}, 1.0, 0.1, 0.1)
+    app_db.electrolyte_costs(0, 100)
+
+    writer = sqlite3.connect(app_db.DB, isolation_level=None)
+    reader = sqlite3.connect(app_db.DB, isolation_level=None, timeout=0)
+    try:
+        writer.execute('BEGIN IMMEDIATE')
+        assert costs.refresh(reader) == 0 # would be "database is locked" if it asked for the lock
+        writer.execute('INSERT INTO electrolytes (conductivity) VALUES (1.0)')
+        writer.execute('COMMIT')
+        assert costs.refresh(reader) == 1
+    finally:
+        writer.close()
+        reader.close()
+
+def test_refresh_drains_in_chunks(app_db):
+    add_components(app_db, 'CaCl2')
+    for amount in range(1, 8):
+        app_db.add_electrolyte({'CaCl2': float(amount)}, 1.0, 0.1, 0.1)
+    with app_db.pool.connection() as conn:
+        assert costs.refresh(conn, chunk_electrolytes=3) == 7
+    assert dirty(app_db) == []
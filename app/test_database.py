@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+def test_server_pool_refuses_threads_it_was_not_sized_for(client, app_db):
+    assert app_db.pool.guard is app_db.executor_only
+    errors = []
+
+    def outside():
+        try:
+            with app_db.pool.connection():
+                pass
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=outside)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1 and 'not a DatabaseExecutor thread' in str(errors[0])
+
+    # executor threads and the main thread are what it was sized for
+    assert client.get('/electrolytes').status_code == 200
+    with app_db.pool.connection() as conn:
+        assert conn.execute('SELECT 1').fetchone() == (1,)
+
+def test_every_pool_consumer_fits(client, app_db):
+    # requests that touch the database from every path at once, more of them than there are connections
+    results, lock = [], threading.Lock()
+
+    def get(path):
+        status = client.get(path).status_code
+        with lock:
+            results.append((path, status))
+    paths = ['/electrolytes', '/electrolytes/costs', '/components/cache', '/download_excel/?format=csv&tables=components',
+             '/download_excel/?format=ndjson'] * 4
+    threads = [threading.Thread(target=get, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for path, status in results:
+        # only streamed downloads may be turned away, and then with a 503, not a pool timeout
+        assert status == 200 or (status == 503 and path.startswith('/download_excel/'))
+
+@pytest.mark.parametrize('size', [1, 3])
+def test_pool_never_opens_more_than_max_size(tmp_path, size):
+    from database import ConnectionPool
+
+    pool = ConnectionPool(str(tmp_path / 'db.sqlite'), max_size=size, timeout=0.1)
+    held = [pool.acquire() for _ in range(size)]
+    with pytest.raises(Exception, match='No database connection available'):
+        pool.acquire()
+    for conn in held:
+        pool.release(conn)
+    pool.close()
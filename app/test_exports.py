@@ -0,0 +1,45 @@
+import gc
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import add_components
+
+def csv_stream(main):
+    with main.pool.connection() as conn:
+        plan = main.export.plan_export(conn, main.TABLES, 'components', None)
+    main._take_stream_slot()
+    return main._slotted(main._stream_export(main.export.stream_csv, plan))
+
+def test_stalled_downloads_leave_the_main_pool_alone(client, app_db):
+    ids = add_components(app_db, 'CaCl2', 'C4H6O3')
+    app_db.add_electrolyte({'CaCl2': 1.0, 'C4H6O3': 2.0}, 1.0, 0.1, 0.1)
+
+    # every slot taken by a download whose client stopped reading after the first chunk
+    streams = [csv_stream(app_db) for _ in range(app_db.EXPORT_STREAMS)]
+    for stream in streams:
+        assert next(stream).startswith(b'id,formula')
+    with pytest.raises(HTTPException) as refused:
+        app_db._take_stream_slot()
+    assert refused.value.status_code == 503
+    assert client.get('/download_excel/', params={'format': 'csv', 'tables': 'components'}).status_code == 503
+
+    # writes and lookups still get connections right away
+    assert app_db.check_electrolyte_exists({'CaCl2': 1.0, 'C4H6O3': 2.0})
+    assert app_db.add_electrolyte({'CaCl2': 2.0, 'C4H6O3': 2.0}, 1.0, 0.1, 0.1) is not None
+    assert len(ids) == 2
+
+    for stream in streams:
+        stream.close()
+    response = client.get('/download_excel/', params={'format': 'csv', 'tables': 'components'})
+    assert response.status_code == 200
+    assert response.text.count('\n') == 3
+
+def test_unsent_download_frees_its_slot(app_db):
+    add_components(app_db, 'CaCl2')
+    for _ in range(3 * app_db.EXPORT_STREAMS):
+        stream = csv_stream(app_db) # never read, then dropped
+        del stream
+        gc.collect()
+    app_db._take_stream_slot()
+    app_db.stream_slots.release()
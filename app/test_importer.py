@@ -0,0 +1,61 @@
+import io
+
+from openpyxl import Workbook
+
+from conftest import add_components
+
+COMPONENT_HEADER = ('id', 'formula', 'notes', 'molar_mass', 'price', 'is_salt')
+ELECTROLYTE_HEADER = ('id', 'conductivity', 'conduct_uncert_bound', 'concent_uncert_bound')
+
+def workbook(components, electrolytes, electrolyte_components):
+    book = Workbook()
+    book.remove(book.active)
+    for title, header, rows in (('components', COMPONENT_HEADER, components),
+                                ('electrolytes', ELECTROLYTE_HEADER, electrolytes),
+                                ('electrolyte_components', ('electrolyte_id', 'component_id', 'amount'), electrolyte_components)):
+        sheet = book.create_sheet(title)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+    file = io.BytesIO()
+    book.save(file)
+    file.seek(0)
+    return file
+
+def stored_compositions(main):
+    with main.pool.connection() as conn:
+        return conn.execute('''SELECT ec.electrolyte_id, c.formula, ec.amount FROM electrolyte_components ec
+                               JOIN components c ON c.id = ec.component_id ORDER BY 1, 2''').fetchall()
+
+def test_import_remaps_workbook_ids(app_db):
+    add_components(app_db, 'CaCl2')
+    file = workbook([(7, 'LiPF6', None, 151.9, 2.0, 1), (8, 'C4H6O3', None, 102.1, 1.0, 0)],
+                    [(3, 1.5, 0.1, 0.1)],
+                    [(3, 7, 1.0), (3, 8, 2.0)])
+    report = app_db.load_excel(file)
+
+    assert report['components']['inserted'] == 2
+    assert report['electrolytes']['inserted'] == 1
+    assert [(formula, amount) for _, formula, amount in stored_compositions(app_db)] == [('H6C4O3', 2.0), ('LiF6P', 1.0)]
+
+def test_rejected_component_rejects_its_electrolytes(app_db):
+    # database ids 1 and 2 exist; the workbook reuses those numbers for its own components
+    add_components(app_db, 'CaCl2', 'C4H6O3')
+    file = workbook([(1, None, None, None, 1.0, 1), (2, 'LiPF6', None, 151.9, 2.0, 1)],
+                    [(1, 1.5, 0.1, 0.1)],
+                    [(1, 1, 2.0), (1, 2, 1.0)])
+    report = app_db.load_excel(file)
+
+    assert report['components']['rejected'] == 1
+    assert report['electrolytes'] == {'inserted': 0, 'skipped': 0, 'rejected': 1}
+    assert report['electrolyte_components']['rejected'] == 2
+    assert any('which was rejected' in issue['reason'] for issue in report['issues'] if issue['sheet'] == 'electrolytes')
+    assert stored_compositions(app_db) == []
+
+def test_ids_the_sheet_does_not_define_are_database_ids(app_db):
+    ids = add_components(app_db, 'CaCl2', 'C4H6O3')
+    file = workbook([], [(1, 1.5, 0.1, 0.1)], [(1, ids['Cl2Ca'], 0.5), (1, ids['H6C4O3'], 3.0)])
+    report = app_db.load_excel(file)
+
+    assert report['electrolytes']['inserted'] == 1
+    assert [(formula, amount) for _, formula, amount in stored_compositions(app_db)] == [('Cl2Ca', 0.5), ('H6C4O3', 3.0)]
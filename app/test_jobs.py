@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+import jobs
+
+# job functions run in spawned workers, which import them from this module
+
+def crash(job):
+    os._exit(1) # like the OOM killer: no exception, the worker is just gone
+
+def succeed(job, value):
+    return {"value": value}
+
+@pytest.fixture
+def runner(tmp_path):
+    runner = jobs.JobRunner(str(tmp_path / 'jobs'), max_workers=1, max_pending=4)
+    yield runner
+    runner.close()
+
+def wait(runner, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while (job := runner.get(job_id))['status'] not in jobs.FINISHED:
+        assert time.monotonic() < deadline, job
+        time.sleep(.05)
+    return job
+
+def statuses(runner):
+    with runner._lock:
+        return dict(runner._connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+def test_a_dead_worker_does_not_wedge_the_runner(runner):
+    assert wait(runner, runner.submit('crash', crash))['status'] == 'failed'
+    # the pool that lost its worker refuses new work; submit starts another one
+    job_ids = [runner.submit('ok', succeed, i) for i in range(3)]
+    assert [wait(runner, job_id)['result'] for job_id in job_ids] == [{"value": 0}, {"value": 1}, {"value": 2}]
+    assert statuses(runner) == {'failed': 1, 'done': 3}
+
+def test_no_row_is_left_queued_when_no_pool_starts(runner, monkeypatch):
+    class Broken:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def submit(self, *args):
+            raise jobs.BrokenProcessPool('gone')
+
+        def shutdown(self, **kwargs):
+            pass
+
+    monkeypatch.setattr(jobs, 'ProcessPoolExecutor', Broken)
+    for _ in range(runner.max_pending + 1): # stuck rows would turn into TooManyJobs here
+        with pytest.raises(jobs.JobsUnavailable):
+            runner.submit('ok', succeed, 1)
+    assert statuses(runner) == {'failed': runner.max_pending + 1}
+
+def test_endpoints_answer_503_when_workers_are_unavailable(client, app_db, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise jobs.JobsUnavailable('Background workers are unavailable, try again later')
+
+    monkeypatch.setattr(app_db.job_runner, 'submit', unavailable)
+    assert client.get('/download_excel/', params={'background': True}).status_code == 503
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import migrations
+import search
+
+def legacy_database(path, electrolytes=2000, components=300):
+    '''
+    a database as the code before versioning left it: user_version 0, the old component_id index, two
+    components sharing a formula and a few hundred more (alkanes) for solvents.
+    '''
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.executescript('''
+        CREATE TABLE components (id INTEGER PRIMARY KEY, formula TEXT, notes TEXT, molar_mass REAL, price REAL, is_salt INTEGER);
+        CREATE TABLE electrolyte_components (electrolyte_id INT, component_id INT, amount REAL, PRIMARY KEY (electrolyte_id, component_id));
+        CREATE TABLE electrolytes (id INTEGER PRIMARY KEY, conductivity REAL, conduct_uncert_bound REAL, concent_uncert_bound REAL,
+                                   density REAL, temperature REAL, viscosity REAL, v_window_low_bound REAL,
+                                   v_window_high_bound REAL, surface_tension REAL);
+        CREATE INDEX idx_electrolyte_components_component_id ON electrolyte_components (component_id);
+        INSERT INTO components (id, formula, price, is_salt) VALUES (1, 'Cl2Ca', 1.0, 1), (2, 'H6C4O3', 2.0, 0),
+                                                                    (3, 'LiF6P', 3.0, 1), (4, 'Cl2Ca', 1.0, 1);
+    ''')
+    conn.executemany('INSERT INTO components (formula, price, is_salt) VALUES (?, 1.0, 0)',
+                     [(f'H{2 * n + 2}C{n}',) for n in range(1, components + 1)])
+    conn.executemany('INSERT INTO electrolytes (id, conductivity) VALUES (?, ?)',
+                     [(i, None if i % 10 == 0 else float(i)) for i in range(1, electrolytes + 1)])
+    # a salt and a solvent each, solvents spread over the alkanes
+    conn.executemany('INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)',
+                     [(i, component_id, float(i % 7 + 1)) for i in range(1, electrolytes + 1)
+                      for component_id in (1 + i % 3, 5 + i % components)])
+    conn.execute('INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (3, 4, 0.5)')
+    conn.close()
+
+def indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+
+def test_hot_queries_use_indexes(tmp_path):
+    import main
+
+    path = str(tmp_path / 'db.sqlite')
+    legacy_database(path)
+    assert migrations.migrate(path) == (0, migrations.LATEST)
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        formulas = conn.execute('SELECT id, formula FROM components').fetchall()
+        search.index_elements(conn, [(component_id, main.Chemical.compile_formula(formula)[0]) for component_id, formula in formulas])
+        assert migrations.full_scans(conn, main.HOT_QUERIES) == {}
+        conn.execute('ANALYZE') # and with statistics, which can change the planner's mind
+        assert migrations.full_scans(conn, main.HOT_QUERIES) == {}
+    finally:
+        conn.close()
+
+def test_migrate_adopts_a_legacy_database_once(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    legacy_database(path, electrolytes=5)
+    migrations.migrate(path)
+    assert migrations.migrate(path) == (migrations.LATEST, migrations.LATEST)
+
+    conn = sqlite3.connect(path)
+    try:
+        assert 'idx_electrolyte_components_component_id' not in indexes(conn)
+        assert 'idx_electrolyte_components_component_id_amount' in indexes(conn)
+        # the duplicate formula is merged into the lowest id, amounts added up
+        assert conn.execute('SELECT id FROM components WHERE formula = ?', ('Cl2Ca',)).fetchall() == [(1,)]
+        assert conn.execute('SELECT amount FROM electrolyte_components WHERE electrolyte_id = 3 AND component_id = 1').fetchone() == (4.5,)
+    finally:
+        conn.close()
+
+def test_baseline_refuses_a_table_it_cannot_adopt(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('CREATE TABLE electrolytes (id INTEGER PRIMARY KEY, conductivity REAL)')
+    conn.close()
+
+    with pytest.raises(RuntimeError, match='electrolytes'):
+        migrations.migrate(path)
+    conn = sqlite3.connect(path)
+    try:
+        assert migrations.version(conn) == 0
+        assert 'components' not in {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
@@ -0,0 +1,125 @@
+import sqlite3
+
+import pytest
+
+from database import ConnectionPool
+from conftest import add_components
+from query import QueryError, QueryService
+
+@pytest.fixture
+def service(db_path):
+    write_pool = ConnectionPool(db_path, max_size=2)
+    with write_pool.transaction() as conn:
+        conn.executemany('INSERT INTO electrolytes (id, conductivity) VALUES (?, ?)', [(i, i * 1.5) for i in range(1, 8)])
+    service = QueryService(db_path, write_pool, max_rows=6, page_size=3)
+    yield service
+    service.close()
+    write_pool.close()
+
+def all_pages(service, sql, **kwargs):
+    pages = [service.page(sql, **kwargs)]
+    while pages[-1]['next_cursor']:
+        pages.append(service.page(sql, cursor=pages[-1]['next_cursor'], **kwargs))
+    return pages
+
+def test_pages_continue_up_to_the_row_cap(service):
+    pages = all_pages(service, 'SELECT id FROM electrolytes ORDER BY id')
+    assert [page['row_offset'] for page in pages] == [0, 3]
+    assert [row for page in pages for row in page['rows']] == [[1], [2], [3], [4], [5], [6]]
+    assert pages[0]['columns'] == ['id']
+    assert pages[-1]['truncated'] # a 7th row exists past max_rows
+
+def test_a_closed_cursor_is_rerun_from_its_offset(service):
+    service.cursor_ttl = 0
+    first = service.page('SELECT id FROM electrolytes ORDER BY id', page_size=2)
+    assert service.expire() == 1
+    second = service.page('SELECT id FROM electrolytes ORDER BY id', cursor=first['next_cursor'], page_size=2)
+    assert second['rows'] == [[3], [4]]
+    with pytest.raises(QueryError, match='different query'):
+        service.page('SELECT id FROM electrolytes', cursor=first['next_cursor'])
+
+def test_expired_cursors_release_their_read_transaction(service, db_path):
+    service.cursor_ttl = 0
+    service.page('SELECT id FROM electrolytes ORDER BY id', page_size=1)
+    writer = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        writer.execute('UPDATE electrolytes SET density = 1.0')
+        assert service.expire() == 1
+        busy, _, _ = writer.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        assert busy == 0 # no reader left pinning the WAL
+    finally:
+        writer.close()
+
+def test_reads_are_read_only_and_writes_are_separate(service):
+    with pytest.raises(QueryError, match='readonly'):
+        service.page('DELETE FROM electrolytes')
+    assert service.execute_write('DELETE FROM electrolytes WHERE id > 2')['rowcount'] == 5
+    assert service.page('SELECT COUNT(*) FROM electrolytes')['rows'] == [[2]]
+
+def test_runaway_queries_hit_the_time_budget(service):
+    service.time_budget = 0.05
+    with pytest.raises(QueryError) as error:
+        service.page('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n')
+    assert error.value.status_code == 408
+
+def test_columns_layout(service):
+    page = service.page("SELECT id, conductivity, NULL AS missing, 'x' AS label FROM electrolytes ORDER BY id", layout='columns')
+    assert [column['type'] for column in page['columns']] == ['integer', 'real', 'null', 'text']
+    assert page['data'][0] == [1, 2, 3]
+    assert page['row_count'] == 3
+
+def test_statements_are_referred_to_by_query_id(service):
+    page = service.page('SELECT id FROM electrolytes ORDER BY id')
+    assert service.statement(page['query_id']) == 'SELECT id FROM electrolytes ORDER BY id'
+    assert service.statement(cursor=page['next_cursor']) == 'SELECT id FROM electrolytes ORDER BY id'
+    service.known_statements = 1
+    service.page('SELECT 1')
+    with pytest.raises(QueryError) as forgotten:
+        service.statement(page['query_id'])
+    assert forgotten.value.status_code == 404
+
+def test_console_posts_the_statement_and_gets_the_rest(client, app_db):
+    add_components(app_db, 'CaCl2', 'C4H6O3', 'LiPF6')
+    sql = 'SELECT formula FROM components ORDER BY id'
+    first = client.post('/execute_sql/', data={'sql_query': sql, 'page_size': 2, 'format': 'columns'}).json()
+    assert first['data'] == [['Cl2Ca', 'H6C4O3']]
+
+    rest = client.get('/execute_sql/', params={'cursor': first['next_cursor'], 'page_size': 2, 'format': 'columns'})
+    assert rest.status_code == 200
+    assert rest.json()['data'] == [['LiF6P']]
+
+    again = client.get('/execute_sql/', params={'query_id': first['query_id'], 'page_size': 2, 'format': 'columns'})
+    assert again.json()['data'] == first['data']
+    assert client.get('/execute_sql/', params={'query_id': first['query_id'], 'page_size': 2, 'format': 'columns'},
+                      headers={'If-None-Match': again.headers['etag']}).status_code == 304
+
+    # the statement itself is never taken from the URL
+    assert client.get('/execute_sql/', params={'sql_query': sql}).status_code == 400
+    assert client.get('/execute_sql/', params={'query_id': 'unknown'}).status_code == 404
+
+def test_the_read_path_cannot_attach_or_reconfigure(service, db_path, tmp_path):
+    scratch = tmp_path / 'scratch' # db_path lives in tmp_path too
+    scratch.mkdir()
+    statements = [
+        'PRAGMA query_only=OFF',
+        'PRAGMA journal_mode=DELETE',
+        'PRAGMA writable_schema',
+        f"ATTACH DATABASE '{db_path}' AS rw",
+        f"ATTACH DATABASE '{scratch / 'new.sqlite'}' AS created",
+        f"VACUUM INTO '{scratch / 'copy.sqlite'}'",
+        'UPDATE rw.electrolytes SET conductivity = 999',
+        'DETACH DATABASE rw',
+    ]
+    for sql in statements:
+        with pytest.raises(QueryError) as refused:
+            service.page(sql)
+        assert refused.value.status_code == 400, sql
+    assert list(scratch.iterdir()) == []
+    assert service.page('SELECT MAX(conductivity) FROM electrolytes')['rows'] == [[7 * 1.5]]
+    assert service.page('PRAGMA query_only')['rows'] == [[1]]
+    assert service.page('PRAGMA table_info(electrolytes)')['rows'] # introspection still works
+
+def test_console_refuses_attach(client, app_db, tmp_path):
+    response = client.post('/execute_sql/', data={'sql_query': f"VACUUM INTO '{tmp_path / 'copy.sqlite'}'"})
+    assert response.status_code == 400
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+import search
+from conftest import add_components
+
+PROPERTIES = ('conductivity', 'temperature')
+
+@pytest.fixture
+def conn(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.executemany('INSERT INTO components (id, formula) VALUES (?, ?)', [(1, 'Cl2Ca'), (2, 'H6C4O3'), (3, 'LiF6P')])
+    # every third conductivity is missing, and 4 and 5 share a value
+    conductivities = {1: 3.0, 2: None, 3: 1.0, 4: 2.0, 5: 2.0, 6: None, 7: 5.0, 8: 4.0, 9: None}
+    conn.executemany('INSERT INTO electrolytes (id, conductivity, temperature) VALUES (?, ?, 25.0)', conductivities.items())
+    conn.executemany('INSERT INTO electrolyte_components (electrolyte_id, component_id, amount) VALUES (?, ?, ?)',
+                     [(i, 1 if i % 2 else 3, 1.0) for i in conductivities] + [(i, 2, 10.0) for i in conductivities if i % 3 == 0])
+    yield conn
+    conn.close()
+
+def walk(conn, limit, **kwargs):
+    ids, cursor = [], None
+    while True:
+        page = search.search_electrolytes(conn, PROPERTIES, limit=limit, cursor=cursor, **kwargs)
+        assert len(page['electrolytes']) <= limit
+        ids += [row['id'] for row in page['electrolytes']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 4, 50])
+def test_keyset_pages_cross_into_the_rows_without_a_value(conn, limit):
+    # ties broken by id, NULLs after every value, in either direction
+    assert walk(conn, limit, sort='conductivity') == [3, 4, 5, 1, 8, 7, 2, 6, 9]
+    assert walk(conn, limit, sort='conductivity', descending=True) == [7, 8, 1, 5, 4, 3, 9, 6, 2]
+    assert walk(conn, limit) == list(range(1, 10))
+
+def test_ranges_and_component_filters(conn):
+    page = search.search_electrolytes(conn, PROPERTIES, ranges={'conductivity': (2.0, 4.0)}, sort='conductivity')
+    assert [row['id'] for row in page['electrolytes']] == [4, 5, 1, 8]
+    page = search.search_electrolytes(conn, PROPERTIES, component_ids=[1, 2])
+    assert [row['id'] for row in page['electrolytes']] == [3, 9]
+    assert page['electrolytes'][0]['components'] == {'Cl2Ca': 1.0, 'H6C4O3': 10.0}
+
+def test_bad_requests_are_refused(conn):
+    cursor = search.search_electrolytes(conn, PROPERTIES, sort='conductivity', limit=1)['next_cursor']
+    with pytest.raises(ValueError, match='different sort order'):
+        search.search_electrolytes(conn, PROPERTIES, sort='temperature', cursor=cursor)
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        search.search_electrolytes(conn, PROPERTIES, cursor='not a cursor')
+    with pytest.raises(ValueError, match='Unknown property'):
+        search.search_electrolytes(conn, PROPERTIES, ranges={'price': (1, None)})
+
+def test_element_constraints(app_db):
+    ids = add_components(app_db, 'LiPF6', 'CaCl2', 'C4H6O3', 'LiF', 'AlF3')
+    with_chlorine = app_db.add_electrolyte({'LiPF6': 1.0, 'CaCl2': 1.0}, 1.0, 0.1, 0.1)
+    carbonate = app_db.add_electrolyte({'LiPF6': 1.0, 'C4H6O3': 10.0}, 1.0, 0.1, 0.1)
+    app_db.add_electrolyte({'LiF': 1.0, 'AlF3': 1.0}, 1.0, 0.1, 0.1) # F6 in total, but no one component has it
+
+    constraints = search.parse_element_constraints('Li>=1, F>=6, Cl=0', app_db.Chemical.ELEMENTS)
+    assert constraints == [('Li', '>=', 1), ('F', '>=', 6), ('Cl', '=', 0)]
+    with app_db.pool.connection() as conn:
+        found = search.element_search(conn, constraints)
+        assert found['components'] == [{"id": ids['LiF6P'], "formula": 'LiF6P'}]
+        assert [row['id'] for row in found['electrolytes']] == [carbonate]
+        assert found['electrolytes'][0]['components'] == {'LiF6P': 1.0, 'H6C4O3': 10.0}
+
+        # an absent element passes "< n" and "!= n" constraints
+        found = search.element_search(conn, search.parse_element_constraints('Ca<1, Li!=2', app_db.Chemical.ELEMENTS))
+        assert with_chlorine not in [row['id'] for row in found['electrolytes']]
+        assert {row['formula'] for row in found['components']} == {'LiF6P', 'H6C4O3', 'LiF', 'F3Al'}
+
+def test_element_constraints_are_validated():
+    with pytest.raises(ValueError, match='Unknown element'):
+        search.parse_element_constraints('Xx>=1', ['Li'])
+    with pytest.raises(ValueError, match="Can't read"):
+        search.parse_element_constraints('Li >> 1', ['Li'])
+    with pytest.raises(ValueError, match='No element constraints'):
+        search.parse_element_constraints(' , ', ['Li'])
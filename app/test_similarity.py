@@ -0,0 +1,20 @@
+import threading
+
+from conftest import add_components
+
+def test_invalidate_does_not_wait_for_a_rebuild(app_db):
+    add_components(app_db, 'CaCl2', 'C4H6O3')
+    first = app_db.add_electrolyte({'CaCl2': 1.0, 'C4H6O3': 3.0}, 1.0, 0.1, 0.1)
+    index = app_db.composition_index
+    assert [electrolyte_id for electrolyte_id, _ in index.nearest({'Cl2Ca': 1.0, 'H6C4O3': 3.0})] == [first]
+
+    with app_db.pool.transaction() as conn: # a write behind the helpers' back, like an upload
+        conn.execute('DELETE FROM electrolyte_fingerprints')
+        conn.execute('DELETE FROM electrolyte_components')
+        conn.execute('DELETE FROM electrolytes')
+    with index._lock: # as a search rebuilding the matrix would
+        invalidating = threading.Thread(target=index.invalidate)
+        invalidating.start()
+        invalidating.join(timeout=5)
+        assert not invalidating.is_alive()
+    assert index.nearest({'Cl2Ca': 1.0, 'H6C4O3': 3.0}) == []